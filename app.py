@@ -1,7 +1,6 @@
 import gradio as gr
 import pandas as pd
 from src.preprocessing.data_loader import process_and_load_csv
-from src.profiling.cluster_model import train_user_clusters
 from src.database import get_engine
 
 
@@ -23,6 +22,8 @@ def handle_upload(file):
 
 def handle_profiling(n_clusters):
     """触发 K-means 聚类并展示结果"""
+    # scikit-learn 只在点击分析时加载，界面启动不必等待
+    from src.profiling.cluster_model import train_user_clusters
     success, msg = train_user_clusters(int(n_clusters))
     if success:
         engine = get_engine()
@@ -0,0 +1,163 @@
+"""
+流水线分析查询后端对比：业务库 (sql) vs DuckDB + Parquet 镜像 (duckdb)
+
+用法 (在 backend-python 目录下):
+    python benchmarks/analytics_backend.py --scale 200 --repeat 3
+    DATABASE_URL=mysql+pymysql://... python benchmarks/analytics_backend.py --use-existing
+
+默认把 test.csv 按 --scale 倍复制 (用户 / 商品 ID 加后缀) 写入临时 SQLite 替身库，
+再镜像为 Parquet；--use-existing 直接使用 DATABASE_URL 指向的库中已有的数据 (只读)。
+对每种后端分别计时各阶段的扫描 / 关联部分：
+- features:   特征库的全部聚合查询 (用户特征、商品特征、用户品类亲和度、用户商品得分)
+- rf:         随机森林训练集联查 (行为 x 画像)
+- popularity: 分群热门榜统计
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+CSV_PATH = BACKEND_DIR.parent / "data" / "raw" / "test.csv"
+sys.path.insert(0, str(BACKEND_DIR))
+
+USER_COLS = ['user_id', 'age', 'gender', 'user_level', 'register_days',
+             'total_spend', 'purchase_freq', 'follow_num', 'fans_num']
+ITEM_COLS = ['item_id', 'category', 'price', 'discount_rate',
+             'title_length', 'title_emo_score', 'img_count', 'has_video']
+BEHAVIOR_COLS = ['user_id', 'item_id', 'pv_count', 'add2cart', 'collect_num',
+                 'like_num', 'comment_num', 'share_num', 'coupon_received',
+                 'coupon_used', 'interaction_rate', 'purchase_intent',
+                 'last_click_gap', 'label']
+
+
+def build_tables(scale, seed=42):
+    """按倍数复制样例数据，返回星型模型各表与模拟画像表"""
+    rng = np.random.default_rng(seed)
+    base = pd.read_csv(CSV_PATH)
+    copies = []
+    for k in range(scale):
+        part = base.copy()
+        part['user_id'] = part['user_id'] + f"_{k}"
+        # 商品按 10 份一组复用，保证用户之间存在共同商品
+        part['item_id'] = part['item_id'] + f"_{k % 10}"
+        copies.append(part)
+    df = pd.concat(copies, ignore_index=True)
+
+    dim_user = df[USER_COLS].drop_duplicates('user_id')
+    dim_item = df[ITEM_COLS].drop_duplicates('item_id')
+    persona = pd.DataFrame({
+        'user_id': dim_user['user_id'].values,
+        'cluster_label': rng.integers(0, 4, len(dim_user)),
+        'consumption_level': rng.choice(["低消费", "中消费", "高消费"], len(dim_user)),
+        'preferred_category': rng.choice(dim_item['category'].unique(), len(dim_user)),
+        'is_churn_risk': rng.integers(0, 2, len(dim_user)),
+        'loyalty_score': rng.uniform(0, 100, len(dim_user)),
+        'price_sensitivity': rng.uniform(0, 5, len(dim_user)),
+    })
+    # behavior_id 与业务库的自增主键一致 (随机森林训练查询读取该列作为增量水位线)
+    fact = df[BEHAVIOR_COLS].assign(behavior_id=np.arange(1, len(df) + 1))
+    return {"dim_user": dim_user, "dim_item": dim_item, "fact_user_behavior": fact, "usr_persona": persona}
+
+
+def _timed(func, repeat):
+    samples = []
+    rows = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        samples.append(time.perf_counter() - start)
+    return {"median_s": round(statistics.median(samples), 4), "min_s": round(min(samples), 4), "rows": rows}
+
+
+def run_stages(repeat):
+    from src.analytics import iter_analytics
+    from src.feature_store import compute_features
+    from src.id_dictionary import get_id_dictionary
+    from src.recommendation.rf_ranker import RF_TRAINING_QUERY
+    from src.recommendation.popularity import compute_popularity
+
+    ids = get_id_dictionary()
+
+    def features():
+        tables, _ = compute_features(ids)
+        return sum(len(df) for df in tables.values())
+
+    stages = {
+        "features": features,
+        "rf": lambda: sum(len(chunk) for chunk in iter_analytics(RF_TRAINING_QUERY,
+                                                                  tables=("fact_user_behavior", "usr_persona"))),
+        "popularity": lambda: len(compute_popularity()),
+    }
+    return {name: _timed(func, repeat) for name, func in stages.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="分析查询后端对比")
+    parser.add_argument("--scale", type=int, default=100, help="样例数据复制倍数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--use-existing", action="store_true", help="使用 DATABASE_URL 中已有的数据")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="analytics_bench_")
+    if not args.use_existing:
+        os.environ["DATABASE_URL"] = f"sqlite:///{workdir}/bench.db"
+    os.environ["ANALYTICS_DIR"] = f"{workdir}/analytics"
+    # ID 字典、特征库、模型目录随测试数据重建，不覆盖正式运行目录中的文件
+    os.environ["ID_DICT_PATH"] = f"{workdir}/id_dictionary.npz"
+    os.environ["FEATURE_STORE_DIR"] = f"{workdir}/features"
+    os.environ["RF_MODEL_DIR"] = f"{workdir}/models"
+    os.environ["PIPELINE_MANIFEST"] = f"{workdir}/manifest.json"
+
+    from src import analytics
+    from src.database import get_engine
+
+    engine = get_engine("analytics")
+
+    analytics.set_analytics_backend("duckdb")
+    mirror_seconds = {}
+    if args.use_existing:
+        tables = {name: pd.read_sql(f"SELECT * FROM {name}", engine)
+                  for name in analytics.STAR_SCHEMA_TABLES + ("usr_persona",)}
+    else:
+        tables = build_tables(args.scale)
+        for name, df in tables.items():
+            df.to_sql(name, engine, index=False)
+    for name, df in tables.items():
+        start = time.perf_counter()
+        analytics.mirror_table(name, df)
+        mirror_seconds[name] = round(time.perf_counter() - start, 3)
+
+    report = {
+        "database": engine.url.get_backend_name(),
+        "rows": {name: len(df) for name, df in tables.items()},
+        "mirror_seconds": mirror_seconds,
+        "mirror_bytes": {name: info['bytes'] for name, info in analytics.mirror_status().items()},
+        "backends": {},
+    }
+    for backend in ("sql", "duckdb"):
+        analytics.set_analytics_backend(backend)
+        report["backends"][backend] = run_stages(args.repeat)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"📊 数据规模: {report['rows']} (业务库: {report['database']})")
+    print(f"🦆 镜像耗时: {mirror_seconds}")
+    print(f"{'stage':<12}{'sql (s)':>12}{'duckdb (s)':>12}{'speedup':>10}")
+    for stage in report["backends"]["sql"]:
+        sql_s = report["backends"]["sql"][stage]['median_s']
+        duck_s = report["backends"]["duckdb"][stage]['median_s']
+        print(f"{stage:<12}{sql_s:>12.3f}{duck_s:>12.3f}{sql_s / duck_s if duck_s else 0:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+"""
+接口并发压测 (本地 SQLite 替身库)
+
+用法 (在 backend-python 目录下):
+    python benchmarks/api_load.py --concurrency 32 --requests 2000 --query-delay-ms 5
+    python benchmarks/api_load.py --data synthetic --rows 50k --with-rebuild --out runtime/benchmarks/api_load.json
+    python benchmarks/api_load.py --mode inprocess --requests 500
+
+1. 建库：按 sql/Smart_EComm_Strategy.sql 在临时 SQLite 文件中建表，用样例数据 (test.csv) 或
+   合成数据 (src.preprocessing.synthetic_data) 走一遍真实的入库与全量重构，得到与线上同构的全部表
+2. 启动服务：--mode http 在子进程中以 uvicorn 启动 main.app，经 localhost 请求；
+   --mode inprocess 在当前进程内通过 ASGI 直接调用 main.app (不经过网络栈)
+3. 施压：按固定比例随机请求单用户接口与看板统计接口，分接口统计吞吐与 p50 / p95 / p99 延迟
+4. --with-rebuild 再压测一轮，期间在后台执行全量重构 (与线上一样由任务进程池执行)，
+   请求持续到重构结束 (至少 --requests 个)，对比重构对接口延迟的影响
+
+--query-delay-ms 在每条 SQL 执行前注入固定延迟，模拟真实 MySQL 的网络/查询耗时。
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+CSV_PATH = BACKEND_DIR.parent / "data" / "raw" / "test.csv"
+sys.path.insert(0, str(BACKEND_DIR))
+
+USER_ROUTES = [
+    "/api/recommend/{uid}",
+    "/api/user/detail/{uid}",
+    "/api/recommend/trend/{uid}",
+]
+STATS_ROUTES = [
+    "/api/stats/persona_distribution",
+    "/api/stats/category_ranking",
+    "/api/stats/consumption_levels",
+    "/api/model/metrics",
+    "/api/model/segment_metrics",
+    "/api/model/kmeans_elbow",
+]
+# 单用户接口在请求中的占比
+USER_ROUTE_SHARE = 0.5
+
+
+def configure_workdir(workdir):
+    """
+    压测使用独立的替身库与运行目录，必须在导入 src 模块之前调用
+    流水线写入的全部运行时文件 (含 ID 字典、特征库、随机森林模型目录) 都重定向到 workdir，
+    不会覆盖当前目录下的 runtime/、libs/ 与 temp_uploads/
+    """
+    workdir = Path(workdir)
+    os.environ["DATABASE_URL"] = f"sqlite:///{workdir / 'bench.db'}"
+    for name, sub in (("JOBS_DIR", "jobs"), ("SERVING_DIR", "serving"), ("ANALYTICS_DIR", "analytics"),
+                      ("PROFILE_DIR", "profiles"), ("FEATURE_STORE_DIR", "features"), ("RF_MODEL_DIR", "models"),
+                      ("UPLOAD_DIR", "uploads")):
+        os.environ[name] = str(workdir / sub)
+    for name, filename in (("DATA_VERSION_PATH", "data_version.json"), ("PIPELINE_MANIFEST", "manifest.json"),
+                           ("STAGE_METRICS_PATH", "stage_metrics.json"), ("ID_DICT_PATH", "ids/id_dictionary.npz")):
+        os.environ[name] = str(workdir / filename)
+
+
+def seed_database(csv_path):
+    """建表后以真实的入库与全量重构任务填充替身库，返回全部用户 ID"""
+    from sqlalchemy import text
+    from src.database import create_schema, get_engine
+    from src.jobs import JobManager
+    from src.pipeline import PIPELINE_STAGES
+
+    engine = get_engine("bulk_write")
+    create_schema(engine)
+    # WAL 模式下重构写库期间接口仍可并发读取
+    with engine.connect() as conn:
+        conn.execute(text("PRAGMA journal_mode=WAL"))
+
+    manager = JobManager()
+    try:
+        for kind, params in (("ingest", {"file_path": str(csv_path)}), ("rebuild", {"force": True})):
+            started = time.perf_counter()
+            job, _ = manager.run_inline(kind, params, stages=PIPELINE_STAGES[kind])
+            if job['state'] != "success":
+                raise RuntimeError(f"建库失败 ({kind}): {job.get('error')}")
+            print(f"🌱 {kind} 完成 ({time.perf_counter() - started:.1f}s)")
+    finally:
+        manager.shutdown()
+
+    with engine.connect() as conn:
+        return [row[0] for row in conn.execute(text("SELECT user_id FROM dim_user"))]
+
+
+def inject_query_delay(query_delay_ms):
+    """在每个数据库引擎上注入固定的 SQL 延迟"""
+    if query_delay_ms <= 0:
+        return
+    from sqlalchemy import event
+    from src.database import on_engine_created
+
+    delay = query_delay_ms / 1000.0
+
+    def _inject_delay(*_):
+        time.sleep(delay)
+
+    # 每个负载引擎 (serving / analytics / bulk_write) 创建时都注入延迟
+    on_engine_created(lambda created, _name: event.listen(created, "before_cursor_execute", _inject_delay))
+
+
+def percentile(values, q):
+    return float(np.percentile(values, q)) * 1000 if values else 0.0
+
+
+def summarize(samples, elapsed):
+    """samples: [(route, latency, status)] -> 分接口及总体的吞吐与延迟分位数"""
+    def stats(rows):
+        latencies = [latency for _, latency, _ in rows]
+        return {
+            "requests": len(rows),
+            "errors": sum(1 for _, _, status in rows if status >= 400),
+            "rps": round(len(rows) / elapsed, 1) if elapsed else 0.0,
+            "p50_ms": round(percentile(latencies, 50), 2),
+            "p95_ms": round(percentile(latencies, 95), 2),
+            "p99_ms": round(percentile(latencies, 99), 2),
+        }
+
+    routes = {}
+    for sample in samples:
+        routes.setdefault(sample[0], []).append(sample)
+    return {"elapsed_s": round(elapsed, 2), "overall": stats(samples),
+            "routes": {route: stats(rows) for route, rows in sorted(routes.items())}}
+
+
+async def run_load(client, user_ids, total_requests, concurrency, seed=0, until=None):
+    """
+    并发请求接口
+    :param until: 可选的 asyncio.Event，设置前持续施压 (总数不少于 total_requests)
+    """
+    rng = np.random.default_rng(seed)
+    samples = []
+    issued = 0
+
+    def next_request():
+        if rng.random() < USER_ROUTE_SHARE:
+            template = USER_ROUTES[rng.integers(len(USER_ROUTES))]
+            return template, template.format(uid=user_ids[rng.integers(len(user_ids))])
+        template = STATS_ROUTES[rng.integers(len(STATS_ROUTES))]
+        return template, template
+
+    async def worker():
+        nonlocal issued
+        while issued < total_requests or (until is not None and not until.is_set()):
+            issued += 1
+            template, path = next_request()
+            t0 = time.perf_counter()
+            try:
+                status = (await client.get(path)).status_code
+            except Exception:
+                status = 599
+            samples.append((template, time.perf_counter() - t0, status))
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(samples, time.perf_counter() - started)
+
+
+async def run_with_rebuild(client, user_ids, args):
+    """后台触发全量重构，施压直至重构结束"""
+    body = (await client.post("/api/admin/rebuild-all", params={"force": "true"})).json()
+    if body.get("status") != "success":
+        raise RuntimeError(f"无法启动重构任务: {body}")
+    job_id = body["job_id"]
+    done = asyncio.Event()
+    job_info = {"job_id": job_id}
+
+    async def watch():
+        started = time.perf_counter()
+        while True:
+            job = (await client.get(f"/api/jobs/{job_id}")).json()["data"]
+            if job["state"] in ("success", "failed", "cancelled"):
+                job_info.update(state=job["state"], error=job.get("error"),
+                                duration_s=round(time.perf_counter() - started, 2))
+                done.set()
+                return
+            await asyncio.sleep(0.5)
+
+    watcher = asyncio.create_task(watch())
+    report = await run_load(client, user_ids, args.requests, args.concurrency, seed=1, until=done)
+    await watcher
+    report["rebuild"] = job_info
+    return report
+
+
+async def drive(client_kwargs, user_ids, args):
+    import httpx
+
+    async with httpx.AsyncClient(timeout=120, **client_kwargs) as client:
+        phases = {"baseline": await run_load(client, user_ids, args.requests, args.concurrency)}
+        if args.with_rebuild:
+            phases["rebuild"] = await run_with_rebuild(client, user_ids, args)
+    return phases
+
+
+async def drive_inprocess(user_ids, args):
+    import httpx
+    import main as api
+
+    # ASGI 直连不会触发 lifespan，手动进入以初始化线程池与服务文件
+    async with api.app.router.lifespan_context(api.app):
+        return await drive({"transport": httpx.ASGITransport(app=api.app), "base_url": "http://inprocess"},
+                           user_ids, args)
+
+
+def serve(workdir, port, query_delay_ms):
+    """子进程入口：指向替身库并注入查询延迟后启动 uvicorn"""
+    configure_workdir(workdir)
+    inject_query_delay(query_delay_ms)
+
+    import uvicorn
+    import main as api
+
+    uvicorn.run(api.app, host="127.0.0.1", port=port, log_level="warning")
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_port(port, timeout=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=0.5):
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"服务在 {timeout}s 内未能启动 (端口 {port})")
+
+
+def print_report(report):
+    for phase, result in report["phases"].items():
+        overall = result["overall"]
+        title = (f"\n📊 {phase}: 并发 {report['concurrency']} | 请求 {overall['requests']} | "
+                 f"吞吐 {overall['rps']:.1f} req/s | 错误 {overall['errors']}")
+        if "rebuild" in result:
+            rebuild = result["rebuild"]
+            title += f" | 重构 {rebuild.get('state')} ({rebuild.get('duration_s')}s)"
+        print(title)
+        print(f"{'route':<36}{'req':>7}{'err':>6}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+        for route, row in list(result["routes"].items()) + [("(overall)", overall)]:
+            print(f"{route:<36}{row['requests']:>7}{row['errors']:>6}{row['rps']:>9.1f}"
+                  f"{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="接口并发压测")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--query-delay-ms", type=float, default=5.0, help="每条 SQL 注入的模拟延迟")
+    parser.add_argument("--data", choices=("bundled", "synthetic"), default="bundled",
+                        help="建库数据：样例 test.csv 或合成数据")
+    parser.add_argument("--rows", default="20k", help="合成数据行数 (--data synthetic)")
+    parser.add_argument("--mode", choices=("http", "inprocess"), default="http")
+    parser.add_argument("--with-rebuild", action="store_true", help="追加一轮后台全量重构期间的压测")
+    parser.add_argument("--out", help="JSON 报告输出路径")
+    parser.add_argument("--serve", metavar="WORKDIR", help=argparse.SUPPRESS)
+    parser.add_argument("--port", type=int, default=0, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve(args.serve, args.port, args.query_delay_ms)
+        return
+
+    workdir = Path(tempfile.mkdtemp(prefix="api_load_"))
+    configure_workdir(workdir)
+    csv_path = CSV_PATH
+    if args.data == "synthetic":
+        from src.preprocessing.synthetic_data import parse_size, write_csv
+        csv_path = workdir / "synthetic.csv"
+        write_csv(csv_path, parse_size(args.rows))
+    user_ids = seed_database(csv_path)
+
+    if args.mode == "inprocess":
+        inject_query_delay(args.query_delay_ms)
+        phases = asyncio.run(drive_inprocess(user_ids, args))
+    else:
+        port = _free_port()
+        server = subprocess.Popen(
+            [sys.executable, __file__, "--serve", str(workdir), "--port", str(port),
+             "--query-delay-ms", str(args.query_delay_ms)],
+            cwd=BACKEND_DIR,
+        )
+        try:
+            _wait_for_port(port)
+            limits_kwargs = {"base_url": f"http://127.0.0.1:{port}"}
+            phases = asyncio.run(drive(limits_kwargs, user_ids, args))
+        finally:
+            server.terminate()
+            server.wait()
+
+    report = {"mode": args.mode, "data": args.data, "rows": args.rows if args.data == "synthetic" else None,
+              "users": len(user_ids), "concurrency": args.concurrency, "query_delay_ms": args.query_delay_ms,
+              "phases": phases}
+    print_report(report)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"📝 报告已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,144 @@
+"""
+流水线各阶段工作数据的内存占用：字符串 ID + float64 / int64 (改造前) vs ID 字典 int32 编码 + 紧凑类型 (改造后)
+
+用法 (在 backend-python 目录下，DATABASE_URL 指向已完成入库与一次全量重构的库):
+    python benchmarks/memory_report.py
+    ANALYTICS_BACKEND=duckdb python benchmarks/memory_report.py --json
+
+对每个阶段按阶段代码相同的方式加载工作数据 (特征库表 / 训练集 / 评估真值与推荐结果)，
+与其展开为字符串 ID、float64、int64、object 品类后的等价表示对比 DataFrame 的实际内存
+(memory_usage(deep=True)，含字符串对象)。
+- user_cf 额外列出稠密用户相似度矩阵 (float64 -> float32) 的理论大小
+- rf 的训练集为流式抽样后的训练 + 验证样本；另外构造一个预测分片 (活跃用户的 1/20 x 全部商品) 的笛卡尔积
+  及该分片的用户 x 商品行为计数
+进程级的峰值内存见 benchmarks/scale.py (--compare 对比改造前后的报告)。
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+from src.analytics import read_analytics  # noqa: E402
+from src.feature_store import load_features  # noqa: E402
+from src.id_dictionary import (  # noqa: E402
+    ID_COLUMNS, get_id_dictionary, encode_ids, decode_ids, compact_dtypes, frame_memory)
+
+# 与 rf_ranker 的预测分片数一致
+PREDICT_CHUNKS = 20
+
+
+def _entry(frame, rows, before, after):
+    return {"frame": frame, "rows": rows, "before_bytes": int(before), "after_bytes": int(after)}
+
+
+def _expand(df, ids):
+    """紧凑表示 -> 改造前的表示：字符串 ID、float64、int64、object 品类"""
+    wide = decode_ids(df.copy(), ids)
+    for col in wide.columns:
+        series = wide[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            wide[col] = series.astype(object)
+        elif pd.api.types.is_float_dtype(series):
+            wide[col] = series.astype(np.float64)
+        elif pd.api.types.is_integer_dtype(series) and col not in ID_COLUMNS:
+            wide[col] = series.astype(np.int64)
+    return wide
+
+
+def _compare(frame, df, ids):
+    return _entry(frame, len(df), frame_memory(_expand(df, ids)), frame_memory(df))
+
+
+def persona_report(ids):
+    from src.profiling.cluster_model import PERSONA_FEATURES
+
+    return [_compare("user_features", load_features("user_features", columns=PERSONA_FEATURES), ids)]
+
+
+def user_cf_report(ids):
+    interactions = load_features("interactions")
+    # 改造前：字符串列之外再追加两列 category 编码
+    before = _expand(interactions, ids)
+    before = before.assign(u_cat=before['user_id'].astype('category'), i_cat=before['item_id'].astype('category'))
+    n_users = interactions['user_id'].nunique()
+    return [
+        _entry("interactions", len(interactions), frame_memory(before), frame_memory(interactions)),
+        _entry("user_similarity", n_users * n_users, n_users * n_users * 8, n_users * n_users * 4),
+    ]
+
+
+def rf_report(ids):
+    from src.recommendation.rf_ranker import (BEHAVIOR_COLS, build_training_sets, _load_item_features,
+                                              _load_user_category_affinity)
+
+    items = _load_item_features()
+    sets = build_training_sets(ids, items, _load_user_category_affinity())
+    users = compact_dtypes(encode_ids(read_analytics(
+        "SELECT user_id, cluster_label, is_churn_risk, loyalty_score, price_sensitivity FROM usr_persona",
+        tables=("usr_persona",)), ids))
+
+    # 一个预测分片的笛卡尔积 (用户批次 x 全部商品，商品表已含独热品类)
+    batch = users[users['user_id'].isin(sets.active_users)]
+    batch = batch.iloc[:max(1, int(np.ceil(len(batch) / PREDICT_CHUNKS)))]
+    # 预测分片从特征库按用户读取的行为计数
+    behavior = load_features("user_items", columns=BEHAVIOR_COLS, users=batch['user_id'].to_numpy())
+    return [
+        _compare("training_set", pd.concat([sets.train, sets.val], ignore_index=True), ids),
+        _compare("behavior_summary", behavior, ids),
+        _compare("predict_chunk", batch.merge(items, how='cross'), ids),
+    ]
+
+
+def evaluate_report(ids):
+    from src.database import get_engine
+    from src.recommendation.evaluate import EVAL_MODELS, _load_ground_truth, _load_predictions
+
+    with get_engine("analytics").connect() as conn:
+        entries = [_compare("ground_truth", encode_ids(_load_ground_truth(conn), ids), ids)]
+        for model in EVAL_MODELS:
+            entries.append(_compare(f"predictions:{model}", encode_ids(_load_predictions(conn, model), ids), ids))
+    return entries
+
+
+STAGES = {
+    "persona": persona_report,
+    "user_cf": user_cf_report,
+    "rf": rf_report,
+    "evaluate": evaluate_report,
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="流水线各阶段内存占用对比")
+    parser.add_argument("--stages", default=",".join(STAGES), help="逗号分隔的阶段名")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    ids = get_id_dictionary()
+    report = {"id_dictionary": {"users": len(ids.users), "items": len(ids.items)}, "stages": {}}
+    for name in (s for s in args.stages.split(",") if s):
+        report["stages"][name] = STAGES[name](ids)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    mib = 1024 * 1024
+    print(f"ID 字典: 用户 {len(ids.users)}, 商品 {len(ids.items)}")
+    print(f"{'stage':<10}{'frame':<26}{'rows':>12}{'before MiB':>13}{'after MiB':>12}{'ratio':>8}")
+    for name, entries in report["stages"].items():
+        for e in entries + [_entry("(total)", sum(x["rows"] for x in entries),
+                                   sum(x["before_bytes"] for x in entries),
+                                   sum(x["after_bytes"] for x in entries))]:
+            ratio = e["before_bytes"] / e["after_bytes"] if e["after_bytes"] else 0.0
+            print(f"{name:<10}{e['frame']:<26}{e['rows']:>12}{e['before_bytes'] / mib:>13.2f}"
+                  f"{e['after_bytes'] / mib:>12.2f}{ratio:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
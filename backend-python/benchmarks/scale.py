@@ -0,0 +1,200 @@
+"""
+端到端规模压测：在不同数据规模下测量各流水线阶段的耗时与峰值内存
+
+用法 (在 backend-python 目录下，DATABASE_URL 指向已建表的测试库，数据会被整体替换):
+    python benchmarks/scale.py --sizes 10k,100k,1m --out runtime/benchmarks/scale.json
+    python benchmarks/scale.py --sizes 10k,100k --compare runtime/benchmarks/scale.json
+
+每个规模先用 src.preprocessing.synthetic_data 生成合成 CSV (按规模与种子缓存在 --data-dir，重复运行直接复用)，
+再依次执行 ingest -> persona -> user_cf -> rf -> evaluate。每个阶段在全新的子进程中运行，
+峰值内存取子进程的 ru_maxrss，互不影响；模块导入耗时单独记录，不计入阶段耗时。
+某阶段失败时，该规模的后续阶段标记为 skipped。
+
+--out 写出 JSON 报告；--compare 与历史报告逐项对比，耗时或峰值内存超过 --threshold 即视为回退，退出码为 1。
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(BACKEND_DIR))
+
+STAGES = ("ingest", "persona", "user_cf", "rf", "evaluate")
+
+
+def _run_stage(name, csv_path, backend):
+    """子进程内执行：返回阶段函数的结果消息，失败时抛出异常"""
+    if name == "ingest":
+        from src.preprocessing.data_loader import process_and_load_csv
+        return lambda: process_and_load_csv(csv_path, backend=backend)
+    if name == "persona":
+        from src.profiling.cluster_model import train_user_clusters
+        return lambda: train_user_clusters(backend=backend)
+    if name == "user_cf":
+        from src.recommendation.baseline_user_cf import UserCFBaseline
+        return lambda: UserCFBaseline().save_results_to_db(top_n=5)
+    if name == "rf":
+        from src.recommendation.rf_ranker import train_recommendation_model
+        return train_recommendation_model
+    if name == "evaluate":
+        from src.recommendation.evaluate import evaluate_models
+        return evaluate_models
+    raise ValueError(f"未知阶段: {name}")
+
+
+def stage_main(name, csv_path, backend):
+    start = time.perf_counter()
+    func = _run_stage(name, csv_path, backend)
+    import_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        result = func()
+        # (success, message) 形式的返回值以 success 判定成败
+        if isinstance(result, tuple) and len(result) == 2 and result[0] is False:
+            raise RuntimeError(result[1])
+    except Exception as e:
+        print(json.dumps({"status": "failed", "error": str(e).strip().splitlines()[0] if str(e).strip() else repr(e)},
+                         ensure_ascii=False))
+        sys.exit(1)
+    seconds = time.perf_counter() - start
+    # Linux 下 ru_maxrss 单位为 KiB
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    print(json.dumps({"status": "ok", "seconds": round(seconds, 3), "import_seconds": round(import_seconds, 3),
+                      "peak_rss_bytes": peak}))
+
+
+def run_stage(name, csv_path, backend, timeout):
+    cmd = [sys.executable, __file__, "--stage", name, "--csv", str(csv_path)]
+    if backend:
+        cmd += ["--backend", backend]
+    try:
+        proc = subprocess.run(cmd, cwd=BACKEND_DIR, capture_output=True, text=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return {"status": "timeout"}
+    # 阶段函数自身也会打印日志，结果为最后一行 JSON
+    lines = proc.stdout.strip().splitlines()
+    try:
+        return json.loads(lines[-1])
+    except (IndexError, json.JSONDecodeError):
+        error = proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "阶段执行失败"
+        return {"status": "failed", "error": error}
+
+
+def _git_commit():
+    proc = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True)
+    return proc.stdout.strip() or None
+
+
+def run_suite(sizes, args):
+    from sqlalchemy.engine import make_url
+    from src.database import SQLALCHEMY_DATABASE_URL
+    from src.preprocessing.synthetic_data import parse_size, write_csv
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "database": make_url(SQLALCHEMY_DATABASE_URL).get_backend_name(),
+            "backend": args.backend or os.getenv("EXECUTION_BACKEND", "pandas"),
+            "seed": args.seed,
+        },
+        "sizes": {},
+    }
+    data_dir = Path(args.data_dir)
+    for label in sizes:
+        rows = parse_size(label)
+        csv_path = data_dir / f"synthetic_{rows}_seed{args.seed}.csv"
+        if csv_path.exists():
+            generated = {"path": str(csv_path), "rows": rows, "bytes": csv_path.stat().st_size, "cached": True}
+        else:
+            print(f"🧪 正在生成 {label} 行合成数据...")
+            generated = write_csv(csv_path, rows, seed=args.seed)
+        entry = {"rows": rows, "generate": generated, "stages": {}}
+        failed = False
+        for name in STAGES:
+            if failed:
+                entry["stages"][name] = {"status": "skipped"}
+                continue
+            print(f"⏱️ {label}: {name} ...", flush=True)
+            result = run_stage(name, csv_path, args.backend, args.timeout)
+            entry["stages"][name] = result
+            failed = result["status"] != "ok"
+            if failed:
+                print(f"❌ {label}: {name} {result['status']} {result.get('error', '')}")
+            else:
+                print(f"   {result['seconds']:.2f}s, 峰值内存 {result['peak_rss_bytes'] / 1024 / 1024:.0f} MiB")
+        report["sizes"][str(rows)] = entry
+    return report
+
+
+def compare(report, baseline, threshold):
+    """逐规模、逐阶段对比耗时与峰值内存，返回回退项列表"""
+    regressions = []
+    print(f"\n📊 与基线对比 (基线 commit {baseline['meta'].get('commit')}, 阈值 +{threshold:.0%})")
+    print(f"{'rows':>10} {'stage':<10}{'seconds':>22}{'peak MiB':>22}")
+    for rows, entry in report["sizes"].items():
+        base_entry = baseline["sizes"].get(rows)
+        if base_entry is None:
+            continue
+        for name, result in entry["stages"].items():
+            base = base_entry["stages"].get(name, {})
+            if result.get("status") != "ok" or base.get("status") != "ok":
+                continue
+            cells = []
+            for key, scale in (("seconds", 1), ("peak_rss_bytes", 1024 * 1024)):
+                old, new = base[key] / scale, result[key] / scale
+                change = (new - old) / old if old else 0.0
+                if change > threshold:
+                    regressions.append({"rows": rows, "stage": name, "metric": key, "baseline": old,
+                                        "current": new, "change": round(change, 3)})
+                cells.append(f"{old:>8.2f} -> {new:>8.2f} ({change:+.0%})")
+            print(f"{rows:>10} {name:<10}{cells[0]:>22}  {cells[1]:>22}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="端到端规模压测")
+    parser.add_argument("--sizes", default="10k,100k,1m", help="数据规模，逗号分隔 (10k ~ 50m)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--data-dir", default="runtime/synthetic", help="合成 CSV 缓存目录")
+    parser.add_argument("--backend", choices=("pandas", "spark"), help="入库与画像的执行后端")
+    parser.add_argument("--timeout", type=float, default=None, help="单阶段超时 (秒)")
+    parser.add_argument("--out", help="JSON 报告输出路径")
+    parser.add_argument("--compare", metavar="REPORT", help="与历史报告对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="回退判定阈值 (默认 20%%)")
+    # 子进程入口
+    parser.add_argument("--stage", choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument("--csv", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage:
+        stage_main(args.stage, args.csv, args.backend)
+        return
+
+    report = run_suite([s for s in args.sizes.split(",") if s], args)
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding='utf-8'))
+        report["regressions"] = compare(report, baseline, args.threshold)
+    if args.out:
+        Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.out).write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding='utf-8')
+        print(f"📝 报告已写入 {args.out}")
+    elif not args.compare:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    if args.compare:
+        if report["regressions"]:
+            print(f"⚠️ 发现 {len(report['regressions'])} 项回退")
+            sys.exit(1)
+        print("✅ 未发现回退")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+入库与画像特征聚合的执行后端对比：pandas vs Spark (local[*])
+
+用法 (在 backend-python 目录下):
+    python benchmarks/spark_backend.py --scales 1,10,50 --repeat 3
+    DATABASE_URL=mysql+pymysql://... python benchmarks/spark_backend.py --scales 10,50 --with-db
+
+把 test.csv 按各倍数复制 (用户 / 商品 ID 加后缀) 生成合成 CSV，对每种后端计时：
+- compute: CSV 解析 + 分表 + 画像特征的多表关联与按用户聚合 (不访问数据库)
+- ingest:  (--with-db) 完整入库，含清空与写入业务库，需要 MySQL
+Spark 会话的启动耗时单独统计，不计入各轮耗时。
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+CSV_PATH = BACKEND_DIR.parent / "data" / "raw" / "test.csv"
+sys.path.insert(0, str(BACKEND_DIR))
+
+
+def write_synthetic_csv(path, scale):
+    """按倍数复制样例数据；商品按 10 份一组复用，保证用户之间存在共同商品"""
+    base = pd.read_csv(CSV_PATH)
+    for k in range(scale):
+        part = base.copy()
+        part['user_id'] = part['user_id'] + f"_{k}"
+        part['item_id'] = part['item_id'] + f"_{k % 10}"
+        part.to_csv(path, mode="a", header=(k == 0), index=False)
+    return len(base) * scale
+
+
+def _timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        samples.append(time.perf_counter() - start)
+    return {"median_s": round(statistics.median(samples), 3), "min_s": round(min(samples), 3), "rows": rows}
+
+
+def pandas_compute(csv_path):
+    from src.preprocessing.data_loader import USER_COLS, ITEM_COLS, BEHAVIOR_COLS
+    from src.profiling.cluster_model import aggregate_user_features
+
+    df = pd.read_csv(csv_path)
+    dim_user = df[USER_COLS].drop_duplicates(subset=['user_id'])
+    dim_item = df[ITEM_COLS].drop_duplicates(subset=['item_id'])
+    fact = df[BEHAVIOR_COLS]
+    # 用户 x 行为 x 商品的逐行联查 (原画像阶段的 SQL 联查)
+    raw = (dim_user.merge(fact[['user_id', 'item_id', 'interaction_rate', 'purchase_intent', 'last_click_gap']],
+                          on='user_id')
+           .merge(dim_item[['item_id', 'category', 'price', 'discount_rate']]
+                  .rename(columns={'price': 'item_price', 'discount_rate': 'item_discount'}), on='item_id'))
+    return len(aggregate_user_features(raw))
+
+
+def spark_compute(csv_path):
+    from src.spark_backend import read_source_csv, split_star_schema, persona_features
+
+    source = read_source_csv(csv_path)
+    try:
+        tables = split_star_schema(source)
+        return len(persona_features(tables["dim_user"], tables["fact_user_behavior"], tables["dim_item"]))
+    finally:
+        source.unpersist()
+
+
+def ingest(csv_path, backend):
+    from src.preprocessing.data_loader import process_and_load_csv
+
+    success, msg = process_and_load_csv(csv_path, backend=backend)
+    if not success:
+        raise RuntimeError(msg)
+    return msg
+
+
+def main():
+    parser = argparse.ArgumentParser(description="pandas / Spark 执行后端对比")
+    parser.add_argument("--scales", default="1,10,50", help="样例数据复制倍数，逗号分隔")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--with-db", action="store_true", help="同时测量完整入库 (写入 DATABASE_URL 指向的 MySQL)")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    # 预先加载 scikit-learn 等依赖，导入耗时不计入第一轮
+    import src.profiling.cluster_model  # noqa: F401
+
+    report = {"scales": {}, "spark_startup_s": None, "spark_error": None}
+    try:
+        from src.spark_backend import get_spark
+        start = time.perf_counter()
+        get_spark()
+        report["spark_startup_s"] = round(time.perf_counter() - start, 2)
+    except Exception as e:
+        report["spark_error"] = str(e)
+
+    workdir = tempfile.mkdtemp(prefix="spark_bench_")
+    for scale in (int(s) for s in args.scales.split(",")):
+        csv_path = os.path.join(workdir, f"synthetic_x{scale}.csv")
+        rows = write_synthetic_csv(csv_path, scale)
+        result = {"rows": rows, "csv_mib": round(os.path.getsize(csv_path) / 1024 / 1024, 1),
+                  "compute": {"pandas": _timed(lambda: pandas_compute(csv_path), args.repeat)}}
+        if report["spark_error"] is None:
+            result["compute"]["spark"] = _timed(lambda: spark_compute(csv_path), args.repeat)
+        if args.with_db:
+            result["ingest"] = {"pandas": _timed(lambda: ingest(csv_path, "pandas"), args.repeat)}
+            if report["spark_error"] is None:
+                result["ingest"]["spark"] = _timed(lambda: ingest(csv_path, "spark"), args.repeat)
+        report["scales"][scale] = result
+        os.remove(csv_path)
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    if report["spark_error"]:
+        print(f"⚠️ Spark 不可用，仅测量 pandas: {report['spark_error']}")
+    else:
+        print(f"⚡ Spark 会话启动耗时: {report['spark_startup_s']}s (不计入下表)")
+    print(f"{'scale':>6}{'rows':>10}{'phase':>9}{'pandas (s)':>12}{'spark (s)':>12}{'speedup':>10}")
+    for scale, result in report["scales"].items():
+        for phase in ("compute", "ingest"):
+            if phase not in result:
+                continue
+            pandas_s = result[phase]["pandas"]["median_s"]
+            spark = result[phase].get("spark")
+            spark_col = f"{spark['median_s']:>12.3f}{pandas_s / spark['median_s']:>9.1f}x" if spark else f"{'-':>12}{'-':>10}"
+            print(f"{scale:>6}{result['rows']:>10}{phase:>9}{pandas_s:>12.3f}{spark_col}")
+
+
+if __name__ == "__main__":
+    main()
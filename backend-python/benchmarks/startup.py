@@ -0,0 +1,117 @@
+"""
+服务进程冷启动压测：导入耗时与常驻内存
+
+用法 (在 backend-python 目录下):
+    python benchmarks/startup.py --target main --repeat 5
+    python benchmarks/startup.py --target main --compare HEAD~1
+
+每轮在全新的子进程中导入 main (FastAPI) 或仓库根目录的 app (Gradio)，记录导入耗时、
+导入后的常驻内存 (RSS)，以及是否加载了 scikit-learn / scipy / joblib 等重型依赖。
+--compare 会把指定的 git 版本检出到临时 worktree，用同样的方式测量，输出前后对比。
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+REPO_DIR = BACKEND_DIR.parent
+
+HEAVY_MODULES = ("sklearn", "scipy", "joblib", "gradio", "pyspark")
+
+# 子进程内执行：只测量导入本身，数据库使用临时 SQLite，避免连接真实 MySQL
+_PROBE = """
+import json, os, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+with open('/proc/self/statm') as f:
+    rss = int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+print(json.dumps({{"import_seconds": elapsed, "rss_bytes": rss,
+                  "heavy_modules": [m for m in {heavy!r} if m in sys.modules],
+                  "modules_loaded": len(sys.modules)}}))
+"""
+
+
+def _target_paths(root, target):
+    """返回 (工作目录, 模块名, 额外的 PYTHONPATH)"""
+    backend = Path(root) / "backend-python"
+    if target == "main":
+        return backend, "main", backend
+    return Path(root), "app", backend
+
+
+def measure(root, target, repeat):
+    cwd, module, pythonpath = _target_paths(root, target)
+    env = dict(os.environ, PYTHONPATH=str(pythonpath), PYTHONDONTWRITEBYTECODE="1")
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        env.setdefault("DATABASE_URL", f"sqlite:///{tmp}/startup.db")
+        for _ in range(repeat):
+            proc = subprocess.run(
+                [sys.executable, "-c", _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+                cwd=cwd, env=env, capture_output=True, text=True,
+            )
+            if proc.returncode != 0:
+                return {"error": proc.stderr.strip().splitlines()[-1] if proc.stderr.strip() else "导入失败"}
+            runs.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return {
+        "import_seconds_median": round(statistics.median(r['import_seconds'] for r in runs), 3),
+        "import_seconds_min": round(min(r['import_seconds'] for r in runs), 3),
+        "rss_mib_median": round(statistics.median(r['rss_bytes'] for r in runs) / 1024 / 1024, 1),
+        "modules_loaded": runs[-1]['modules_loaded'],
+        "heavy_modules": runs[-1]['heavy_modules'],
+        "repeat": repeat,
+    }
+
+
+def measure_ref(ref, target, repeat):
+    """在临时 worktree 中测量某个 git 版本"""
+    with tempfile.TemporaryDirectory() as tmp:
+        worktree = Path(tmp) / "tree"
+        subprocess.run(["git", "worktree", "add", "--detach", str(worktree), ref],
+                       cwd=REPO_DIR, check=True, capture_output=True)
+        try:
+            return measure(worktree, target, repeat)
+        finally:
+            subprocess.run(["git", "worktree", "remove", "--force", str(worktree)],
+                           cwd=REPO_DIR, capture_output=True)
+
+
+def _print_row(label, result):
+    if "error" in result:
+        print(f"{label:<12} ❌ {result['error']}")
+        return
+    heavy = ",".join(result['heavy_modules']) or "-"
+    print(f"{label:<12} import {result['import_seconds_median']:>6.3f}s (min {result['import_seconds_min']:.3f}s)  "
+          f"RSS {result['rss_mib_median']:>7.1f} MiB  modules {result['modules_loaded']:>5}  heavy: {heavy}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="服务进程冷启动压测")
+    parser.add_argument("--target", choices=("main", "app"), default="main")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--compare", metavar="GIT_REF", help="与指定的 git 版本对比 (如 HEAD~1)")
+    parser.add_argument("--json", action="store_true", help="以 JSON 输出")
+    args = parser.parse_args()
+
+    report = {"target": args.target, "current": measure(REPO_DIR, args.target, args.repeat)}
+    if args.compare:
+        report["baseline"] = measure_ref(args.compare, args.target, args.repeat)
+        report["baseline_ref"] = args.compare
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    print(f"🚀 冷启动测量: {args.target} (每项 {args.repeat} 次，取中位数)")
+    if args.compare:
+        _print_row(args.compare, report["baseline"])
+    _print_row("current", report["current"])
+
+
+if __name__ == "__main__":
+    main()
@@ -1,33 +1,80 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi import FastAPI, UploadFile, File, HTTPException, Request
+from fastapi.responses import StreamingResponse, PlainTextResponse, FileResponse
 from fastapi.middleware.cors import CORSMiddleware
+from contextlib import asynccontextmanager
+import anyio
+import asyncio
+import json
 import os
 import time
 from pathlib import Path
 import shutil
 
-# 导入核心逻辑模块
-from src.preprocessing.data_loader import process_and_load_csv
-from src.profiling.cluster_model import train_user_clusters
-# 确保 rf_ranker.py 已经处理好相关逻辑
-from src.recommendation.rf_ranker import train_recommendation_model, get_top_recommendations
+# 导入评价函数
+from src.recommendation.evaluate import evaluate_models, EVAL_MODELS
 
-# 导入基准 User-CF 模型类
-from src.recommendation.baseline_user_cf import UserCFBaseline
+# 推荐结果在线查询 (单用户 / 批量)
+from src.recommendation.serving import lookup_recommendations, get_fallback, iter_batch_recommendations
+from src.recommendation.popularity import popularity_fallback
+from src.recommendation.serving_store import serving_store
 
-# 导入评价函数
-from src.recommendation.evaluate import evaluate_models
+# 流水线任务子系统：画像 / 训练 / 全量重构均在独立进程池中执行
+from src.jobs import JobManager, TERMINAL_STATES
+from src.pipeline import PIPELINE_STAGES
+from src.pipeline_manifest import PipelineManifest
+# 入库 / 画像特征聚合的执行后端 (pandas / spark)，可按单次任务选择
+from src.spark_backend import resolve_backend
+
+# 看板统计接口的响应缓存：数据版本号变化 (流水线写库) 后自动失效
+from src.response_cache import cached_response, register_cache_metrics
+
+# 运行指标 (Prometheus 文本格式)
+from src.metrics import REGISTRY, StageMetricsStore, counter, histogram, instrument_engine
 
-from fastapi import FastAPI, BackgroundTasks
-from typing import Dict, Optional
+# 按需开启的性能剖析 (PROFILE_STAGES / PROFILE_ROUTES，或单次请求 X-Profile: 1)
+from src.profiler import (profiled, request_profiling, reset_request_profiling, list_profiles, profile_file,
+                          PROFILE_ALLOW_REQUEST)
+
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
 
 from sqlalchemy import text
 
 import pandas as pd
-from src.database import engine
+from src.database import get_engine, on_engine_created, DB_POOL_SIZE, DB_MAX_OVERFLOW
+# 接口统一使用 serving 引擎。带响应缓存的接口读主库：副本的复制延迟会让旧数据以新版本号写进缓存；
+# 不走缓存的单用户查询 (read=True) 可容忍短暂延迟，配置了只读副本时路由到副本
+
+# 同步路由 (def) 由 FastAPI 放入线程池执行，避免阻塞式数据库查询卡住事件循环
+# 线程数不超过数据库连接池总容量 (多出的线程只会排队等待连接)，也不超过每核 4 个 (过多线程只会加剧 GIL 争用)
+API_THREADPOOL_SIZE = int(os.getenv(
+    "API_THREADPOOL_SIZE", str(min(DB_POOL_SIZE + DB_MAX_OVERFLOW, (os.cpu_count() or 1) * 4))))
+
+
+job_manager = JobManager()
+
+# 指标：接口耗时、SQL 耗时与连接池、缓存命中、流水线阶段
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "接口处理耗时 (到响应头发出为止)", labelnames=("method", "route"))
+HTTP_REQUESTS = counter("http_requests_total", "接口请求数", labelnames=("method", "route", "status"))
+on_engine_created(instrument_engine)
+register_cache_metrics()
+REGISTRY.add_collector(lambda: StageMetricsStore().render())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    anyio.to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    # 启动时映射最新的推荐服务文件，之后在查询时按需检测新版本
+    serving_store.refresh(force=True)
+    popularity_fallback.refresh(force=True)
+    yield
+    job_manager.shutdown()
 
 
 # 项目标题
-app = FastAPI(title="Smart-EComm-Strategy 智慧电商后端引擎")
+app = FastAPI(title="Smart-EComm-Strategy 智慧电商后端引擎", lifespan=lifespan)
 
 # 1. 配置跨域
 app.add_middleware(
@@ -37,18 +84,80 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# 全局状态管理，用于前端轮询
-training_status = {"is_running": False, "last_result": None}
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    start = time.perf_counter()
+    status = 500
+    # 单次请求的剖析开关 (需设置 PROFILE_ALLOW_REQUEST=1)，对带 @profiled 标记的接口生效
+    token = request_profiling(request.headers.get("x-profile") == "1"
+                              or request.query_params.get("profile") == "1")
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        reset_request_profiling(token)
+        # 使用路由模板 (如 /api/recommend/{user_id}) 作为标签，避免标签基数随用户数增长
+        route = request.scope.get("route")
+        path = route.path if route is not None else "unmatched"
+        HTTP_REQUEST_SECONDS.observe(time.perf_counter() - start, method=request.method, route=path)
+        HTTP_REQUESTS.inc(method=request.method, route=path, status=status)
+
+
+@app.get("/metrics")
+def get_metrics():
+    """
+    Prometheus 文本格式的运行指标
+    """
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def _require_profile_access():
+    if not PROFILE_ALLOW_REQUEST:
+        raise HTTPException(status_code=403, detail="剖析结果接口未开启 (需设置 PROFILE_ALLOW_REQUEST=1)")
+
+
+@app.get("/api/profiles")
+def get_profiles(limit: int = 50):
+    """
+    最近的性能剖析结果 (流水线阶段 / 接口)，每条包含可下载的产物文件名
+    """
+    _require_profile_access()
+    return {"status": "success", "data": list_profiles(limit)}
+
+
+@app.get("/api/profiles/{filename}")
+def download_profile(filename: str):
+    """
+    下载剖析产物：.pstats / .collapsed.txt (火焰图折叠栈) / .memory.txt / .summary.txt
+    """
+    _require_profile_access()
+    path = profile_file(filename)
+    if path is None:
+        raise HTTPException(status_code=404, detail="剖析文件不存在")
+    return FileResponse(path, filename=filename)
+
 
 # 定义上传目录路径
-UPLOAD_DIR = Path("temp_uploads")
+UPLOAD_DIR = Path(os.getenv("UPLOAD_DIR", "temp_uploads"))
 UPLOAD_DIR.mkdir(exist_ok=True)
 
 
+def _backend_params(backend):
+    """单次任务的执行后端 (pandas / spark)，未指定时使用 EXECUTION_BACKEND"""
+    if backend is None:
+        return {}
+    try:
+        return {"backend": resolve_backend(backend)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
 @app.post("/api/data/upload")
-async def upload_data(file: UploadFile = File(...)):
+def upload_data(file: UploadFile = File(...), backend: Optional[str] = None):
     if not file.filename.endswith('.csv'):
         raise HTTPException(status_code=400, detail="仅支持上传 CSV 格式文件")
+    backend_params = _backend_params(backend)
 
     file_ext = os.path.splitext(file.filename)[1]
     base_name = os.path.splitext(file.filename)[0]
@@ -59,15 +168,32 @@ async def upload_data(file: UploadFile = File(...)):
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(file.file, buffer)
 
-        # 数据处理入库
-        process_and_load_csv(str(file_path))
-        return {"status": "success", "message": "文件上传并解析成功", "filename": unique_name}
+        # 数据处理入库：与其他流水线任务一样提交到任务进程池执行 (不占用接口线程、不改动 API 进程的进度上报)，
+        # 进度与结果通过 /api/jobs/{job_id}/events 订阅
+        job, active = job_manager.submit(
+            "ingest", {"file_path": str(file_path), **backend_params}, stages=PIPELINE_STAGES["ingest"])
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+    if job is None:
+        raise HTTPException(status_code=409, detail=f"已有任务正在运行中: {active['id']}")
+    return {"status": "success", "message": "文件已上传，入库任务已在后台启动", "filename": unique_name,
+            "job_id": job['id']}
+
+
+def _submit_job(kind, params=None, message="任务已在后台启动", profile=False):
+    """
+    统一的任务提交入口：已有任务运行时拒绝提交 (single-flight)
+    :param profile: 剖析该任务的每个阶段，结果见 /api/profiles
+    """
+    job, active = job_manager.submit(kind, params, stages=PIPELINE_STAGES[kind], profile=profile)
+    if job is None:
+        return {"status": "error", "message": "已有任务正在运行中", "job_id": active['id']}
+    return {"status": "success", "message": message, "job_id": job['id']}
+
 
 @app.post("/api/recommend/train")
-async def train_model(background_tasks: BackgroundTasks, params: Optional[Dict] = None):
+async def train_model(params: Optional[Dict] = None):
     """
     接收前端参数，若 params 为空则使用默认值 5
     """
@@ -80,66 +206,124 @@ async def train_model(background_tasks: BackgroundTasks, params: Optional[Dict]
     # 同样可以获取阈值，如果没有则默认 0.6
     threshold = safe_params.get("threshold", 0.6)
 
-    # 启动后台任务并透传参数
-    background_tasks.add_task(rebuild_all_task, top_n=top_n, threshold=threshold)
+    # force=True 时忽略数据指纹，强制重算全部阶段
+    force = bool(safe_params.get("force", False))
+
+    # incremental=True 时随机森林在上一版本模型上用新增行为增量更新
+    incremental = bool(safe_params.get("incremental", False))
+
+    # 画像特征聚合的执行后端 (pandas / spark)
+    backend_params = _backend_params(safe_params.get("backend"))
 
-    return {
-        "status": "success",
-        "message": f"全量重构流水线已启动 (参数: Top-{top_n}, Threshold-{threshold})"
-    }
+    # 提交全量重构任务并透传参数
+    return _submit_job(
+        "rebuild", {"top_n": top_n, "threshold": threshold, "incremental": incremental, "force": force,
+                    **backend_params},
+        message=f"全量重构流水线已启动 (参数: Top-{top_n}, Threshold-{threshold})",
+        profile=bool(safe_params.get("profile", False)),
+    )
 
-async def rebuild_all_task(top_n: int = 5, threshold: float = 0.6):
+
+@app.post("/api/admin/rebuild-all")
+async def rebuild_all(force: bool = False, profile: bool = False, backend: Optional[str] = None):
+    return _submit_job("rebuild", {"force": force, **_backend_params(backend)},
+                       message="全量重构任务已在后台启动", profile=profile)
+
+
+@app.get("/api/pipeline/runs")
+def get_pipeline_runs(limit: int = 20):
     """
-    全量重构异步流水线：支持动态参数透传
+    最近的流水线运行记录 (含各阶段耗时与是否跳过) 及当前数据集指纹
     """
-    global training_status
-    training_status["is_running"] = True
-    try:
-        # 1. 智慧画像建模
-        print("\n" + "=" * 30)
-        print(">>> 步骤 1: 正在构建智慧画像 (K-Means)...")
-        train_user_clusters()
-
-        # 2. 基准模型计算
-        # 使用动态传入的 top_n
-        print(f">>> 步骤 2: 正在执行 User-CF 基准模型 (Top {top_n})...")
-        cf_model = UserCFBaseline()
-        cf_model.save_results_to_db(top_n=top_n)
-
-        # 3. 核心推荐模型训练
-        # 透传 top_n 和 threshold 参数给随机森林模型
-        print(f">>> 步骤 3: 正在训练优化版随机森林推荐模型 (Top {top_n}, Threshold {threshold})...")
-        train_recommendation_model(top_n=top_n, threshold=threshold)
-
-        # 4. 实验对比评价
-        print(">>> 步骤 4: 正在基于数据库真实行为生成实验对比指标...")
-        evaluate_models()
-
-        training_status["last_result"] = "Success"
-        print("=" * 30)
-        print(f"✅ 全量任务已圆满完成（参数：Top {top_n}, Threshold {threshold}）。")
+    manifest = PipelineManifest().snapshot()
+    return {"status": "success", "data": {
+        "runs": manifest['runs'][-limit:][::-1],
+        "datasets": manifest['datasets'],
+    }}
 
-    except Exception as e:
-        print(f"❌ 任务执行中断: {str(e)}")
-        training_status["last_result"] = f"Error: {str(e)}"
-    finally:
-        training_status["is_running"] = False
+
+@app.get("/api/jobs")
+async def list_jobs(limit: int = 20):
+    """
+    最近的流水线任务列表
+    """
+    return {"status": "success", "data": job_manager.list(limit)}
 
 
-@app.post("/api/admin/rebuild-all")
-async def rebuild_all(background_tasks: BackgroundTasks):
-    if training_status["is_running"]:
-        return {"status": "error", "message": "已有任务正在运行中"}
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """
+    查询任务状态与各阶段进度
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"status": "success", "data": job}
+
+
+# SSE 推送间隔 (秒)：读取任务事件文件的新增部分，不查询数据库
+JOB_EVENTS_POLL_INTERVAL = 0.5
+
 
-    background_tasks.add_task(rebuild_all_task)
-    return {"status": "success", "message": "全量重构任务已在后台启动"}
+def _sse(event_type, payload):
+    return f"event: {event_type}\ndata: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+@app.get("/api/jobs/{job_id}/events")
+async def stream_job_events(job_id: str):
+    """
+    以 Server-Sent Events 推送任务进度：阶段开始 / 结束、阶段内百分比、已处理行数与吞吐量
+    job_id 传 latest 时订阅最近一个任务；任务结束后发送 job 事件并关闭连接
+    """
+    if job_id == "latest":
+        jobs = job_manager.list(limit=1)
+        job_id = jobs[0]['id'] if jobs else None
+    job = job_manager.get(job_id) if job_id else None
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+
+    async def event_stream():
+        offset = 0
+        # 先推送一次当前快照，晚连接的客户端也能立即渲染
+        yield _sse("snapshot", job)
+        while True:
+            # 先读状态再读事件：读到终态时结束事件必然已写入
+            current = job_manager.get(job_id)
+            events, offset = job_manager.store.read_events(job_id, offset)
+            for event in events:
+                yield _sse(event['type'], event)
+            if any(event['type'] == "job" for event in events):
+                return
+            if current is None or current['state'] in TERMINAL_STATES:
+                # 工作进程异常退出 / 开始前被取消时没有结束事件，以状态文件为准收尾
+                yield _sse("job", {"type": "job", "state": current['state'] if current else "failed",
+                                   "error": current.get('error') if current else None})
+                return
+            # 注释行作为心跳，防止代理因长时间无数据断开连接
+            if not events:
+                yield ": keep-alive\n\n"
+            await asyncio.sleep(JOB_EVENTS_POLL_INTERVAL)
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.post("/api/jobs/{job_id}/cancel")
+async def cancel_job(job_id: str):
+    """
+    取消任务：未开始的任务立即撤销，运行中的任务在当前阶段结束后终止
+    """
+    job = job_manager.cancel(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="任务不存在")
+    return {"status": "success", "message": "已提交取消请求", "data": job}
 
 
 @app.get("/api/user/profile/{user_id}")
-async def get_user_profile(user_id: str):
+def get_user_profile(user_id: str):
     query = text("SELECT * FROM usr_persona WHERE user_id = :uid")
     try:
-        with engine.connect() as conn:
+        with get_engine("serving", read=True).connect() as conn:
             result = conn.execute(query, {"uid": user_id}).fetchone()
             if result:
                 return {"status": "success", "data": dict(result._mapping)}
@@ -150,9 +334,9 @@ async def get_user_profile(user_id: str):
 
 
 @app.get("/api/system/status")
-async def get_system_status():
+def get_system_status():
     try:
-        with engine.connect() as conn:
+        with get_engine("serving", read=True).connect() as conn:
             res_persona = conn.execute(text("SELECT COUNT(*) FROM usr_persona")).scalar()
             res_user = conn.execute(text("SELECT COUNT(*) FROM dim_user")).scalar()
             return {"isUploaded": res_user > 0, "isProfiled": res_persona > 0}
@@ -161,23 +345,20 @@ async def get_system_status():
 
 
 @app.get("/api/recommend/trend/{user_id}")
-async def get_recommend_trend_final(user_id: str):
+@profiled("/api/recommend/trend/{user_id}")
+def get_recommend_trend_final(user_id: str):
     """
     汇总该用户在不同品类下的预测得分趋势
     """
     query = text("""
-                    SELECT 
-                        i.category as name, 
-                        MAX(r.score) as value 
-                    FROM recommendation_results r
-                    JOIN dim_item i ON r.item_id = i.item_id
-                    WHERE r.user_id = :uid AND r.model_type = 'RF-Optimized'
-                    GROUP BY i.category
+                    SELECT category as name, max_score as value
+                    FROM agg_user_category_score
+                    WHERE user_id = :uid AND model_type = 'RF-Optimized'
                     ORDER BY value DESC
                     LIMIT 10
                  """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving", read=True).connect() as conn:
             result = conn.execute(query, {"uid": user_id})
             data = [dict(row._mapping) for row in result]
 
@@ -190,13 +371,38 @@ async def get_recommend_trend_final(user_id: str):
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/model/metrics")
-async def get_model_metrics():
+@cached_response("model_metrics")
+def get_model_metrics():
+    """
+    供前端调用，获取 model_metrics 表中的 Precision, Recall, F1 及 NDCG/MAP/命中率/覆盖率数据
+    """
+    query = text("""
+        SELECT model_type, precision_val, recall_val, f1_val,
+               ndcg_val, map_val, hit_rate, coverage, k_value
+        FROM model_metrics
+    """)
+    try:
+        with get_engine("serving").connect() as conn:
+            result = conn.execute(query)
+            data = [dict(row._mapping) for row in result]
+            return {"status": "success", "data": data}
+    except Exception as e:
+        return {"status": "error", "message": str(e)}
+
+@app.get("/api/model/segment_metrics")
+@cached_response("model_segment_metrics")
+def get_model_segment_metrics():
     """
-    供前端调用，获取 model_metrics 表中的 Precision, Recall, F1 数据
+    按用户分群 (cluster_label) 拆分的模型评估指标
     """
-    query = text("SELECT model_type, precision_val, recall_val, f1_val FROM model_metrics")
+    query = text("""
+        SELECT model_type, segment, user_count, precision_val, recall_val, f1_val,
+               ndcg_val, map_val, hit_rate
+        FROM model_segment_metrics
+        ORDER BY model_type, segment
+    """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             data = [dict(row._mapping) for row in result]
             return {"status": "success", "data": data}
@@ -205,68 +411,33 @@ async def get_model_metrics():
 
 # 画像分析独立接口
 @app.post("/api/analyze/persona")
-async def analyze_persona(background_tasks: BackgroundTasks):
+async def analyze_persona(profile: bool = False, backend: Optional[str] = None):
     """
     独立触发用户画像分析任务
     """
-    if training_status["is_running"]:
-        return {"status": "error", "message": "已有任务正在运行中"}
+    return _submit_job("persona", _backend_params(backend), message="画像分析任务已在后台启动", profile=profile)
 
-    def run_task():
-        global training_status
-        training_status["is_running"] = True
-        try:
-            print("正在执行独立画像分析...")
-            train_user_clusters() # 执行 K-Means 聚类
-            training_status["last_result"] = "Success"
-        except Exception as e:
-            training_status["last_result"] = f"Error: {str(e)}"
-        finally:
-            training_status["is_running"] = False
 
-    background_tasks.add_task(run_task)
-    return {"status": "success", "message": "画像分析任务已在后台启动"}
-
-
-async def recommend_train(background_tasks: BackgroundTasks):
+async def recommend_train():
     """
     独立触发推荐模型训练任务 (随机森林)
     """
-    if training_status["is_running"]:
-        return {"status": "error", "message": "已有任务正在运行中"}
-
-    def run_task():
-        global training_status
-        training_status["is_running"] = True
-        try:
-            print("正在执行独立推荐模型训练...")
-            # 执行你修改后的保守型训练逻辑
-            success, msg = train_recommendation_model()
-            if success:
-                training_status["last_result"] = "Success"
-            else:
-                training_status["last_result"] = f"Error: {msg}"
-        except Exception as e:
-            training_status["last_result"] = f"Error: {str(e)}"
-        finally:
-            training_status["is_running"] = False
-
-    background_tasks.add_task(run_task)
-    return {"status": "success", "message": "推荐模型训练已在后台启动"}
+    return _submit_job("recommend", message="推荐模型训练已在后台启动")
 
 
 @app.get("/api/stats/persona_distribution")
-async def get_persona_distribution():
+@profiled("/api/stats/persona_distribution")
+@cached_response("persona_distribution")
+def get_persona_distribution():
     """
     获取画像分布统计数据（用于前端饼图展示）
     """
     query = text("""
-                 SELECT cluster_label as name, COUNT(*) as value
-                 FROM usr_persona
-                 GROUP BY cluster_label
+                 SELECT cluster_label as name, user_count as value
+                 FROM agg_persona_cluster
                  """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             # 将数据转换为前端 ECharts 喜欢的 {name: '分群1', value: 10} 格式
             data = [dict(row._mapping) for row in result]
@@ -282,17 +453,17 @@ async def get_persona_distribution():
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/stats/consumption_level")
-async def get_consumption_level():
+@cached_response("consumption_level")
+def get_consumption_level():
     """
     获取消费等级分布
     """
     query = text("""
-        SELECT consumption_level as name, COUNT(*) as value 
-        FROM usr_persona 
-        GROUP BY consumption_level
+        SELECT consumption_level as name, user_count as value
+        FROM agg_consumption_level
     """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             data = [dict(row._mapping) for row in result]
             return {"status": "success", "data": data}
@@ -300,21 +471,22 @@ async def get_consumption_level():
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/stats/category_ranking")
-async def get_category_ranking():
+@profiled("/api/stats/category_ranking")
+@cached_response("category_ranking")
+def get_category_ranking():
     """
     获取热门品类覆盖人数排名（已排除同一用户重复计入）
     """
-    # 核心修改：使用 COUNT(DISTINCT user_id) 统计覆盖的人数而非总条数
+    # 覆盖人数 (COUNT(DISTINCT user_id)) 由流水线预先汇总到 agg_category_coverage
     query = text("""
-        SELECT category as name, COUNT(DISTINCT user_id) as value 
-        FROM recommendation_results 
+        SELECT category as name, user_count as value
+        FROM agg_category_coverage
         WHERE model_type = 'RF-Optimized'
-        GROUP BY category 
-        ORDER BY value DESC 
+        ORDER BY value DESC
         LIMIT 10
     """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             data = [dict(row._mapping) for row in result]
             return {"status": "success", "data": data}
@@ -323,19 +495,19 @@ async def get_category_ranking():
 
 
 @app.get("/api/stats/consumption_levels")
-async def get_consumption_levels():
+@cached_response("consumption_levels")
+def get_consumption_levels():
     """
     获取消费等级分布统计数据（用于前端图表展示）
     """
     # 这里的字段名需与你数据库 usr_persona 表中的消费等级字段一致
     query = text("""
-                 SELECT consumption_level as name, COUNT(*) as value
-                 FROM usr_persona
-                 GROUP BY consumption_level
+                 SELECT consumption_level as name, user_count as value
+                 FROM agg_consumption_level
                  ORDER BY value DESC
                  """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             # 转换为前端 ECharts 通用的 [{name: '高消费', value: 120}, ...] 格式
             data = [dict(row._mapping) for row in result]
@@ -350,19 +522,21 @@ async def get_consumption_levels():
         return {"status": "error", "message": str(e)}
 
 @app.post("/api/model/evaluate")
-async def trigger_evaluation():
+@profiled("/api/model/evaluate")
+def trigger_evaluation():
     """
     手动触发模型评估，生成 Precision, Recall, F1 数据
     """
     try:
-        # 运行评价脚本，结果会自动存入 model_metrics 表
-        evaluate_models()
+        # 独立调用时以流式模式逐用户归并，内存占用不随结果表规模增长；结果会自动存入 model_metrics 表
+        evaluate_models(streaming=True)
         return {"status": "success", "message": "对比实验评估完成！"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/user/detail/{user_id}")
-async def get_user_detail(user_id: str):
+@profiled("/api/user/detail/{user_id}")
+def get_user_detail(user_id: str):
     query = text("""
         SELECT 
             u.user_id,
@@ -380,7 +554,7 @@ async def get_user_detail(user_id: str):
         WHERE u.user_id = :uid
     """)
     try:
-        with engine.connect() as conn:
+        with get_engine("serving", read=True).connect() as conn:
             result = conn.execute(query, {"uid": user_id}).fetchone()
             if result:
                 return {"status": "success", "data": dict(result._mapping)}
@@ -390,70 +564,61 @@ async def get_user_detail(user_id: str):
 
 # 2. 修复推荐列表：增加全局热门商品保底
 @app.get("/api/recommend/{user_id}")
-async def get_user_recommendations(user_id: str):
-    # 优先查 RF 结果，如果没有，则查询全局点击最高的商品作为保底
-    query = text("""
-        SELECT 
-            r.item_id, 
-            i.category, 
-            r.score,
-            r.rank
-        FROM recommendation_results r
-        JOIN dim_item i ON r.item_id = i.item_id
-        JOIN dim_user u ON r.user_id = u.user_id
-        WHERE r.user_id = :uid AND r.model_type = 'RF-Optimized'
-        ORDER BY r.rank ASC 
-        LIMIT 5
-    """)
+@profiled("/api/recommend/{user_id}")
+def get_user_recommend_final(user_id: str, model_type: str = 'RF-Optimized', top_n: int = 5):
+    """
+    单用户推荐查询：优先读取内存映射的服务文件，不可用时按 (user_id, model_type) 索引查询
+    recommendation_results (已冗余品类字段)；该用户没有模型结果时返回分群热门兜底商品
+    """
     try:
-        with engine.connect() as conn:
-            result = conn.execute(query, {"uid": user_id})
-            data = [dict(row._mapping) for row in result]
-            return {"status": "success", "data": data}
+        data = lookup_recommendations([user_id], model_type, top_n).get(user_id)
+
+        # 保底逻辑：如果该用户没有模型结果，返回其所属分群的热门商品
+        if not data:
+            data, _ = get_fallback(user_id, top_n)
+
+        return {"status": "success", "data": data}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 
-@app.get("/api/recommend/{user_id}")
-async def get_user_recommend_final(user_id: str):
+# 单次批量查询的用户数上限
+RECOMMEND_BATCH_MAX_USERS = int(os.getenv("RECOMMEND_BATCH_MAX_USERS", "50000"))
+
+
+class BatchRecommendRequest(BaseModel):
+    user_ids: List[str]
+    model_type: str = 'RF-Optimized'
+    top_n: int = 5
+
+
+@app.post("/api/recommend/batch")
+def get_batch_recommendations(req: BatchRecommendRequest):
     """
-    以 recommendation_results 为主表，联查 dim_item 获取准确的品类信息
+    批量推荐查询：按分片以 IN 查询一次取回多个用户的结果，逐用户以 NDJSON 流式返回
+    每行格式 {"user_id", "model_type", "fallback", "fallback_segment", "items"}，
+    fallback 为 true 表示该用户没有模型结果，items 取自 fallback_segment 对应分群的热门榜
     """
-    query = text("""
-                 SELECT r.item_id,
-                        i.category,
-                        r.score,
-                        r.rank
-                 FROM recommendation_results r
-                          JOIN dim_item i ON r.item_id = i.item_id
-                          JOIN dim_user u ON r.user_id = u.user_id
-                 WHERE r.user_id = :uid
-                   AND r.model_type = 'RF-Optimized'
-                 ORDER BY r.rank ASC LIMIT 5
-                 """)
-    try:
-        with engine.connect() as conn:
-            result = conn.execute(query, {"uid": user_id})
-            data = [dict(row._mapping) for row in result]
+    if req.model_type not in EVAL_MODELS:
+        raise HTTPException(status_code=400, detail=f"不支持的模型类型: {req.model_type}")
+    # 去重并保持请求顺序
+    user_ids = list(dict.fromkeys(req.user_ids))
+    if len(user_ids) > RECOMMEND_BATCH_MAX_USERS:
+        raise HTTPException(status_code=400, detail=f"单次最多查询 {RECOMMEND_BATCH_MAX_USERS} 个用户")
 
-            # 保底逻辑：如果该用户没有模型结果，返回全局热门作为填充
-            if not data:
-                fallback_query = text("""
-                                      SELECT item_id, category, 0.5 as score, 0 as rank
-                                      FROM dim_item LIMIT 5
-                                      """)
-                data = [dict(row._mapping) for row in conn.execute(fallback_query)]
+    def ndjson():
+        for record in iter_batch_recommendations(user_ids, req.model_type, req.top_n):
+            yield json.dumps(record, ensure_ascii=False) + "\n"
 
-            return {"status": "success", "data": data}
-    except Exception as e:
-        return {"status": "error", "message": str(e)}
+    return StreamingResponse(ndjson(), media_type="application/x-ndjson")
 
 @app.get("/api/model/kmeans_elbow")
-async def get_kmeans_elbow():
+@cached_response("kmeans_elbow")
+def get_kmeans_elbow():
     try:
         # 核心修正：使用 AS 将数据库字段名重命名为前端需要的 k 和 sse
         query = text("SELECT k_value AS k, sse_value AS sse FROM kmeans_metrics ORDER BY k_value ASC")
-        with engine.connect() as conn:
+        with get_engine("serving").connect() as conn:
             result = conn.execute(query)
             # 转化为列表对象
             data = [{"k": row.k, "sse": row.sse} for row in result]
@@ -462,7 +627,8 @@ async def get_kmeans_elbow():
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/model/rf_sensitivity")
-async def get_rf_sensitivity():
+@cached_response("rf_sensitivity")
+def get_rf_sensitivity():
     """
     读取真实的随机森林阈值敏感度趋势 (由 train_recommendation_model 生成)
     """
@@ -473,7 +639,7 @@ async def get_rf_sensitivity():
             FROM rf_sensitivity_metrics 
             ORDER BY threshold ASC
         """
-        df = pd.read_sql(query, engine)
+        df = pd.read_sql(query, get_engine("serving"))
         if df.empty:
             return {"status": "success", "data": []}
         return {"status": "success", "data": df.to_dict(orient='records')}
@@ -481,18 +647,18 @@ async def get_rf_sensitivity():
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/model/kmeans_process")
-async def get_kmeans_process():
+def get_kmeans_process():
     # 调用 cluster_model.py 中的新函数
     from src.profiling.cluster_model import get_kmeans_steps_data
     return get_kmeans_steps_data(n_clusters=4)
 
 @app.post("/api/model/optimize")
-async def optimize_model_alias(background_tasks: BackgroundTasks, params: Optional[Dict] = None):
+async def optimize_model_alias(params: Optional[Dict] = None):
     """
     前端 ModelEvaluation.vue 调用的调优接口别名
     """
     # 直接转发给已有的重构逻辑
-    return await train_model(background_tasks, params)
+    return await train_model(params)
 
 if __name__ == "__main__":
     import uvicorn
@@ -17,6 +17,53 @@
 SET NAMES utf8mb4;
 SET FOREIGN_KEY_CHECKS = 0;
 
+-- ----------------------------
+-- Table structure for agg_category_coverage
+-- ----------------------------
+DROP TABLE IF EXISTS `agg_category_coverage`;
+CREATE TABLE `agg_category_coverage` (
+  `model_type` varchar(50) NOT NULL COMMENT '模型类型',
+  `category` varchar(100) NOT NULL COMMENT '商品品类',
+  `user_count` int NOT NULL COMMENT '推荐结果覆盖的去重用户数',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '汇总刷新时间',
+  PRIMARY KEY (`model_type`,`category`),
+  KEY `idx_model_count` (`model_type`,`user_count`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='品类覆盖人数汇总表 (流水线末尾刷新)';
+
+-- ----------------------------
+-- Table structure for agg_consumption_level
+-- ----------------------------
+DROP TABLE IF EXISTS `agg_consumption_level`;
+CREATE TABLE `agg_consumption_level` (
+  `consumption_level` varchar(20) NOT NULL COMMENT '消费等级标签',
+  `user_count` int NOT NULL COMMENT '用户数',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '汇总刷新时间',
+  PRIMARY KEY (`consumption_level`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='消费等级人数汇总表 (流水线末尾刷新)';
+
+-- ----------------------------
+-- Table structure for agg_persona_cluster
+-- ----------------------------
+DROP TABLE IF EXISTS `agg_persona_cluster`;
+CREATE TABLE `agg_persona_cluster` (
+  `cluster_label` int NOT NULL COMMENT 'K-means 聚类群体编号',
+  `user_count` int NOT NULL COMMENT '用户数',
+  `updated_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '汇总刷新时间',
+  PRIMARY KEY (`cluster_label`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='画像分群人数汇总表 (流水线末尾刷新)';
+
+-- ----------------------------
+-- Table structure for agg_user_category_score
+-- ----------------------------
+DROP TABLE IF EXISTS `agg_user_category_score`;
+CREATE TABLE `agg_user_category_score` (
+  `user_id` varchar(50) NOT NULL COMMENT '用户ID',
+  `model_type` varchar(50) NOT NULL COMMENT '模型类型',
+  `category` varchar(100) NOT NULL COMMENT '商品品类',
+  `max_score` float DEFAULT NULL COMMENT '该品类下推荐商品的最高预测得分',
+  PRIMARY KEY (`user_id`,`model_type`,`category`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='用户品类最高得分汇总表 (流水线末尾刷新)';
+
 -- ----------------------------
 -- Table structure for dim_item
 -- ----------------------------
@@ -102,10 +149,50 @@ CREATE TABLE `model_metrics` (
   `precision_val` float NOT NULL COMMENT '准确率 (Precision)',
   `recall_val` float NOT NULL COMMENT '召回率 (Recall)',
   `f1_val` float NOT NULL COMMENT 'F1值',
+  `ndcg_val` float DEFAULT NULL COMMENT 'NDCG@K',
+  `map_val` float DEFAULT NULL COMMENT 'MAP@K',
+  `hit_rate` float DEFAULT NULL COMMENT '命中率 (至少命中一个商品的用户占比)',
+  `coverage` float DEFAULT NULL COMMENT '商品库覆盖率',
+  `k_value` int DEFAULT NULL COMMENT '截断位置 K',
   `test_date` timestamp NULL DEFAULT CURRENT_TIMESTAMP COMMENT '实验执行时间',
   PRIMARY KEY (`id`)
 ) ENGINE=InnoDB AUTO_INCREMENT=9 DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='模型对比实验指标表';
 
+-- ----------------------------
+-- Table structure for model_segment_metrics
+-- ----------------------------
+DROP TABLE IF EXISTS `model_segment_metrics`;
+CREATE TABLE `model_segment_metrics` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `model_type` varchar(50) NOT NULL COMMENT '模型类型',
+  `segment` int NOT NULL COMMENT '用户分群 (usr_persona.cluster_label, -1 为未分群)',
+  `user_count` int NOT NULL COMMENT '参与评估的用户数',
+  `precision_val` float NOT NULL COMMENT '准确率 (Precision@K)',
+  `recall_val` float NOT NULL COMMENT '召回率 (Recall@K)',
+  `f1_val` float NOT NULL COMMENT 'F1值',
+  `ndcg_val` float DEFAULT NULL COMMENT 'NDCG@K',
+  `map_val` float DEFAULT NULL COMMENT 'MAP@K',
+  `hit_rate` float DEFAULT NULL COMMENT '命中率',
+  `test_date` timestamp NULL DEFAULT CURRENT_TIMESTAMP COMMENT '实验执行时间',
+  PRIMARY KEY (`id`),
+  KEY `idx_model_segment` (`model_type`,`segment`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='模型分群对比指标表';
+
+-- ----------------------------
+-- Table structure for popular_items_segment
+-- ----------------------------
+DROP TABLE IF EXISTS `popular_items_segment`;
+CREATE TABLE `popular_items_segment` (
+  `segment_type` varchar(30) NOT NULL COMMENT '分群维度: global / cluster_label / preferred_category / consumption_level',
+  `segment_value` varchar(100) NOT NULL COMMENT '分群取值 (global 维度固定为 global)',
+  `item_id` varchar(50) NOT NULL COMMENT '商品ID',
+  `category` varchar(100) DEFAULT NULL COMMENT '商品品类',
+  `score` double DEFAULT NULL COMMENT '分群内隐式反馈加权得分之和',
+  `rank` int NOT NULL COMMENT '分群内热度排名',
+  `created_at` timestamp NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (`segment_type`,`segment_value`,`rank`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='分群热门商品榜 (冷启动兜底)';
+
 -- ----------------------------
 -- Table structure for recommendation_results
 -- ----------------------------
@@ -139,6 +226,58 @@ CREATE TABLE `rf_sensitivity_metrics` (
   KEY `idx_rf_threshold` (`threshold`)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='随机森林模型阈值敏感度分析表';
 
+-- ----------------------------
+-- Table structure for sys_data_version
+-- ----------------------------
+DROP TABLE IF EXISTS `sys_data_version`;
+CREATE TABLE `sys_data_version` (
+  `id` int NOT NULL COMMENT '固定为 1 (单行)',
+  `version` bigint NOT NULL COMMENT '全局数据版本号，写库后递增，用于看板缓存失效',
+  `reason` varchar(100) DEFAULT NULL COMMENT '最近一次变更来源 (表名 / 阶段名)',
+  `updated_at` double DEFAULT NULL COMMENT '最近一次变更时间 (Unix 时间戳)',
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='全局数据版本号 (STATE_BACKEND=db)';
+
+-- ----------------------------
+-- Table structure for sys_job
+-- ----------------------------
+DROP TABLE IF EXISTS `sys_job`;
+CREATE TABLE `sys_job` (
+  `job_id` varchar(32) NOT NULL COMMENT '任务ID',
+  `kind` varchar(30) NOT NULL COMMENT '任务类型: ingest / persona / recommend / rebuild',
+  `state` varchar(20) NOT NULL COMMENT '任务状态',
+  `payload` mediumtext NOT NULL COMMENT '完整任务记录 (JSON，含分阶段进度)',
+  `cancel_requested` tinyint(1) NOT NULL DEFAULT '0' COMMENT '是否已请求取消',
+  `created_at` double NOT NULL COMMENT '创建时间 (Unix 时间戳)',
+  `updated_at` double NOT NULL COMMENT '最近更新时间 (Unix 时间戳)',
+  PRIMARY KEY (`job_id`),
+  KEY `idx_job_created` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='流水线任务记录 (STATE_BACKEND=db)';
+
+-- ----------------------------
+-- Table structure for sys_job_event
+-- ----------------------------
+DROP TABLE IF EXISTS `sys_job_event`;
+CREATE TABLE `sys_job_event` (
+  `id` bigint NOT NULL AUTO_INCREMENT COMMENT '事件序号，SSE 接口按序号增量读取',
+  `job_id` varchar(32) NOT NULL COMMENT '任务ID',
+  `payload` text NOT NULL COMMENT '事件内容 (JSON)',
+  PRIMARY KEY (`id`),
+  KEY `idx_event_job` (`job_id`,`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='流水线任务事件流 (STATE_BACKEND=db)';
+
+-- ----------------------------
+-- Table structure for sys_lock
+-- ----------------------------
+DROP TABLE IF EXISTS `sys_lock`;
+CREATE TABLE `sys_lock` (
+  `name` varchar(50) NOT NULL COMMENT '锁名称 (如 pipeline)',
+  `owner` varchar(64) DEFAULT NULL COMMENT '持有者 (任务ID)，为空表示未被持有',
+  `expires_at` double DEFAULT NULL COMMENT '租约到期时间 (Unix 时间戳)',
+  `acquired_at` double DEFAULT NULL COMMENT '获取时间 (Unix 时间戳)',
+  PRIMARY KEY (`name`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_0900_ai_ci COMMENT='带租约的命名锁 (STATE_BACKEND=db)';
+
 -- ----------------------------
 -- Table structure for usr_persona
 -- ----------------------------
@@ -0,0 +1,107 @@
+"""
+看板图表的物化汇总表
+
+品类覆盖人数、画像分群 / 消费等级人数、用户 × 品类最高得分原本由接口在每次请求时
+对 recommendation_results / usr_persona 全表 GROUP BY 得到，耗时随数据量线性增长。
+这里在流水线末尾把结果预先汇总到 agg_* 表，接口只读小表，延迟与数据规模无关。
+
+刷新按分区增量进行：每个分区 (画像表、每个模型的推荐结果) 记录其来源数据集的指纹，
+来源未变化的分区直接跳过；本次运行中刚产出的结果直接使用内存中的 DataFrame 汇总，
+只有被跳过的上游阶段才回退到数据库读取对应分区。
+"""
+import pandas as pd
+from sqlalchemy import text
+
+from src.database import get_engine
+from src.pipeline_manifest import PipelineManifest
+from src.recommendation.evaluate import EVAL_MODELS
+from src.response_cache import bump_data_version
+
+# 汇总分区 -> 来源数据集 (与流水线清单中的数据集名称一致)
+PERSONA_SOURCE = "usr_persona"
+
+
+def _result_source(model):
+    return f"recommendation_results:{model}"
+
+
+def _agg_key(source):
+    return f"agg:{source}"
+
+
+def refresh_persona_aggregates(persona_df=None):
+    """
+    刷新画像分群人数与消费等级人数
+    :param persona_df: 本次画像阶段的结果 (user_id, cluster_label, consumption_level)，为空时从数据库读取
+    """
+    if persona_df is None:
+        persona_df = pd.read_sql("SELECT user_id, cluster_label, consumption_level FROM usr_persona", get_engine("analytics"))
+
+    cluster_counts = persona_df.groupby('cluster_label')['user_id'].nunique().reset_index(name='user_count')
+    level_counts = persona_df.groupby('consumption_level')['user_id'].nunique().reset_index(name='user_count')
+
+    with get_engine("bulk_write").begin() as conn:
+        conn.execute(text("DELETE FROM agg_persona_cluster"))
+        conn.execute(text("DELETE FROM agg_consumption_level"))
+        cluster_counts.to_sql('agg_persona_cluster', con=conn, if_exists='append', index=False)
+        level_counts.to_sql('agg_consumption_level', con=conn, if_exists='append', index=False)
+    print(f"✅ 画像汇总表已刷新 ({len(cluster_counts)} 个分群, {len(level_counts)} 个消费等级)。")
+
+
+def refresh_model_aggregates(model, result_df=None):
+    """
+    刷新单个模型的品类覆盖人数与用户 × 品类最高得分，只替换该模型对应的行
+    :param result_df: 本次运行产出的推荐结果 (user_id, category, score)，为空时只读取该模型的分区
+    """
+    if result_df is None:
+        result_df = pd.read_sql(
+            text("SELECT user_id, category, score FROM recommendation_results WHERE model_type = :mtype"),
+            get_engine("analytics"), params={"mtype": model})
+
+    coverage = result_df.groupby('category')['user_id'].nunique().reset_index(name='user_count')
+    coverage.insert(0, 'model_type', model)
+    user_scores = result_df.groupby(['user_id', 'category'])['score'].max().reset_index(name='max_score')
+    user_scores.insert(1, 'model_type', model)
+
+    with get_engine("bulk_write").begin() as conn:
+        conn.execute(text("DELETE FROM agg_category_coverage WHERE model_type = :mtype"), {"mtype": model})
+        conn.execute(text("DELETE FROM agg_user_category_score WHERE model_type = :mtype"), {"mtype": model})
+        coverage.to_sql('agg_category_coverage', con=conn, if_exists='append', index=False)
+        user_scores.to_sql('agg_user_category_score', con=conn, if_exists='append', index=False,
+                           method='multi', chunksize=2000)
+    print(f"✅ {model} 汇总表已刷新 ({len(coverage)} 个品类, {len(user_scores)} 条用户品类得分)。")
+
+
+def refresh_aggregates(handoff=None, force=False):
+    """
+    流水线末尾的汇总刷新入口：来源指纹未变化的分区跳过
+    :param handoff: EvaluationHandoff，携带本次运行中刚产出的画像 / 推荐结果
+    :param force: 忽略指纹，全部分区重新汇总
+    """
+    manifest = PipelineManifest()
+    datasets = manifest.snapshot()['datasets']
+    refreshed = {}
+
+    def stale(source):
+        # 来源指纹未知 (如数据不是通过流水线写入) 时总是刷新
+        fingerprint = datasets.get(source)
+        return force or fingerprint is None or datasets.get(_agg_key(source)) != fingerprint
+
+    if stale(PERSONA_SOURCE):
+        refresh_persona_aggregates(handoff.personas if handoff is not None else None)
+        refreshed[_agg_key(PERSONA_SOURCE)] = datasets.get(PERSONA_SOURCE)
+
+    for model in EVAL_MODELS:
+        source = _result_source(model)
+        if not stale(source):
+            continue
+        result_df = handoff.results.get(model) if handoff is not None else None
+        refresh_model_aggregates(model, result_df)
+        refreshed[_agg_key(source)] = datasets.get(source)
+
+    if refreshed:
+        manifest.record_datasets(refreshed)
+        bump_data_version("aggregates")
+    else:
+        print("⏭️ 汇总表来源数据均未变化，跳过刷新。")
+    return list(refreshed)
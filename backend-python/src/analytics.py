@@ -0,0 +1,166 @@
+"""
+流水线的分析型查询后端
+
+画像聚类、User-CF、随机森林和热门榜阶段都要对星型模型做全表扫描和多表关联。
+这类查询放在行存的 MySQL 上很慢，而且会占用线上服务的连接。
+设置 ANALYTICS_BACKEND=duckdb 后：
+- 入库时把 dim_user / dim_item / fact_user_behavior 镜像为 Parquet 文件 (ANALYTICS_DIR)，
+  画像阶段写完 usr_persona 后同样镜像一份
+- 流水线的扫描 / 关联查询改由进程内嵌的 DuckDB 在这些 Parquet 文件上执行 (列式、向量化、多线程)，
+  结果直接转换为 pandas DataFrame
+- MySQL 仍然保存服务用的表，推荐结果、指标等写入不受影响
+
+镜像与业务库保持一致的约定：写业务库之前先删除对应的镜像文件，提交成功后再写入新镜像。
+镜像缺失 (未安装 duckdb、镜像写入失败或数据并非经本系统入库) 时自动回退到业务库查询。
+每个镜像文件先写临时文件再原子替换，正在执行的查询不会读到写了一半的文件。
+"""
+import os
+import threading
+import time
+from pathlib import Path
+
+import pandas as pd
+
+from src.database import get_engine
+
+ANALYTICS_BACKEND = os.getenv("ANALYTICS_BACKEND", "sql")
+ANALYTICS_DIR = Path(os.getenv("ANALYTICS_DIR", "runtime/analytics"))
+# DuckDB 执行线程数，0 表示使用全部 CPU
+ANALYTICS_THREADS = int(os.getenv("ANALYTICS_THREADS", "0"))
+# iter_analytics 每块的行数
+ANALYTICS_CHUNK_ROWS = int(os.getenv("ANALYTICS_CHUNK_ROWS", "200000"))
+
+# 入库环节镜像的源表
+STAR_SCHEMA_TABLES = ("dim_user", "dim_item", "fact_user_behavior")
+
+_backend = ANALYTICS_BACKEND
+_warned = threading.Event()
+
+
+def set_analytics_backend(name):
+    """切换当前进程使用的分析后端 (sql / duckdb)，供压测脚本对比"""
+    global _backend
+    if name not in ("sql", "duckdb"):
+        raise ValueError(f"未知的 ANALYTICS_BACKEND: {name} (可选 sql / duckdb)")
+    _backend = name
+
+
+def analytics_backend():
+    return _backend
+
+
+def _duckdb():
+    """duckdb 为可选依赖；未安装时返回 None 并回退到业务库"""
+    try:
+        import duckdb
+        return duckdb
+    except ImportError:
+        if not _warned.is_set():
+            _warned.set()
+            print("⚠️ 未安装 duckdb，分析查询回退到业务库 (pip install duckdb)")
+        return None
+
+
+def _table_path(name):
+    return ANALYTICS_DIR / f"{name}.parquet"
+
+
+def mirror_enabled():
+    return _backend == "duckdb" and _duckdb() is not None
+
+
+def invalidate_mirror(*tables):
+    """业务库中的表即将被改写：先删除镜像，查询回退到业务库，避免读到旧数据"""
+    for name in tables:
+        _table_path(name).unlink(missing_ok=True)
+
+
+def mirror_table(name, df):
+    """
+    把刚写入业务库的 DataFrame 镜像为 Parquet 文件
+    镜像失败只影响查询速度 (回退到业务库)，不影响流水线结果
+    """
+    if not mirror_enabled():
+        return False
+    duckdb = _duckdb()
+    path = _table_path(name)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        ANALYTICS_DIR.mkdir(parents=True, exist_ok=True)
+        start = time.perf_counter()
+        with duckdb.connect() as con:
+            con.register("source_df", df)
+            con.execute(f"COPY (SELECT * FROM source_df) TO '{tmp}' (FORMAT PARQUET)")
+        os.replace(tmp, path)
+        print(f"🦆 已镜像 {name} ({len(df)} 行, {time.perf_counter() - start:.2f}s)")
+        return True
+    except Exception as e:
+        tmp.unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
+        print(f"⚠️ 分析镜像写入失败 ({name})，该表查询将回退到业务库: {e}")
+        return False
+
+
+def _mirrored(tables):
+    return mirror_enabled() and all(_table_path(name).exists() for name in tables)
+
+
+def _open_mirror(con, tables, query, params):
+    """在 DuckDB 连接上注册镜像视图并执行查询，返回结果游标"""
+    if ANALYTICS_THREADS > 0:
+        con.execute(f"SET threads = {ANALYTICS_THREADS}")
+    for name in tables:
+        con.execute(f"CREATE VIEW {name} AS SELECT * FROM read_parquet('{_table_path(name)}')")
+    if params:
+        # DuckDB 使用 $name 形式的命名参数
+        for key in params:
+            query = query.replace(f":{key}", f"${key}")
+        return con.execute(query, params)
+    return con.execute(query)
+
+
+def read_analytics(query, tables, params=None):
+    """
+    执行流水线的分析查询
+    :param query: 只使用标准 SQL (两种后端通用)，表名与业务库一致
+    :param tables: 查询涉及的表；任一表没有镜像时整条查询回退到业务库
+    :param params: 命名参数 (:name)，两种后端都支持
+    """
+    if _mirrored(tables):
+        with _duckdb().connect() as con:
+            return _open_mirror(con, tables, query, params).df()
+
+    from sqlalchemy import text
+    return pd.read_sql(text(query), get_engine("analytics"), params=params)
+
+
+def iter_analytics(query, tables, params=None, chunk_rows=ANALYTICS_CHUNK_ROWS):
+    """
+    分块执行分析查询，逐块产出约 chunk_rows 行的 DataFrame，结果集不会整体载入内存
+    DuckDB 按向量 (2048 行) 批量取数；业务库使用服务端游标
+    """
+    if _mirrored(tables):
+        with _duckdb().connect() as con:
+            result = _open_mirror(con, tables, query, params)
+            vectors = max(1, chunk_rows // 2048)
+            while True:
+                chunk = result.fetch_df_chunk(vectors)
+                if chunk.empty:
+                    return
+                yield chunk
+
+    from sqlalchemy import text
+    with get_engine("analytics").connect() as conn:
+        conn = conn.execution_options(stream_results=True)
+        yield from pd.read_sql(text(query), conn, params=params, chunksize=chunk_rows)
+
+
+def mirror_status():
+    """各镜像表的大小与更新时间"""
+    status = {}
+    for name in STAR_SCHEMA_TABLES + ("usr_persona",):
+        path = _table_path(name)
+        if path.exists():
+            stat = path.stat()
+            status[name] = {"bytes": stat.st_size, "updated_at": stat.st_mtime}
+    return status
@@ -0,0 +1,309 @@
+"""
+用户 / 商品特征库
+
+画像、User-CF、随机森林三个阶段原本各自对 fact_user_behavior x dim_user x dim_item 做一次全量联查，
+再重复计算 pv / 加购 / 收藏 / 点赞汇总、品类偏好、商品价格折扣等重叠特征，每次重构同样的扫描要跑三遍。
+特征库阶段 (流水线 features 阶段) 每个数据版本只计算一次，产出五张表：
+- user_features:  dim_user 属性 + 行为汇总 (交互数、各计数之和、交互率 / 购买意向均值、最大点击间隔、
+                  所购商品平均折扣) + 偏好品类
+- item_features:  dim_item 属性 + 按固定品类表展开的独热列 (category_<品类>)
+- user_category:  用户 x 品类亲和度 (交互数、pv 之和)
+- interactions:   用户 x 商品隐式反馈得分 (User-CF 的稀疏矩阵输入，口径同 IMPLICIT_SCORE_SQL)
+- user_items:     用户 x 商品行为计数之和 (随机森林预测特征) 与是否为评估真值 (label = 1 或 purchase_intent = 1)
+聚合通过 read_analytics 下推到 DuckDB 镜像 / 业务库执行，pandas 只接收聚合后的结果。
+user_id / item_id 为 ID 字典的 int32 编码，数值列为紧凑类型，品类为共享同一类目表的 category。
+
+存储为列式文件：每张表一个目录，每列一个 .npy (category 列保存 int16 编码)，读取时可只加载需要的列；
+含 user_id 的表按 user_id 排序，可按用户以内存映射方式只读取对应的行。
+每次构建写入新的版本目录，再原子替换 CURRENT 指针；meta.json 记录源数据指纹与品类表。
+品类表只追加不删除，新数据中出现的新品类追加在末尾，已有品类的编码与独热列在版本之间保持不变。
+"""
+import json
+import os
+import shutil
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from src.analytics import read_analytics
+from src.id_dictionary import get_id_dictionary, encode_ids, compact_dtypes
+
+FEATURE_STORE_DIR = Path(os.getenv("FEATURE_STORE_DIR", "runtime/features"))
+
+# 保留的历史版本数 (含当前版本)
+KEEP_VERSIONS = 2
+
+FEATURE_TABLES = ("user_features", "item_features", "user_category", "interactions", "user_items")
+
+_POINTER = "CURRENT"
+
+# 用户行为汇总 (画像特征口径：商品折扣取所交互商品的均值)
+USER_BEHAVIOR_QUERY = """
+        SELECT b.user_id,
+               COUNT(*)                        as n_interactions,
+               SUM(COALESCE(b.pv_count, 0))    as pv_count,
+               SUM(COALESCE(b.add2cart, 0))    as add2cart,
+               SUM(COALESCE(b.collect_num, 0)) as collect_num,
+               SUM(COALESCE(b.like_num, 0))    as like_num,
+               AVG(b.interaction_rate)         as interaction_rate,
+               AVG(b.purchase_intent)          as purchase_intent,
+               MAX(b.last_click_gap)           as last_click_gap,
+               AVG(i.discount_rate)            as item_discount
+        FROM fact_user_behavior b
+                 JOIN dim_item i ON b.item_id = i.item_id
+        GROUP BY b.user_id
+        """
+
+USER_CATEGORY_QUERY = """
+        SELECT b.user_id,
+               i.category,
+               COUNT(*)                     as n_interactions,
+               SUM(COALESCE(b.pv_count, 0)) as pv_count
+        FROM fact_user_behavior b
+                 JOIN dim_item i ON b.item_id = i.item_id
+        GROUP BY b.user_id, i.category
+        """
+
+USER_ITEM_QUERY = """
+        SELECT user_id,
+               item_id,
+               SUM(COALESCE(pv_count, 0))    as pv_count,
+               SUM(COALESCE(add2cart, 0))    as add2cart,
+               SUM(COALESCE(collect_num, 0)) as collect_num,
+               SUM(COALESCE(like_num, 0))    as like_num,
+               MAX(CASE WHEN label = 1 OR purchase_intent = 1 THEN 1 ELSE 0 END) as relevant
+        FROM fact_user_behavior
+        GROUP BY user_id, item_id
+        """
+
+ITEM_QUERY = """
+        SELECT item_id, category, price, discount_rate, title_length, title_emo_score, img_count, has_video
+        FROM dim_item
+        """
+
+
+def _interactions_query():
+    from src.recommendation.baseline_user_cf import IMPLICIT_SCORE_SQL, IMPLICIT_FILTER_SQL
+
+    return f"""
+        SELECT user_id, item_id, SUM({IMPLICIT_SCORE_SQL}) as score
+        FROM fact_user_behavior
+        WHERE {IMPLICIT_FILTER_SQL}
+        GROUP BY user_id, item_id
+        """
+
+
+def one_hot_columns(categories):
+    """独热列名，与 pd.get_dummies(prefix='category') 一致"""
+    return [f"category_{c}" for c in categories]
+
+
+# ==========================================================
+# 计算
+# ==========================================================
+
+def _category_vocabulary(observed, previous=None):
+    """在上一版本品类表的末尾追加新出现的品类"""
+    vocab = list(previous or [])
+    known = set(vocab)
+    vocab += sorted(c for c in set(observed) if c is not None and c not in known)
+    return vocab
+
+
+def compute_features(ids, previous_categories=None):
+    """
+    计算全部特征表
+    :return: (tables {name: DataFrame}, categories 品类表)
+    """
+    items = read_analytics(ITEM_QUERY, tables=("dim_item",))
+    categories = _category_vocabulary(items['category'].dropna().unique(), previous_categories)
+    category_dtype = pd.CategoricalDtype(categories)
+
+    # 商品特征：属性 + 对齐到品类表的独热列
+    items = compact_dtypes(encode_ids(items, ids), categories={'category': category_dtype})
+    dummies = pd.get_dummies(items['category'], prefix='category').astype(np.uint8)
+    item_features = pd.concat([items, dummies[one_hot_columns(categories)]], axis=1)
+
+    # 用户 x 品类亲和度
+    user_category = read_analytics(USER_CATEGORY_QUERY, tables=("fact_user_behavior", "dim_item"))
+    user_category = compact_dtypes(encode_ids(user_category, ids), categories={'category': category_dtype})
+
+    # 用户特征：维度属性 + 行为汇总 + 偏好品类 (交互次数最多的品类，次数相同时取品类名最小者)
+    users = compact_dtypes(encode_ids(read_analytics("SELECT * FROM dim_user", tables=("dim_user",)), ids))
+    behavior = read_analytics(USER_BEHAVIOR_QUERY, tables=("fact_user_behavior", "dim_item"))
+    behavior = compact_dtypes(encode_ids(behavior, ids))
+    preferred = (user_category.dropna(subset=['category'])
+                 .assign(name=lambda d: d['category'].astype(str))
+                 .sort_values(['user_id', 'n_interactions', 'name'], ascending=[True, False, True])
+                 .drop_duplicates('user_id')
+                 .set_index('user_id')['category'])
+    user_features = users.merge(behavior, on='user_id', how='left')
+    user_features['n_interactions'] = user_features['n_interactions'].fillna(0).astype(np.int32)
+    user_features['preferred_category'] = preferred.reindex(user_features['user_id']).to_numpy()
+    user_features['preferred_category'] = user_features['preferred_category'].astype(category_dtype)
+    user_features = compact_dtypes(user_features.sort_values('user_id', ignore_index=True))
+
+    interactions = read_analytics(_interactions_query(), tables=("fact_user_behavior",))
+    interactions = compact_dtypes(encode_ids(interactions, ids)).sort_values(
+        ['user_id', 'item_id'], ignore_index=True)
+
+    user_items = read_analytics(USER_ITEM_QUERY, tables=("fact_user_behavior",))
+    user_items = compact_dtypes(encode_ids(user_items, ids)).sort_values(['user_id', 'item_id'], ignore_index=True)
+
+    tables = {
+        "user_features": user_features,
+        "item_features": item_features.sort_values('item_id', ignore_index=True),
+        "user_category": user_category.sort_values(['user_id', 'category'], ignore_index=True),
+        "interactions": interactions,
+        "user_items": user_items,
+    }
+    return tables, categories
+
+
+# ==========================================================
+# 存储
+# ==========================================================
+
+def _write_table(directory, df):
+    """每列一个 .npy；category 列保存 int16 编码，文本列保存为定长字符串，均无需 pickle"""
+    directory.mkdir(parents=True)
+    columns = []
+    for col in df.columns:
+        series = df[col]
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            values, kind = series.cat.codes.to_numpy().astype(np.int16), "category"
+        elif pd.api.types.is_object_dtype(series) or pd.api.types.is_string_dtype(series):
+            values, kind = np.asarray(series.astype(str), dtype=str), "str"
+        else:
+            values, kind = series.to_numpy(), "num"
+        np.save(directory / f"{col}.npy", values)
+        columns.append({"name": col, "kind": kind})
+    (directory / "schema.json").write_text(json.dumps({"columns": columns, "rows": len(df)}), encoding='utf-8')
+
+
+def build_feature_store(root=None):
+    """计算并发布新版本特征库，返回版本元数据"""
+    root = Path(root or FEATURE_STORE_DIR)
+    start = time.perf_counter()
+    ids = get_id_dictionary()
+    current = current_version(root)
+    tables, categories = compute_features(ids, current["categories"] if current else None)
+
+    # 版本名精确到微秒：_cleanup 按版本名排序，同一秒内的多次构建也要按构建顺序排列
+    now = time.time()
+    version = f"{time.strftime('%Y%m%d%H%M%S', time.localtime(now))}{int(now % 1 * 1e6):06d}-{uuid.uuid4().hex[:8]}"
+    staging = root / f".{version}.tmp"
+    staging.mkdir(parents=True)
+    try:
+        for name, df in tables.items():
+            _write_table(staging / name, df)
+        meta = {
+            "version": version,
+            "source": ids.fingerprint,
+            "created_at": time.time(),
+            "categories": categories,
+            "tables": {name: len(df) for name, df in tables.items()},
+        }
+        (staging / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+        os.replace(staging, root / version)
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+
+    pointer_tmp = root / f".{_POINTER}.tmp"
+    pointer_tmp.write_text(version, encoding='utf-8')
+    os.replace(pointer_tmp, root / _POINTER)
+    _cleanup(root, keep=version)
+
+    summary = ", ".join(f"{name} {rows} 行" for name, rows in meta["tables"].items())
+    print(f"🗃️ 特征库已发布: {version} ({summary}, {time.perf_counter() - start:.2f}s)")
+    return meta
+
+
+def _cleanup(root, keep):
+    versions = sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    for path in versions[:-KEEP_VERSIONS]:
+        if path.name != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+def current_version(root=None):
+    """当前版本的元数据，不存在时返回 None"""
+    root = Path(root or FEATURE_STORE_DIR)
+    try:
+        version = (root / _POINTER).read_text(encoding='utf-8').strip()
+        return json.loads((root / version / "meta.json").read_text(encoding='utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def get_feature_store():
+    """
+    各阶段使用的特征库版本：与当前 ID 字典 (即源数据) 指纹一致时直接使用，
+    否则 (阶段单独调用、特征文件丢失) 先重新构建
+    """
+    meta = current_version()
+    if meta is not None and meta["source"] == get_id_dictionary().fingerprint:
+        return meta
+    print("⚠️ 特征库缺失或已过期，正在重新构建...")
+    return build_feature_store()
+
+
+def _user_rows(directory, users):
+    """按 user_id 排序的表中属于 users 的行号 (user_id 列以内存映射方式二分查找)"""
+    user_col = np.load(directory / "user_id.npy", mmap_mode='r')
+    users = np.unique(np.asarray(users))
+    start = np.searchsorted(user_col, users, side='left')
+    lengths = np.searchsorted(user_col, users, side='right') - start
+    offsets = np.cumsum(lengths) - lengths
+    return np.repeat(start - offsets, lengths) + np.arange(lengths.sum())
+
+
+def load_features(name, columns=None, users=None):
+    """
+    读取特征表
+    :param columns: 只加载指定列 (列式存储，未请求的列不读盘)
+    :param users: 只读取这些用户 (user_id 编码) 的行；列文件以内存映射方式打开，只有对应的行会被读入内存
+    """
+    if name not in FEATURE_TABLES:
+        raise ValueError(f"未知的特征表: {name}")
+    try:
+        return _read_table(get_feature_store(), name, columns, users)
+    except FileNotFoundError:
+        # 读取期间又完成了多次构建，该版本已被 _cleanup 删除 (只保留 KEEP_VERSIONS 个版本)：按最新版本重读一次
+        return _read_table(get_feature_store(), name, columns, users)
+
+
+def _read_table(meta, name, columns, users):
+    directory = FEATURE_STORE_DIR / meta["version"] / name
+    schema = json.loads((directory / "schema.json").read_text(encoding='utf-8'))
+    category_dtype = pd.CategoricalDtype(meta["categories"])
+    rows = None
+    if users is not None:
+        if not any(col["name"] == "user_id" for col in schema["columns"]):
+            raise ValueError(f"特征表 {name} 不含 user_id，不能按用户读取")
+        rows = _user_rows(directory, users)
+
+    data = {}
+    for col in schema["columns"]:
+        key = col["name"]
+        if columns is not None and key not in columns:
+            continue
+        if rows is None:
+            values = np.load(directory / f"{key}.npy", allow_pickle=False)
+        else:
+            values = np.load(directory / f"{key}.npy", mmap_mode='r')[rows]
+        if col["kind"] == "category":
+            values = pd.Categorical.from_codes(values, dtype=category_dtype)
+        elif col["kind"] == "str":
+            values = values.astype(object)
+        data[key] = values
+    return pd.DataFrame(data)
+
+
+def feature_categories():
+    """当前版本的品类表 (独热列顺序)"""
+    return get_feature_store()["categories"]
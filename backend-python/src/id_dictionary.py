@@ -0,0 +1,198 @@
+"""
+用户 / 商品 ID 字典与紧凑数据类型
+
+user_id / item_id 是 U00000001 这样的字符串，作为 object 列在画像、User-CF、随机森林、评估各阶段之间
+反复关联、分组，再叠加默认的 float64，流水线的内存占用是实际数据量的数倍。
+- 入库时由 dim_user / dim_item 生成 ID 字典：按字符串排序后依次编号为稠密的 int32 编码
+  (编码顺序与字符串顺序一致)，以 npz 文件保存在 ID_DICT_PATH，并记录生成时的源数据指纹
+- 各阶段读入数据后立即用 encode_ids 把 ID 列换成编码，关联、分组、稀疏矩阵都在 int32 上完成，
+  只在写库 / 交给服务文件之前用 decode_ids 解码回字符串
+- compact_dtypes 把数值列压缩为 float32 / int8 / int16 / int32，低基数文本列转换为 category
+  (业务库中相应字段本身就是单精度 float，压缩不损失落库精度)
+
+源数据指纹变化 (重新入库) 后旧字典自动失效；字典缺失或失效时 get_id_dictionary() 从维度表重建并保存。
+"""
+import os
+import threading
+from decimal import Decimal
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_float_dtype, is_integer_dtype, is_object_dtype
+
+from src.pipeline_manifest import PipelineManifest
+
+ID_DICT_PATH = Path(os.getenv("ID_DICT_PATH", "runtime/ids/id_dictionary.npz"))
+
+# 编码的 ID 列 -> 字典中的取值表
+ID_COLUMNS = ("user_id", "item_id")
+
+_cache = {"mtime": None, "ids": None}
+_cache_lock = threading.Lock()
+
+
+class IdDictionary:
+    def __init__(self, users, items, fingerprint=""):
+        # 已排序、去重的字符串 ID，位置即编码
+        self.users = pd.Index(users, dtype=object)
+        self.items = pd.Index(items, dtype=object)
+        self.fingerprint = fingerprint or ""
+
+    @classmethod
+    def from_ids(cls, user_ids, item_ids, fingerprint=""):
+        return cls(_sorted_unique(user_ids), _sorted_unique(item_ids), fingerprint)
+
+    def _values(self, column):
+        if column == "user_id":
+            return self.users
+        if column == "item_id":
+            return self.items
+        raise ValueError(f"未知的 ID 列: {column}")
+
+    def encode(self, column, values):
+        """字符串 ID -> int32 编码，字典中不存在的 ID 编码为 -1"""
+        values = pd.Index(values, dtype=object).astype(str)
+        return self._values(column).get_indexer(values).astype(np.int32)
+
+    def decode(self, column, codes):
+        """int32 编码 -> 字符串 ID 数组"""
+        return self._values(column).to_numpy()[np.asarray(codes, dtype=np.int64)]
+
+    def save(self, path=ID_DICT_PATH):
+        """先写临时文件再原子替换，其他进程不会读到写了一半的字典"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            with open(tmp, 'wb') as f:
+                np.savez(f, users=_to_bytes(self.users), items=_to_bytes(self.items),
+                         fingerprint=np.array(self.fingerprint))
+            os.replace(tmp, path)
+        except BaseException:
+            tmp.unlink(missing_ok=True)
+            raise
+
+    @classmethod
+    def load(cls, path=ID_DICT_PATH):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(np.char.decode(data['users'], 'utf-8').astype(object),
+                       np.char.decode(data['items'], 'utf-8').astype(object),
+                       str(data['fingerprint']))
+
+    def __len__(self):
+        return len(self.users) + len(self.items)
+
+
+def _sorted_unique(values):
+    return np.unique(np.asarray(pd.Series(values, dtype=object).dropna().astype(str), dtype=str)).astype(object)
+
+
+def _to_bytes(index):
+    """定长 UTF-8 字节串，无需 pickle 即可保存与加载"""
+    return np.asarray([v.encode('utf-8') for v in index], dtype=bytes)
+
+
+def _source_fingerprint():
+    return PipelineManifest().snapshot()["datasets"].get("dim_user") or ""
+
+
+def build_id_dictionary(user_ids, item_ids, fingerprint=None):
+    """入库环节调用：由新写入的维度表生成并保存字典"""
+    ids = IdDictionary.from_ids(user_ids, item_ids,
+                                _source_fingerprint() if fingerprint is None else fingerprint)
+    ids.save()
+    print(f"🔢 ID 字典已生成 (用户 {len(ids.users)}, 商品 {len(ids.items)})")
+    return ids
+
+
+def load_id_dictionary():
+    """读取已保存的字典 (按文件修改时间缓存)；文件不存在时返回 None"""
+    try:
+        mtime = ID_DICT_PATH.stat().st_mtime_ns
+    except FileNotFoundError:
+        return None
+    with _cache_lock:
+        if _cache["mtime"] != mtime:
+            _cache["ids"] = IdDictionary.load(ID_DICT_PATH)
+            _cache["mtime"] = mtime
+        return _cache["ids"]
+
+
+def get_id_dictionary():
+    """
+    流水线各阶段使用的字典：已保存且与当前源数据指纹一致时直接使用，
+    否则 (数据并非经本系统入库、字典文件丢失) 从维度表重建并保存
+    """
+    from src.analytics import read_analytics
+
+    fingerprint = _source_fingerprint()
+    ids = load_id_dictionary()
+    if ids is not None and ids.fingerprint == fingerprint:
+        return ids
+    print("⚠️ ID 字典缺失或已过期，正在从维度表重建...")
+    users = read_analytics("SELECT user_id FROM dim_user", tables=("dim_user",))['user_id']
+    items = read_analytics("SELECT item_id FROM dim_item", tables=("dim_item",))['item_id']
+    return build_id_dictionary(users, items, fingerprint)
+
+
+def encode_ids(df, ids, columns=ID_COLUMNS):
+    """
+    把 df 中的 ID 列替换为 int32 编码 (已是整数编码的列跳过)
+    字典中不存在的 ID 所在行被丢弃并打印提示 (维度表有外键约束，正常情况下不会出现)
+    """
+    keep = None
+    for col in columns:
+        if col not in df.columns or is_integer_dtype(df[col]):
+            continue
+        codes = ids.encode(col, df[col])
+        df[col] = codes
+        known = codes >= 0
+        keep = known if keep is None else keep & known
+    if keep is not None and not keep.all():
+        print(f"⚠️ {int((~keep).sum())} 行的 ID 不在字典中，已忽略")
+        df = df[keep].reset_index(drop=True)
+    return df
+
+
+def decode_ids(df, ids, columns=ID_COLUMNS):
+    """把 int32 编码的 ID 列还原为字符串 (写库、发布服务文件之前调用)"""
+    for col in columns:
+        if col in df.columns and is_integer_dtype(df[col]):
+            df[col] = ids.decode(col, df[col])
+    return df
+
+
+def compact_dtypes(df, categories=None):
+    """
+    原地压缩数据类型：浮点 -> float32，整数按取值范围 -> int8 / int16 / int32，
+    MySQL DECIMAL 读入的 Decimal 对象列 -> float32；ID 列不变
+    :param categories: {列名: CategoricalDtype 或 None}，转换为 category；
+                       传入共享的 CategoricalDtype 可让多张表的品类编码保持一致
+    """
+    categories = categories or {}
+    for col in df.columns:
+        if col in ID_COLUMNS:
+            continue
+        series = df[col]
+        if col in categories:
+            df[col] = series.astype(categories[col] or 'category')
+        elif is_bool_dtype(series):
+            continue
+        elif is_float_dtype(series):
+            df[col] = series.astype(np.float32)
+        elif is_integer_dtype(series):
+            df[col] = pd.to_numeric(series, downcast='integer')
+        elif is_object_dtype(series) and isinstance(_first_valid(series), Decimal):
+            df[col] = series.astype(np.float32)
+    return df
+
+
+def _first_valid(series):
+    index = series.first_valid_index()
+    return None if index is None else series[index]
+
+
+def frame_memory(df):
+    """DataFrame 的实际内存占用 (字节，含字符串对象本身)"""
+    return int(df.memory_usage(deep=True).sum())
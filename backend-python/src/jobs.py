@@ -0,0 +1,305 @@
+"""
+流水线任务执行子系统
+
+- 每个任务拥有唯一 job_id，任务记录、事件与取消标记保存在共享状态存储中 (src.state_store)，
+  多个 uvicorn worker / 多台主机看到的是同一份状态
+- 任务在独立的进程池中执行，CPU 密集的聚类 / 训练不再占用 API 事件循环
+- 同一时刻全局只允许一个流水线任务运行 (single-flight)：由共享存储中的带租约命名锁保证，
+  执行任务的工作进程定期续约，进程崩溃后租约到期自动释放
+- 取消采用协作式：等待中的任务直接撤销，运行中的任务在下一个阶段开始前终止
+- 阶段进度事件 (src.progress) 追加写入每个任务的事件文件，供 SSE 接口推送
+- 任务或环境变量开启剖析时，每个阶段的性能剖析结果写入 PROFILE_DIR (src.profiler)
+"""
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from src import progress
+from src.metrics import StageMetricsStore, track_peak_rss
+from src.profiler import profile_section, stage_enabled
+from src.state_store import get_state_store, make_state_store
+
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+
+# 流水线 single-flight 锁的名称与租约 (秒)；工作进程每 1/3 租约续约一次
+PIPELINE_LOCK = "pipeline"
+PIPELINE_LOCK_TTL = float(os.getenv("PIPELINE_LOCK_TTL", "120"))
+
+TERMINAL_STATES = ("success", "failed", "cancelled")
+
+
+class JobCancelled(Exception):
+    """任务被用户取消"""
+
+
+class JobContext:
+    """
+    任务在工作进程内的执行上下文：记录阶段进度并检查取消请求
+    工作进程是任务启动后任务记录的唯一写入方
+    """
+
+    def __init__(self, job, store):
+        self.job = job
+        self.store = store
+        # 互不依赖的阶段会在多个线程中并发执行
+        self._lock = threading.Lock()
+
+    @property
+    def job_id(self):
+        return self.job['id']
+
+    def _save(self):
+        self.store.save(self.job)
+
+    def check_cancelled(self):
+        if self.store.cancel_requested(self.job_id):
+            raise JobCancelled(f"任务 {self.job_id} 已被取消")
+
+    @contextmanager
+    def stage(self, name):
+        """阶段上下文：进入前检查取消请求，退出时记录耗时、结果及阶段指标 (行数 / 峰值内存)"""
+        self.start_stage(name)
+        state = "success"
+        started = time.perf_counter()
+        try:
+            with track_peak_rss() as rss, \
+                    profile_section("stage", name, stage_enabled(name, self.job.get('profile', False))):
+                yield
+        except BaseException:
+            state = "failed"
+            raise
+        finally:
+            self.finish_stage(name, state=state)
+            try:
+                StageMetricsStore().record(name, state, round(time.perf_counter() - started, 3),
+                                           rows=progress.stage_rows(name), peak_rss=rss['peak'])
+            except Exception as e:
+                print(f"⚠️ 阶段指标写入失败: {e}")
+
+    def start_stage(self, name):
+        self.check_cancelled()
+        with self._lock:
+            stage = self._stage(name)
+            stage.update(state="running", started_at=time.time())
+            self.job['current_stage'] = name
+            self._save()
+        progress.start_stage(name)
+        self.store.append_event(self.job_id, {"type": "stage", "stage": name, "state": "running", "ts": time.time()})
+
+    def finish_stage(self, name, state="success"):
+        with self._lock:
+            stage = self._stage(name)
+            stage['finished_at'] = time.time()
+            stage['state'] = state
+            stage['duration'] = round(stage['finished_at'] - stage.get('started_at', stage['finished_at']), 3)
+            done = sum(1 for s in self.job['stages'] if s['state'] in ("success", "skipped"))
+            self.job['progress'] = round(done / len(self.job['stages']) * 100, 1)
+            running = [s['name'] for s in self.job['stages'] if s['state'] == "running"]
+            self.job['current_stage'] = running[0] if running else None
+            self._save()
+        self.store.append_event(self.job_id, {
+            "type": "stage", "stage": name, "state": state, "duration": stage['duration'],
+            "progress": self.job['progress'], "ts": stage['finished_at'],
+        })
+
+    def skip_stage(self, name, reason):
+        self.check_cancelled()
+        with self._lock:
+            self._stage(name).update(state="skipped", reason=reason, started_at=time.time())
+        self.finish_stage(name, state="skipped")
+
+    def _stage(self, name):
+        for stage in self.job['stages']:
+            if stage['name'] == name:
+                return stage
+        stage = {"name": name, "state": "pending"}
+        self.job['stages'].append(stage)
+        return stage
+
+
+@contextmanager
+def _hold_lease(store, job_id):
+    """任务执行期间定期续约 single-flight 锁，结束后释放"""
+    stop = threading.Event()
+
+    def renew():
+        while not stop.wait(PIPELINE_LOCK_TTL / 3):
+            if not store.refresh_lock(PIPELINE_LOCK, job_id, PIPELINE_LOCK_TTL):
+                print(f"⚠️ 任务 {job_id} 的运行锁已失效 (租约过期后被其他任务获取)")
+                return
+
+    thread = threading.Thread(target=renew, daemon=True)
+    thread.start()
+    try:
+        yield
+    finally:
+        stop.set()
+        thread.join()
+        store.release_lock(PIPELINE_LOCK, job_id)
+
+
+def _run_job(job_id, store_config):
+    """工作进程入口：按任务类型调度流水线，并落盘最终状态"""
+    from src import pipeline
+
+    store = make_state_store(**store_config)
+    with _hold_lease(store, job_id):
+        return _execute_job(pipeline, store, job_id)
+
+
+def _execute_job(pipeline, store, job_id):
+    job = store.load(job_id)
+    ctx = JobContext(job, store)
+    job.update(state="running", started_at=time.time(), pid=os.getpid())
+    store.save(job)
+    progress.set_sink(lambda event: store.append_event(job_id, event))
+    try:
+        pipeline.PIPELINES[job['kind']](ctx, **job['params'])
+        job['state'] = "success"
+        job['progress'] = 100.0
+    except JobCancelled as e:
+        job['state'] = "cancelled"
+        job['error'] = str(e)
+    except Exception as e:
+        job['state'] = "failed"
+        job['error'] = str(e)
+        print(f"❌ 任务 {job_id} 执行中断: {e}")
+    finally:
+        for stage in job['stages']:
+            if stage['state'] == "running":
+                stage['state'] = job['state']
+        job['finished_at'] = time.time()
+        job['current_stage'] = None
+        progress.clear_sink()
+        # 先写结束事件再落盘终态：读到终态的订阅方一定也能读到结束事件
+        store.append_event(job_id, {"type": "job", "state": job['state'], "error": job.get('error'),
+                                    "ts": job['finished_at']})
+        store.save(job)
+    return job['state']
+
+
+class JobManager:
+    """API 进程内的任务调度器"""
+
+    def __init__(self, store=None, max_workers=JOB_WORKERS):
+        self.store = store or get_state_store()
+        self.max_workers = max_workers
+        self._executor = None
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn：避免从多线程的 API 进程 fork 出状态不一致的子进程
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+    def _holder_finished(self, job_id):
+        """持有锁的任务已结束 (如被取消或工作进程异常退出后补记了终态) 时，锁可以被回收"""
+        job = self.store.load(job_id)
+        return job is not None and job['state'] in TERMINAL_STATES
+
+    def active_job(self):
+        holder = self.store.lock_holder(PIPELINE_LOCK)
+        if holder is None:
+            return None
+        job = self.store.load(holder)
+        if job is None or job['state'] in TERMINAL_STATES:
+            return None
+        return job
+
+    def _create(self, kind, params, stages, profile=False):
+        """获取全局 single-flight 锁并创建任务记录；已有任务运行时返回 (None, active_job)"""
+        job_id = uuid.uuid4().hex
+        acquired, holder = self.store.acquire_lock(
+            PIPELINE_LOCK, job_id, PIPELINE_LOCK_TTL, is_stale=self._holder_finished)
+        if not acquired:
+            # 持有方可能刚获取锁、尚未写入任务记录
+            return None, self.store.load(holder) or {"id": holder, "state": "pending"}
+
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "params": params or {},
+            "state": "pending",
+            "progress": 0.0,
+            "current_stage": None,
+            "stages": [{"name": name, "state": "pending"} for name in stages],
+            "created_at": time.time(),
+            "error": None,
+            "profile": bool(profile),
+        }
+        self.store.save(job)
+        return job, None
+
+    def run_inline(self, kind, params=None, stages=(), profile=False):
+        """
+        在当前线程同步执行任务 (压测脚本、测试等独立进程使用)，同样受 single-flight 约束并产生进度事件
+        会替换当前进程的进度上报目标，API 进程中应使用 submit
+        :return: (执行完成后的 job, None)；(None, active_job) 已有任务在运行
+        """
+        with self._lock:
+            job, active = self._create(kind, params, stages, profile)
+        if job is None:
+            return None, active
+        _run_job(job['id'], self.store.config())
+        return self.store.load(job['id']), None
+
+    def submit(self, kind, params=None, stages=(), profile=False):
+        """
+        提交流水线任务
+        :param profile: 剖析该任务的每个阶段
+        :return: (job, None) 提交成功；(None, active_job) 已有任务在运行
+        """
+        with self._lock:
+            job, active = self._create(kind, params, stages, profile)
+            if job is None:
+                return None, active
+            future = self._get_executor().submit(_run_job, job['id'], self.store.config())
+            self._futures[job['id']] = future
+            future.add_done_callback(lambda f, job_id=job['id']: self._on_done(job_id, f))
+            return job, None
+
+    def _on_done(self, job_id, future):
+        """工作进程异常退出 (如被 OOM 杀掉) 时补记失败状态，避免任务永久停留在运行中"""
+        self._futures.pop(job_id, None)
+        if future.cancelled() or future.exception() is None:
+            return
+        job = self.store.load(job_id)
+        if job is not None and job['state'] not in TERMINAL_STATES:
+            job.update(state="failed", finished_at=time.time(), error=f"工作进程异常退出: {future.exception()}")
+            self.store.save(job)
+        self.store.release_lock(PIPELINE_LOCK, job_id)
+        if isinstance(future.exception(), BrokenProcessPool):
+            # 进程池已损坏，下次提交时重建
+            self._executor = None
+
+    def get(self, job_id):
+        return self.store.load(job_id)
+
+    def list(self, limit=20):
+        return self.store.list(limit)
+
+    def cancel(self, job_id):
+        job = self.store.load(job_id)
+        if job is None or job['state'] in TERMINAL_STATES:
+            return job
+        self.store.request_cancel(job_id)
+        future = self._futures.get(job_id)
+        # 尚未开始执行的任务直接撤销
+        if future is not None and future.cancel():
+            job.update(state="cancelled", finished_at=time.time(), error="任务在开始前被取消")
+            self.store.save(job)
+            self.store.release_lock(PIPELINE_LOCK, job_id)
+        return job
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,281 @@
+"""
+Prometheus 文本格式的运行指标
+
+不依赖 prometheus_client 等外部库，只实现本项目用到的最小子集：
+- Counter / Histogram：API 进程内累计，/metrics 接口渲染
+- 采集回调 (collector)：渲染时现场读取的指标，如连接池占用、缓存命中数
+- StageMetricsStore：流水线阶段在任务工作进程中执行，阶段耗时 / 处理行数 / 峰值内存
+  写入共享的 JSON 文件 (文件锁保护)，API 进程渲染时读取
+"""
+import fcntl
+import json
+import os
+import resource
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+STAGE_METRICS_PATH = Path(os.getenv("STAGE_METRICS_PATH", "runtime/metrics/stages.json"))
+
+# 接口 / 查询耗时的直方图分桶 (秒)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 流水线阶段耗时的直方图分桶 (秒)
+STAGE_BUCKETS = (1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple((name, labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+                    break
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                lines.extend(render_histogram_series(self.name, key, self.buckets, series))
+        return lines
+
+
+def render_histogram_series(name, labels, buckets, series):
+    """按 Prometheus 约定输出累计分桶、_sum 与 _count"""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(buckets, series['counts']):
+        cumulative += count
+        lines.append(f"{name}_bucket{_format_labels(tuple(labels) + (('le', _format_value(float(bound))),))} "
+                     f"{cumulative}")
+    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(float(series['sum']))}")
+    lines.append(f"{name}_count{_format_labels(labels)} {series['count']}")
+    return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def add_collector(self, collector):
+        """collector() 返回若干行 Prometheus 文本，渲染时调用"""
+        self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        for collector in self._collectors:
+            try:
+                lines.extend(collector())
+            except Exception as e:
+                lines.append(f"# collector {getattr(collector, '__name__', collector)} failed: {_escape(e)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labelnames=()):
+    return REGISTRY.register(Counter(name, documentation, labelnames))
+
+
+def histogram(name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+    return REGISTRY.register(Histogram(name, documentation, labelnames, buckets))
+
+
+def gauge_lines(name, documentation, samples, kind="gauge"):
+    """
+    渲染一组由采集回调现场读取的值
+    :param samples: [(labels_tuple, value), ...]
+    :param kind: gauge / counter
+    """
+    lines = [f"# HELP {name} {documentation}", f"# TYPE {name} {kind}"]
+    lines.extend(f"{name}{_format_labels(labels)} {_format_value(value)}" for labels, value in samples)
+    return lines
+
+
+# ==========================================================
+# 数据库：查询耗时与连接池占用
+# ==========================================================
+
+DB_QUERY_SECONDS = histogram(
+    "db_query_duration_seconds", "SQL 语句执行耗时", labelnames=("operation",))
+
+
+def instrument_engine(engine, name="default"):
+    """为引擎挂载查询计时事件，并注册连接池占用的采集回调"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('_query_start', []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get('_query_start')
+        if starts:
+            operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else "UNKNOWN"
+            DB_QUERY_SECONDS.observe(time.perf_counter() - starts.pop(), operation=operation)
+
+    def pool_collector():
+        pool = engine.pool
+        samples = []
+        for state, method in (("size", "size"), ("checked_out", "checkedout"),
+                              ("checked_in", "checkedin"), ("overflow", "overflow")):
+            # SQLite 内存库等使用的连接池没有尺寸统计
+            if hasattr(pool, method):
+                samples.append(((("engine", name), ("state", state)), getattr(pool, method)()))
+        return gauge_lines("db_pool_connections", "数据库连接池连接数", samples)
+
+    REGISTRY.add_collector(pool_collector)
+
+
+# ==========================================================
+# 流水线阶段：跨进程共享的耗时 / 行数 / 峰值内存
+# ==========================================================
+
+def _current_rss():
+    """当前常驻内存 (字节)；没有 /proc 的平台退化为进程历史峰值"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+@contextmanager
+def track_peak_rss(interval=0.2):
+    """
+    阶段执行期间后台采样常驻内存，退出后 tracker['peak'] 为峰值 (字节)
+    同一进程内并发执行的阶段共享进程内存，峰值反映的是整个进程
+    """
+    tracker = {"peak": _current_rss()}
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            tracker['peak'] = max(tracker['peak'], _current_rss())
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+    try:
+        yield tracker
+    finally:
+        stop.set()
+        thread.join()
+        tracker['peak'] = max(tracker['peak'], _current_rss())
+
+
+class StageMetricsStore:
+    def __init__(self, path=STAGE_METRICS_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def record(self, stage, state, duration, rows=None, peak_rss=None):
+        with open(self.path.with_suffix('.lock'), 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                data = self._read()
+                entry = data.setdefault(stage, {
+                    "counts": [0] * (len(STAGE_BUCKETS) + 1), "sum": 0.0, "count": 0, "runs": {},
+                })
+                for i, bound in enumerate(STAGE_BUCKETS + (float('inf'),)):
+                    if duration <= bound:
+                        entry['counts'][i] += 1
+                        break
+                entry['sum'] += duration
+                entry['count'] += 1
+                entry['runs'][state] = entry['runs'].get(state, 0) + 1
+                entry['last_duration'] = duration
+                entry['last_rows'] = rows
+                entry['last_peak_rss'] = peak_rss
+                entry['last_finished_at'] = time.time()
+                tmp = self.path.with_suffix('.tmp')
+                tmp.write_text(json.dumps(data), encoding='utf-8')
+                os.replace(tmp, self.path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def render(self):
+        data = self._read()
+        lines = ["# HELP pipeline_stage_duration_seconds 流水线阶段耗时",
+                 "# TYPE pipeline_stage_duration_seconds histogram"]
+        for stage, entry in sorted(data.items()):
+            lines.extend(render_histogram_series(
+                "pipeline_stage_duration_seconds", (("stage", stage),), STAGE_BUCKETS + (float('inf'),), entry))
+        lines.extend(gauge_lines("pipeline_stage_runs_total", "流水线阶段执行次数 (按结果)", [
+            ((("stage", stage), ("state", state)), count)
+            for stage, entry in sorted(data.items()) for state, count in sorted(entry['runs'].items())
+        ], kind="counter"))
+        lines.extend(gauge_lines("pipeline_stage_last_rows", "最近一次执行处理的行数", [
+            ((("stage", stage),), entry['last_rows'])
+            for stage, entry in sorted(data.items()) if entry.get('last_rows') is not None
+        ]))
+        lines.extend(gauge_lines("pipeline_stage_last_peak_rss_bytes", "最近一次执行期间的进程峰值常驻内存", [
+            ((("stage", stage),), entry['last_peak_rss'])
+            for stage, entry in sorted(data.items()) if entry.get('last_peak_rss') is not None
+        ]))
+        return lines
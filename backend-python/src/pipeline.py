@@ -0,0 +1,307 @@
+"""
+流水线阶段定义：由 src.jobs 在独立的工作进程中调度执行
+
+全量重构被描述为一个有向无环图 (DAG)：每个阶段声明输入 / 输出数据集，
+依赖关系由“上游阶段的输出是否为本阶段的输入”自动推导，互不依赖的阶段并发执行。
+阶段指纹 = hash(阶段名, 参数, 全部输入数据集指纹)；与清单中上次成功执行的指纹一致时跳过，
+失败的任务重新提交后会从最后一个未完成的阶段继续。
+
+API 进程只需要 PIPELINE_STAGES 等定义，依赖 scikit-learn / joblib 的聚类与随机森林模块
+在阶段函数内延迟导入，只在任务工作进程中加载。
+"""
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from src.pipeline_manifest import PipelineManifest, combine_fingerprints
+from src.preprocessing.data_loader import process_and_load_csv
+from src.recommendation.baseline_user_cf import UserCFBaseline
+from src.recommendation.evaluate import evaluate_models, EvaluationHandoff, EVAL_MODELS
+from src.recommendation.serving import load_model_results
+from src.recommendation.serving_store import build_serving_store
+from src.recommendation.popularity import save_popularity
+from src.aggregates import refresh_aggregates
+
+# 同时执行的阶段数上限
+PIPELINE_MAX_PARALLEL = int(os.getenv("PIPELINE_MAX_PARALLEL", "2"))
+
+
+def _ensure_success(result):
+    """阶段函数以 (success, message) 返回结果时，失败即抛出异常以终止任务"""
+    if isinstance(result, tuple) and not result[0]:
+        raise RuntimeError(result[1])
+
+
+class Stage:
+    """
+    流水线阶段
+    :param inputs: 读取的数据集
+    :param outputs: 写入的数据集
+    :param defaults: 影响产出的参数及其默认值，参与指纹计算
+    :param options: 只影响执行方式、不影响产出的参数 (如执行后端)，不参与指纹计算
+    """
+
+    def __init__(self, name, func, inputs, outputs, defaults=None, options=None):
+        self.name = name
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.outputs = tuple(outputs)
+        self.defaults = defaults or {}
+        self.options = options or {}
+
+    def resolve_params(self, params):
+        return {key: params.get(key, default) for key, default in self.defaults.items()}
+
+    def resolve_options(self, params):
+        return {key: params.get(key, default) for key, default in self.options.items()}
+
+    def fingerprint(self, datasets, params):
+        """任一输入指纹未知 (如数据不是通过本系统入库) 时返回 None，该阶段总是重新执行"""
+        parts = [self.name, json.dumps(params, sort_keys=True)]
+        for name in self.inputs:
+            if datasets.get(name) is None:
+                return None
+            parts.append(f"{name}={datasets[name]}")
+        return combine_fingerprints(*parts)
+
+
+# ==========================================================
+# 阶段实现
+# ==========================================================
+
+def _features_stage(handoff):
+    # 0. 特征库：画像 / User-CF / 随机森林共用的用户、商品、品类亲和度特征，每个数据版本只计算一次
+    print(">>> 步骤 0: 正在构建特征库...")
+    from src.feature_store import build_feature_store
+    build_feature_store()
+
+
+def _persona_stage(handoff, n_clusters=4, backend=None):
+    # 1. 智慧画像建模
+    print(">>> 步骤 1: 正在构建智慧画像 (K-Means)...")
+    from src.profiling.cluster_model import train_user_clusters
+    _ensure_success(train_user_clusters(n_clusters=n_clusters, handoff=handoff, backend=backend))
+
+
+def _user_cf_stage(handoff, top_n=5):
+    # 2. 基准模型计算，使用动态传入的 top_n
+    print(f">>> 步骤 2: 正在执行 User-CF 基准模型 (Top {top_n})...")
+    cf_model = UserCFBaseline()
+    cf_model.save_results_to_db(top_n=top_n, handoff=handoff)
+
+
+def _rf_stage(handoff, top_n=5, threshold=0.6, incremental=False):
+    # 3. 核心推荐模型训练，透传 top_n 和 threshold 参数给随机森林模型；incremental 时在上一版本模型上增量更新
+    print(f">>> 步骤 3: 正在训练优化版随机森林推荐模型 (Top {top_n}, Threshold {threshold})...")
+    from src.recommendation.rf_ranker import train_recommendation_model
+    _ensure_success(train_recommendation_model(top_n=top_n, threshold=threshold, handoff=handoff,
+                                               incremental=incremental))
+
+
+def _evaluate_stage(handoff):
+    # 4. 实验对比评价：上游在本次运行中产出的结果直接从内存交接，被跳过的阶段回退到数据库读取
+    print(">>> 步骤 4: 正在生成实验对比指标...")
+    evaluate_models(handoff=handoff)
+
+
+def _popularity_stage(handoff, popular_top_k=50):
+    # 分群热门榜：冷启动 / 低于阈值用户的兜底推荐
+    print(">>> 正在统计分群热门榜...")
+    save_popularity(top_k=popular_top_k)
+
+
+def _aggregates_stage(handoff):
+    # 5. 刷新看板汇总表：只重算来源数据有变化的分区
+    print(">>> 步骤 5: 正在刷新看板汇总表...")
+    refresh_aggregates(handoff=handoff)
+
+
+def _serving_stage(handoff):
+    # 6. 发布推荐服务文件：本次运行产出的结果直接取自内存，其余模型从数据库读取
+    print(">>> 步骤 6: 正在发布推荐服务文件...")
+    frames = {}
+    for model in EVAL_MODELS:
+        df = handoff.results.get(model)
+        if df is None:
+            df = load_model_results(model)
+        if not df.empty:
+            frames[model] = df
+    if not frames:
+        print("⚠️ 没有可发布的推荐结果，跳过服务文件生成。")
+        return
+    build_serving_store(frames)
+
+
+STAGES = {
+    "features": Stage(
+        "features", _features_stage,
+        inputs=("dim_user", "fact_user_behavior", "dim_item"),
+        outputs=("feature_store",),
+    ),
+    "persona": Stage(
+        "persona", _persona_stage,
+        inputs=("dim_user", "fact_user_behavior", "dim_item", "feature_store"),
+        outputs=("usr_persona",),
+        defaults={"n_clusters": 4},
+        options={"backend": None},
+    ),
+    "popularity": Stage(
+        "popularity", _popularity_stage,
+        inputs=("fact_user_behavior", "usr_persona", "dim_item"),
+        outputs=("popular_items_segment",),
+        defaults={"popular_top_k": 50},
+    ),
+    "user_cf": Stage(
+        "user_cf", _user_cf_stage,
+        inputs=("fact_user_behavior", "dim_item", "feature_store"),
+        outputs=("recommendation_results:User-CF",),
+        defaults={"top_n": 5},
+    ),
+    "rf": Stage(
+        "rf", _rf_stage,
+        inputs=("fact_user_behavior", "usr_persona", "dim_item", "feature_store"),
+        outputs=("recommendation_results:RF-Optimized", "rf_model", "rf_sensitivity_metrics", "kmeans_metrics"),
+        defaults={"top_n": 5, "threshold": 0.6, "incremental": False},
+    ),
+    "evaluate": Stage(
+        "evaluate", _evaluate_stage,
+        inputs=("fact_user_behavior", "usr_persona", "dim_item",
+                "recommendation_results:User-CF", "recommendation_results:RF-Optimized"),
+        outputs=("model_metrics", "model_segment_metrics"),
+    ),
+    "aggregates": Stage(
+        "aggregates", _aggregates_stage,
+        inputs=("usr_persona", "recommendation_results:User-CF", "recommendation_results:RF-Optimized"),
+        outputs=("agg_tables",),
+    ),
+    "serving": Stage(
+        "serving", _serving_stage,
+        inputs=("recommendation_results:User-CF", "recommendation_results:RF-Optimized"),
+        outputs=("serving_store",),
+    ),
+}
+
+# 任务类型 -> 包含的阶段
+PIPELINE_STAGES = {
+    "ingest": ("ingest",),
+    "persona": ("features", "persona", "popularity", "aggregates"),
+    "recommend": ("features", "rf", "aggregates", "serving"),
+    "rebuild": ("features", "persona", "popularity", "user_cf", "rf", "evaluate", "aggregates", "serving"),
+}
+
+
+def _dependencies(stage_names):
+    """在本次运行的阶段集合内，依据输入 / 输出推导每个阶段的上游阶段"""
+    producers = {}
+    for name in stage_names:
+        for output in STAGES[name].outputs:
+            producers[output] = name
+    return {
+        name: {producers[i] for i in STAGES[name].inputs if i in producers and producers[i] != name}
+        for name in stage_names
+    }
+
+
+def run_dag(ctx, stage_names, params, force=False, max_parallel=PIPELINE_MAX_PARALLEL):
+    """
+    按依赖关系调度阶段：就绪阶段并发执行，指纹未变化的阶段跳过
+    :param force: 忽略指纹强制重新执行全部阶段
+    """
+    manifest = PipelineManifest()
+    handoff = EvaluationHandoff()
+    deps = _dependencies(stage_names)
+    done, failed = set(), None
+    timings = {}
+    started_at = time.time()
+
+    def execute(stage, stage_params, stage_options, fingerprint):
+        if not force and fingerprint is not None:
+            recorded = manifest.snapshot()
+            last = recorded['stages'].get(stage.name, {})
+            if last.get('fingerprint') == fingerprint and all(
+                    recorded['datasets'].get(o) == fingerprint for o in stage.outputs):
+                ctx.skip_stage(stage.name, "输入未变化")
+                print(f"⏭️ 阶段 {stage.name} 输入未变化，跳过。")
+                return {"skipped": True, "duration": 0.0}
+
+        t0 = time.perf_counter()
+        with ctx.stage(stage.name):
+            stage.func(handoff, **stage_params, **stage_options)
+        duration = round(time.perf_counter() - t0, 3)
+        manifest.record_stage(stage.name, fingerprint, stage.outputs, duration)
+        return {"skipped": False, "duration": duration}
+
+    print("\n" + "=" * 30)
+    try:
+        with ThreadPoolExecutor(max_workers=max_parallel) as executor:
+            running = {}
+            while len(done) < len(stage_names):
+                if failed is None:
+                    for name in stage_names:
+                        if name in done or name in running.values() or not deps[name] <= done:
+                            continue
+                        stage = STAGES[name]
+                        stage_params = stage.resolve_params(params)
+                        fingerprint = stage.fingerprint(manifest.snapshot()['datasets'], stage_params)
+                        stage_options = stage.resolve_options(params)
+                        running[executor.submit(execute, stage, stage_params, stage_options, fingerprint)] = name
+                if not running:
+                    if failed is None:
+                        raise RuntimeError(f"流水线存在无法满足的依赖: {sorted(set(stage_names) - done)}")
+                    break
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name = running.pop(future)
+                    try:
+                        timings[name] = future.result()
+                        done.add(name)
+                    except Exception as e:
+                        timings[name] = {"skipped": False, "error": str(e)}
+                        # 已在运行的阶段允许执行完毕，不再调度新阶段
+                        failed = failed or e
+        if failed is not None:
+            raise failed
+    finally:
+        manifest.record_run({
+            "job_id": ctx.job_id,
+            "stages": timings,
+            "started_at": started_at,
+            "duration": round(time.time() - started_at, 3),
+            "state": "success" if failed is None and len(done) == len(stage_names) else "failed",
+        })
+
+    summary = ", ".join(f"{n} {t['duration']}s" + (" (跳过)" if t['skipped'] else "") for n, t in timings.items())
+    print("=" * 30)
+    print(f"✅ 流水线已完成（阶段耗时: {summary}）。")
+
+
+def run_ingest(ctx, file_path, force=False, backend=None):
+    """数据入库任务：源数据集指纹由入库函数自行登记，不参与 DAG 调度"""
+    with ctx.stage("ingest"):
+        _ensure_success(process_and_load_csv(file_path, backend=backend))
+
+
+def run_persona(ctx, force=False, **params):
+    """独立画像分析任务"""
+    print("正在执行独立画像分析...")
+    run_dag(ctx, PIPELINE_STAGES["persona"], params, force=force)
+
+
+def run_recommend(ctx, force=False, **params):
+    """独立推荐模型训练任务 (随机森林)"""
+    print("正在执行独立推荐模型训练...")
+    run_dag(ctx, PIPELINE_STAGES["recommend"], params, force=force)
+
+
+def run_rebuild(ctx, force=False, **params):
+    """全量重构流水线：支持动态参数透传"""
+    run_dag(ctx, PIPELINE_STAGES["rebuild"], params, force=force)
+
+
+PIPELINES = {
+    "ingest": run_ingest,
+    "persona": run_persona,
+    "recommend": run_recommend,
+    "rebuild": run_rebuild,
+}
@@ -0,0 +1,104 @@
+"""
+流水线数据血缘清单
+
+记录每个数据集 (源表 / 阶段产出) 的内容指纹、各阶段最近一次成功执行时的输入指纹，
+以及每次运行的分阶段耗时。清单以 JSON 文件保存，读改写过程持有文件锁，
+数据入库 (API 进程) 与流水线任务 (工作进程) 可以安全地并发更新。
+"""
+import fcntl
+import hashlib
+import json
+import os
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+MANIFEST_PATH = Path(os.getenv("PIPELINE_MANIFEST", "runtime/pipeline/manifest.json"))
+
+# 由数据入库环节产出的源数据集
+SOURCE_DATASETS = ("dim_user", "dim_item", "fact_user_behavior")
+
+# 保留的运行历史条数
+MAX_RUN_HISTORY = 50
+
+
+def file_fingerprint(file_path, chunk_size=1 << 20):
+    """按内容计算文件指纹 (sha256)"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def combine_fingerprints(*parts):
+    """将若干字符串组合为一个新的指纹"""
+    return hashlib.sha256("|".join(parts).encode('utf-8')).hexdigest()
+
+
+class PipelineManifest:
+    def __init__(self, path=MANIFEST_PATH):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock_path = self.path.with_suffix('.lock')
+
+    @contextmanager
+    def _locked(self):
+        with open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self):
+        try:
+            return json.loads(self.path.read_text(encoding='utf-8'))
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"datasets": {}, "stages": {}, "runs": []}
+
+    def _write(self, data):
+        tmp = self.path.with_suffix('.tmp')
+        tmp.write_text(json.dumps(data, ensure_ascii=False, indent=1), encoding='utf-8')
+        os.replace(tmp, self.path)
+
+    @contextmanager
+    def update(self):
+        """读改写事务：with manifest.update() as data: ..."""
+        with self._locked():
+            data = self._read()
+            yield data
+            self._write(data)
+
+    def snapshot(self):
+        with self._locked():
+            return self._read()
+
+    def record_datasets(self, fingerprints):
+        with self.update() as data:
+            data['datasets'].update(fingerprints)
+
+    def reset_sources(self, fingerprints):
+        """
+        源表整体替换后调用：登记新的源数据指纹，并清除全部派生数据集与阶段记录
+        入库会清空画像表与画像汇总表，即使重新上传的是同一文件 (源指纹不变)，下游阶段也必须重新执行
+        """
+        with self.update() as data:
+            data['datasets'] = dict(fingerprints)
+            data['stages'] = {}
+
+    def record_stage(self, name, fingerprint, outputs, duration):
+        """阶段成功后记录其输入指纹，并把产出数据集的指纹设为同一值"""
+        with self.update() as data:
+            data['stages'][name] = {
+                "fingerprint": fingerprint,
+                "finished_at": time.time(),
+                "duration": duration,
+            }
+            for output in outputs:
+                data['datasets'][output] = fingerprint
+
+    def record_run(self, run):
+        with self.update() as data:
+            data['runs'].append(run)
+            data['runs'] = data['runs'][-MAX_RUN_HISTORY:]
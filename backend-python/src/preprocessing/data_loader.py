@@ -1,57 +1,135 @@
 import pandas as pd
 from sqlalchemy import text
-from src.database import SessionLocal, engine
+from src.database import get_engine, truncate_tables
+from src.pipeline_manifest import PipelineManifest, SOURCE_DATASETS, file_fingerprint
+from src import progress
+from src.response_cache import bump_data_version
+from src.analytics import STAR_SCHEMA_TABLES, invalidate_mirror, mirror_enabled, mirror_table
+from src.spark_backend import resolve_backend
+from src.id_dictionary import build_id_dictionary
 
+# 事实表分批写入的行数，每批写完上报一次进度
+FACT_WRITE_BATCH = 5000
 
-def process_and_load_csv(file_path):
+# 核心字段
+REQUIRED_COLS = ['user_id', 'item_id', 'purchase_intent', 'interaction_rate']
+# 维度表1：dim_user (去重并提取静态属性)
+USER_COLS = ['user_id', 'age', 'gender', 'user_level', 'register_days',
+             'total_spend', 'purchase_freq', 'follow_num', 'fans_num']
+# 维度表2：dim_item (去重并提取商品属性)
+ITEM_COLS = ['item_id', 'category', 'price', 'discount_rate',
+             'title_length', 'title_emo_score', 'img_count', 'has_video']
+# 事实表：fact_user_behavior (动态交互数据)
+BEHAVIOR_COLS = ['user_id', 'item_id', 'pv_count', 'add2cart', 'collect_num',
+                 'like_num', 'comment_num', 'share_num', 'coupon_received',
+                 'coupon_used', 'interaction_rate', 'purchase_intent',
+                 'last_click_gap', 'label']
+
+
+def _truncate_star_schema(conn):
+    # --- 先清理旧数据，防止主键冲突 ---
+    # 注意顺序：由于有外键约束，必须先删事实表，再删维度表
+    # 画像汇总表随画像表一起清空，避免看板展示旧数据的分群人数
+    truncate_tables(conn, "fact_user_behavior", "usr_persona", "agg_persona_cluster",
+                    "agg_consumption_level", "dim_user", "dim_item")
+
+
+def _record_ingest(file_path, user_ids, item_ids):
+    # 源表已整体替换 (画像表同时被清空)，依赖旧数据的接口缓存全部失效
+    bump_data_version("ingest")
+    # 记录源数据指纹并清除全部派生数据集 / 阶段指纹：入库清空了画像表与汇总表，
+    # 重新上传同一文件时下游阶段也不能沿用旧指纹跳过
+    fingerprint = file_fingerprint(file_path)
+    PipelineManifest().reset_sources({name: fingerprint for name in SOURCE_DATASETS})
+    # 与源数据同一指纹的 ID 字典，流水线各阶段据此把字符串 ID 编码为 int32
+    build_id_dictionary(user_ids, item_ids, fingerprint)
+
+
+def process_and_load_csv(file_path, backend=None):
     """
     接收文件路径，执行清洗、分表并入库
+    :param backend: 执行后端 pandas / spark，为空时使用 EXECUTION_BACKEND
     """
     try:
+        if resolve_backend(backend) == "spark":
+            return _load_csv_with_spark(file_path)
+
         # 1. 加载全量数据 (10,000条)
         df = pd.read_csv(file_path)
+        progress.emit("ingest", 0, rows=0, total=len(df), message="CSV 读取完成")
 
         # 2. 核心字段校验
-        required_cols = ['user_id', 'item_id', 'purchase_intent', 'interaction_rate']
-        if not all(col in df.columns for col in required_cols):
+        if not all(col in df.columns for col in REQUIRED_COLS):
             return False, "核心字段缺失，请检查CSV格式。"
 
-        # 3. 维度表1：dim_user (去重并提取静态属性)
-        # 包含：user_id, age, gender, user_level, register_days, total_spend, purchase_freq 等
-        user_cols = ['user_id', 'age', 'gender', 'user_level', 'register_days',
-                     'total_spend', 'purchase_freq', 'follow_num', 'fans_num']
-        dim_user_df = df[user_cols].drop_duplicates(subset=['user_id'])
-
-        # 4. 维度表2：dim_item (去重并提取商品属性)
-        # 包含：item_id, category, price, discount_rate, has_video 等
-        item_cols = ['item_id', 'category', 'price', 'discount_rate',
-                     'title_length', 'title_emo_score', 'img_count', 'has_video']
-        dim_item_df = df[item_cols].drop_duplicates(subset=['item_id'])
-
-        # 5. 事实表：fact_user_behavior (动态交互数据)
-        # 包含：pv_count, add2cart, collect_num, interaction_rate, purchase_intent, label 等
-        behavior_cols = ['user_id', 'item_id', 'pv_count', 'add2cart', 'collect_num',
-                         'like_num', 'comment_num', 'share_num', 'coupon_received',
-                         'coupon_used', 'interaction_rate', 'purchase_intent',
-                         'last_click_gap', 'label']
-        fact_behavior_df = df[behavior_cols]
-
-        with engine.begin() as conn:
-            # --- 新增步骤：先清理旧数据，防止主键冲突 ---
-            # 注意顺序：由于有外键约束，必须先删事实表，再删维度表
-            conn.execute(text("SET FOREIGN_KEY_CHECKS = 0;"))
-            conn.execute(text("TRUNCATE TABLE fact_user_behavior;"))
-            conn.execute(text("TRUNCATE TABLE usr_persona;"))
-            conn.execute(text("TRUNCATE TABLE dim_user;"))
-            conn.execute(text("TRUNCATE TABLE dim_item;"))
-            conn.execute(text("SET FOREIGN_KEY_CHECKS = 1;"))
+        # 3. 维度表去重，事实表保留全部交互记录
+        dim_user_df = df[USER_COLS].drop_duplicates(subset=['user_id'])
+        dim_item_df = df[ITEM_COLS].drop_duplicates(subset=['item_id'])
+        fact_behavior_df = df[BEHAVIOR_COLS]
+
+        # 分析镜像先失效，业务库提交后再按新数据重建 (画像表随源表一起清空)
+        invalidate_mirror(*STAR_SCHEMA_TABLES, "usr_persona")
+
+        with get_engine("bulk_write").begin() as conn:
+            _truncate_star_schema(conn)
 
             # --- 执行写入 ---
             dim_user_df.to_sql('dim_user', con=conn, if_exists='append', index=False)
             dim_item_df.to_sql('dim_item', con=conn, if_exists='append', index=False)
-            fact_behavior_df.to_sql('fact_user_behavior', con=conn, if_exists='append', index=False)
+            total = len(fact_behavior_df)
+            for start in range(0, total, FACT_WRITE_BATCH):
+                fact_behavior_df.iloc[start:start + FACT_WRITE_BATCH].to_sql(
+                    'fact_user_behavior', con=conn, if_exists='append', index=False)
+                written = min(start + FACT_WRITE_BATCH, total)
+                progress.emit("ingest", written / total * 100, rows=written, total=total)
+
+            if mirror_enabled():
+                # 镜像需要与业务库一致的自增主键 (随机森林按 behavior_id 排序抽样并作为增量水位线)，
+                # 表已清空且按顺序写入，自增值与行顺序一一对应
+                behavior_ids = conn.execute(text(
+                    "SELECT behavior_id FROM fact_user_behavior ORDER BY behavior_id")).scalars().all()
+                fact_behavior_df = fact_behavior_df.assign(behavior_id=behavior_ids)
+
+        _record_ingest(file_path, dim_user_df['user_id'], dim_item_df['item_id'])
+        for name, table_df in zip(STAR_SCHEMA_TABLES, (dim_user_df, dim_item_df, fact_behavior_df)):
+            mirror_table(name, table_df)
 
         return True, f"成功刷新数据库！已处理 {len(fact_behavior_df)} 条记录。"
 
     except Exception as e:
-        return False, f"入库异常: {str(e)}"
\ No newline at end of file
+        return False, f"入库异常: {str(e)}"
+
+
+def _load_csv_with_spark(file_path):
+    """
+    Spark 执行后端：并行解析与分表，经 JDBC 分区并发写入
+    各分区分别提交，清空与写入不在同一事务内；写入中途失败时重新执行入库即可。
+    不生成分析镜像 (流水线查询回退到业务库)。
+    """
+    from src.spark_backend import read_source_csv, split_star_schema, write_table
+
+    source = read_source_csv(file_path)
+    try:
+        tables = split_star_schema(source)
+        if tables is None:
+            return False, "核心字段缺失，请检查CSV格式。"
+        total = tables["fact_user_behavior"].count()
+        progress.emit("ingest", 0, rows=0, total=total, message="CSV 读取完成")
+
+        invalidate_mirror(*STAR_SCHEMA_TABLES, "usr_persona")
+        with get_engine("bulk_write").begin() as conn:
+            _truncate_star_schema(conn)
+
+        # 先写维度表再写事实表，与外键方向一致
+        for pct, name in ((10, "dim_user"), (20, "dim_item"), (100, "fact_user_behavior")):
+            write_table(tables[name], name)
+            progress.emit("ingest", pct, rows=total if name == "fact_user_behavior" else 0, total=total,
+                          message=f"{name} 写入完成")
+        # 维度表去重后的 ID 列规模与用户 / 商品数相当，收集到驱动端生成字典
+        user_ids = tables["dim_user"].select('user_id').toPandas()['user_id']
+        item_ids = tables["dim_item"].select('item_id').toPandas()['item_id']
+    finally:
+        source.unpersist()
+
+    _record_ingest(file_path, user_ids, item_ids)
+    return True, f"成功刷新数据库！已处理 {total} 条记录 (Spark)。"
\ No newline at end of file
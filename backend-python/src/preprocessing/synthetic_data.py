@@ -0,0 +1,203 @@
+"""
+合成数据生成器：按指定规模生成与 data/raw/test.csv 同构 (32 列) 的行为数据
+
+用法 (在 backend-python 目录下):
+    python -m src.preprocessing.synthetic_data --rows 1m --out runtime/synthetic/1m.csv
+    python -m src.preprocessing.synthetic_data --rows 50m --out /data/50m.csv --chunk-rows 2m
+
+分布参考样例数据：
+- 用户属性 (年龄、等级、消费额等) 按用户固定，同一用户的多条记录属性一致，入库去重后与维度表对应
+- 用户活跃度服从对数正态分布，商品热度服从幂律 (Zipf)，少数商品占据大部分交互
+- 商品的品类占比与样例数据一致，交互计数为长尾分布
+- label 由加购、用券、浏览、收藏等信号加噪声打分后按 label_rate 截断，模型可以学到有效信号
+
+结果只由 (rows, seed, users, items, chunk_rows 等参数) 决定：用户 / 商品属性使用固定的随机流，
+第 k 个分块使用 (seed, k) 派生的随机流，相同参数重复生成的文件逐字节一致。
+按分块流式写出，内存占用与 chunk_rows 及用户 / 商品数成正比，与总行数无关。
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+# 与 test.csv 一致的列顺序
+COLUMNS = [
+    'user_id', 'item_id', 'age', 'gender', 'user_level', 'purchase_freq', 'total_spend',
+    'register_days', 'follow_num', 'fans_num', 'price', 'discount_rate', 'category',
+    'title_length', 'title_emo_score', 'img_count', 'has_video', 'like_num', 'comment_num',
+    'share_num', 'collect_num', 'is_follow_author', 'add2cart', 'coupon_received',
+    'coupon_used', 'pv_count', 'last_click_gap', 'interaction_rate', 'purchase_intent',
+    'freshness_score', 'social_influence', 'label',
+]
+
+# 样例数据中的品类占比
+CATEGORY_MIX = {
+    "服饰鞋包": 0.39, "美妆个护": 0.22, "数码家电": 0.14,
+    "食品生鲜": 0.12, "家居日用": 0.09, "其他": 0.04,
+}
+
+CHUNK_ROWS = 1_000_000
+# 默认每个用户约 20 条交互、每个商品约 50 条交互
+ROWS_PER_USER = 20
+ROWS_PER_ITEM = 50
+
+_STREAM_USERS, _STREAM_ITEMS, _STREAM_ROWS = 1, 2, 3
+
+
+def parse_size(text):
+    """解析 10k / 1.5m / 50M / 200000 形式的行数"""
+    text = str(text).strip().lower().replace("_", "")
+    units = {"k": 1_000, "m": 1_000_000, "b": 1_000_000_000}
+    if text and text[-1] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(text)
+
+
+def _format_ids(prefix, idx):
+    return prefix + pd.Series(idx + 1).astype(str).str.zfill(8)
+
+
+def _build_users(n_users, seed):
+    rng = np.random.default_rng([seed, _STREAM_USERS])
+    users = pd.DataFrame({
+        'age': np.clip(18 + rng.gamma(2.0, 4.0, n_users), 18, 60).astype(np.int64),
+        'gender': (rng.random(n_users) < 0.38).astype(np.int64),
+        'user_level': rng.binomial(6, 0.48, n_users) + 1,
+        'purchase_freq': np.clip(1 + rng.negative_binomial(1.5, 0.12, n_users), 1, 50),
+        'total_spend': np.round(rng.lognormal(7.5, 0.8, n_users), 2),
+        'register_days': np.clip(rng.normal(540, 285, n_users), 1, 1500).astype(np.int64),
+        'follow_num': rng.negative_binomial(1.0, 0.05, n_users),
+        'fans_num': rng.negative_binomial(0.3, 0.3, n_users),
+    })
+    # 活跃度权重 -> 累积分布，按均匀随机数二分查找抽样
+    activity = rng.lognormal(0.0, 1.0, n_users)
+    return users, np.cumsum(activity) / activity.sum()
+
+
+def _build_items(n_items, seed, alpha):
+    rng = np.random.default_rng([seed, _STREAM_ITEMS])
+    categories = list(CATEGORY_MIX)
+    discount = np.where(rng.random(n_items) < 0.3, 0.0, np.clip(rng.beta(1.5, 8.0, n_items), 0, 0.5))
+    items = pd.DataFrame({
+        'price': np.round(rng.lognormal(4.3, 0.9, n_items), 2),
+        'discount_rate': np.round(discount, 3),
+        'category': rng.choice(categories, n_items, p=list(CATEGORY_MIX.values())),
+        'title_length': np.clip(rng.normal(28, 11.6, n_items), 5, 60).astype(np.int64),
+        'title_emo_score': np.round(rng.beta(6.0, 4.0, n_items), 3),
+        'img_count': rng.binomial(7, 0.3, n_items) + 1,
+        'has_video': (rng.random(n_items) < 0.33).astype(np.int64),
+    })
+    # 幂律热度：随机排名，避免热度与商品编号相关
+    rank = rng.permutation(n_items)
+    popularity = 1.0 / np.power(rank + 1.0, alpha)
+    return items, np.cumsum(popularity) / popularity.sum()
+
+
+def _build_chunk(k, size, seed, users, user_cdf, items, item_cdf, label_rate):
+    rng = np.random.default_rng([seed, _STREAM_ROWS, k])
+    u = np.minimum(np.searchsorted(user_cdf, rng.random(size)), len(user_cdf) - 1)
+    i = np.minimum(np.searchsorted(item_cdf, rng.random(size)), len(item_cdf) - 1)
+
+    pv = 1 + rng.negative_binomial(1.0, 0.11, size)
+    like = np.floor(rng.lognormal(2.3, 1.5, size)).astype(np.int64)
+    comment = rng.binomial(like, 0.2)
+    share = rng.binomial(like, 0.1)
+    collect = rng.binomial(like, 0.27)
+    add2cart = (rng.random(size) < 0.22).astype(np.int64)
+    coupon_received = (rng.random(size) < 0.18).astype(np.int64)
+    coupon_used = coupon_received * (rng.random(size) < 0.63)
+    gap = np.maximum(np.round(rng.exponential(11.3, size), 1), 0.1)
+    intent = np.round(add2cart * 4.0 + coupon_used * 3.0 + (collect > 0) + rng.exponential(1.0, size), 1)
+
+    chunk = pd.concat([
+        users.iloc[u].reset_index(drop=True),
+        items.iloc[i].reset_index(drop=True),
+    ], axis=1)
+    chunk['user_id'] = _format_ids("U", u)
+    chunk['item_id'] = _format_ids("I", i)
+    chunk['like_num'] = like
+    chunk['comment_num'] = comment
+    chunk['share_num'] = share
+    chunk['collect_num'] = collect
+    chunk['is_follow_author'] = (rng.random(size) < 0.12).astype(np.int64)
+    chunk['add2cart'] = add2cart
+    chunk['coupon_received'] = coupon_received
+    chunk['coupon_used'] = coupon_used.astype(np.int64)
+    chunk['pv_count'] = pv
+    chunk['last_click_gap'] = gap
+    chunk['interaction_rate'] = np.round((like + comment + share + collect) / pv, 3)
+    chunk['purchase_intent'] = intent
+    chunk['freshness_score'] = np.round(rng.beta(4.0, 1.5, size), 3)
+    chunk['social_influence'] = np.round(chunk['fans_num'].values * 5.0 + like * 0.3 + share, 2)
+
+    # 转化信号加 logistic 噪声打分，按 label_rate 取分块内得分最高的部分为正样本
+    score = (1.2 * add2cart + 0.9 * chunk['coupon_used'].values + 0.4 * np.log1p(pv)
+             + 0.3 * np.log1p(collect) - 0.03 * gap + 2.0 * chunk['discount_rate'].values
+             + rng.logistic(0.0, 0.8, size))
+    chunk['label'] = (score >= np.quantile(score, 1.0 - label_rate)).astype(np.int64)
+    return chunk[COLUMNS]
+
+
+def generate_chunks(rows, seed=42, users=None, items=None, chunk_rows=CHUNK_ROWS, alpha=1.1, label_rate=0.4):
+    """
+    按分块生成合成数据
+    :param users / items: 用户数 / 商品数，默认按每用户约 20 条、每商品约 50 条交互推算
+    :param alpha: 商品热度的幂律指数，越大越集中
+    :param label_rate: 正样本比例 (样例数据约 0.4)
+    """
+    n_users = users or max(100, rows // ROWS_PER_USER)
+    n_items = items or max(50, rows // ROWS_PER_ITEM)
+    user_df, user_cdf = _build_users(n_users, seed)
+    item_df, item_cdf = _build_items(n_items, seed, alpha)
+    for k, start in enumerate(range(0, rows, chunk_rows)):
+        size = min(chunk_rows, rows - start)
+        yield _build_chunk(k, size, seed, user_df, user_cdf, item_df, item_cdf, label_rate)
+
+
+def write_csv(path, rows, **kwargs):
+    """流式写出合成 CSV，返回生成摘要"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    start = time.perf_counter()
+    written, positives = 0, 0
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        for k, chunk in enumerate(generate_chunks(rows, **kwargs)):
+            chunk.to_csv(tmp, mode="w" if k == 0 else "a", header=(k == 0), index=False)
+            written += len(chunk)
+            positives += int(chunk['label'].sum())
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    return {
+        "path": str(path),
+        "rows": written,
+        "label_rate": round(positives / written, 4) if written else 0.0,
+        "bytes": os.path.getsize(path),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成与 test.csv 同构的合成行为数据")
+    parser.add_argument("--rows", default="10k", help="行数，支持 10k / 1m / 50m")
+    parser.add_argument("--out", required=True, help="输出 CSV 路径")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--users", type=parse_size, help="用户数 (默认 行数/20)")
+    parser.add_argument("--items", type=parse_size, help="商品数 (默认 行数/50)")
+    parser.add_argument("--chunk-rows", type=parse_size, default=CHUNK_ROWS)
+    parser.add_argument("--alpha", type=float, default=1.1, help="商品热度幂律指数")
+    parser.add_argument("--label-rate", type=float, default=0.4)
+    args = parser.parse_args()
+
+    summary = write_csv(args.out, parse_size(args.rows), seed=args.seed, users=args.users, items=args.items,
+                        chunk_rows=args.chunk_rows, alpha=args.alpha, label_rate=args.label_rate)
+    print(f"✅ 已生成 {summary['rows']} 行 -> {summary['path']} "
+          f"({summary['bytes'] / 1024 / 1024:.1f} MiB, 正样本 {summary['label_rate']:.1%}, {summary['seconds']}s)")
+
+
+if __name__ == "__main__":
+    main()
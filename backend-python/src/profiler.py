@@ -0,0 +1,248 @@
+"""
+按需开启的性能剖析
+
+重构变慢时需要知道时间花在 read_sql、笛卡尔合并、predict_proba 还是 to_sql 上。
+开关打开时，profile_section() 包住的代码段 (流水线阶段 / 指定的 API 接口) 会同时采集：
+- cProfile 确定性剖析，保存为 .pstats (可用 snakeviz / pstats 查看)
+- 后台线程按固定间隔采样调用栈，保存为折叠栈文本 .collapsed.txt (可直接交给 flamegraph.pl / speedscope)
+- tracemalloc 内存快照，保存分配量最大的代码行 .memory.txt
+产物以 时间戳-进程号-名称 为前缀写入 PROFILE_DIR，另附一份 .json 元信息供列表接口使用。
+
+开关：
+- PROFILE_STAGES=all 或逗号分隔的阶段名：剖析流水线阶段；提交任务时传 profile=true 只剖析该任务
+- PROFILE_ROUTES=all 或逗号分隔的接口路径模板：剖析带 @profiled 标记的接口；
+  设置 PROFILE_ALLOW_REQUEST=1 后，单次请求也可通过请求头 X-Profile: 1 或查询参数 profile=1 开启
+- PROFILE_ALLOW_REQUEST 同时控制剖析结果的列表与下载接口：剖析开销大、产物含源码路径与调用栈，
+  默认不允许客户端触发或读取
+开关关闭时只有一次布尔判断，不启动任何剖析器。
+"""
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+
+PROFILE_DIR = Path(os.getenv("PROFILE_DIR", "runtime/profiles"))
+PROFILE_STAGES = os.getenv("PROFILE_STAGES", "")
+PROFILE_ROUTES = os.getenv("PROFILE_ROUTES", "")
+PROFILE_ALLOW_REQUEST = os.getenv("PROFILE_ALLOW_REQUEST", "") == "1"
+
+# 调用栈采样间隔 (秒)
+SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+# tracemalloc 保留的栈深度与报告行数
+TRACEMALLOC_FRAMES = 10
+MEMORY_TOP_N = 30
+
+# 由 API 中间件按请求设置，经 contextvars 传递到线程池中执行的接口函数
+_request_profile = ContextVar("profile_request", default=False)
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _switch(value):
+    return {item.strip() for item in value.split(',') if item.strip()}
+
+
+_STAGE_SWITCH = _switch(PROFILE_STAGES)
+_ROUTE_SWITCH = _switch(PROFILE_ROUTES)
+
+
+def stage_enabled(name, requested=False):
+    return requested or 'all' in _STAGE_SWITCH or name in _STAGE_SWITCH
+
+
+def route_enabled(route):
+    return _request_profile.get() or 'all' in _ROUTE_SWITCH or route in _ROUTE_SWITCH
+
+
+def request_profiling(enabled):
+    """中间件调用：标记当前请求是否需要剖析 (未设置 PROFILE_ALLOW_REQUEST 时忽略)，返回用于复位的 token"""
+    return _request_profile.set(PROFILE_ALLOW_REQUEST and bool(enabled))
+
+
+def reset_request_profiling(token):
+    _request_profile.reset(token)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class _StackSampler:
+    """后台线程定时读取目标线程的调用栈，累计折叠栈计数"""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    """返回快照后，最后一个使用方负责关闭 tracemalloc"""
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+    return snapshot, peak
+
+
+def _memory_report(snapshot, peak):
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, __file__),
+    ))
+    stats = snapshot.statistics('lineno')
+    lines = [f"traced peak: {peak / 1024 / 1024:.1f} MiB",
+             f"top {MEMORY_TOP_N} allocation sites (still allocated at end of section):"]
+    for stat in stats[:MEMORY_TOP_N]:
+        frame = stat.traceback[0]
+        lines.append(f"{stat.size / 1024:10.1f} KiB  {stat.count:8d} blocks  {frame.filename}:{frame.lineno}")
+    return "\n".join(lines) + "\n"
+
+
+def _save(kind, name, started_at, duration, profiler, sampler, memory):
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_') or kind
+    stamp = time.strftime('%Y%m%d-%H%M%S', time.localtime(started_at)) + f"{int(started_at * 1000) % 1000:03d}"
+    prefix = f"{stamp}-{os.getpid()}-{kind}-{safe_name}"
+    files = []
+
+    if profiler is not None:
+        profiler.dump_stats(str(PROFILE_DIR / f"{prefix}.pstats"))
+        files.append(f"{prefix}.pstats")
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats('cumulative').print_stats(40)
+        (PROFILE_DIR / f"{prefix}.summary.txt").write_text(summary.getvalue(), encoding='utf-8')
+        files.append(f"{prefix}.summary.txt")
+    (PROFILE_DIR / f"{prefix}.collapsed.txt").write_text(sampler.collapsed(), encoding='utf-8')
+    files.append(f"{prefix}.collapsed.txt")
+    (PROFILE_DIR / f"{prefix}.memory.txt").write_text(memory, encoding='utf-8')
+    files.append(f"{prefix}.memory.txt")
+
+    meta = {
+        "id": prefix, "kind": kind, "name": name, "pid": os.getpid(),
+        "started_at": started_at, "duration": round(duration, 3),
+        "samples": sum(sampler.stacks.values()), "files": files,
+    }
+    (PROFILE_DIR / f"{prefix}.json").write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+    print(f"🔬 性能剖析已保存: {prefix} ({duration:.2f}s)")
+    return meta
+
+
+@contextmanager
+def profile_section(kind, name, enabled):
+    """
+    剖析一段代码；enabled 为 False 时直接执行
+    :param kind: stage / route，用于区分产物
+    """
+    if not enabled:
+        yield
+        return
+
+    started_at, started = time.time(), time.perf_counter()
+    sampler = _StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        # Python 3.12+ 同一时刻只允许一个 cProfile，并发阶段退化为只做栈采样
+        profiler = None
+    _start_tracemalloc()
+    sampler.start()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+        snapshot, peak = _stop_tracemalloc()
+        try:
+            _save(kind, name, started_at, time.perf_counter() - started, profiler, sampler,
+                  _memory_report(snapshot, peak))
+        except Exception as e:
+            print(f"⚠️ 性能剖析结果保存失败 ({name}): {e}")
+
+
+def profiled(route):
+    """
+    接口装饰器：开关打开时剖析接口函数本身 (在线程池中执行的同步接口)
+    :param route: 接口路径模板，与 PROFILE_ROUTES 中的取值对应
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not route_enabled(route):
+                return func(*args, **kwargs)
+            with profile_section("route", route, True):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def list_profiles(limit=50):
+    """最近的剖析结果 (按时间倒序)"""
+    if not PROFILE_DIR.exists():
+        return []
+    profiles = []
+    for path in sorted(PROFILE_DIR.glob('*.json'), reverse=True)[:limit]:
+        try:
+            profiles.append(json.loads(path.read_text(encoding='utf-8')))
+        except (OSError, json.JSONDecodeError):
+            continue
+    return profiles
+
+
+def profile_file(filename):
+    """
+    按文件名取剖析产物路径，只允许访问 PROFILE_DIR 下的文件
+    :return: Path；不存在或名称非法时返回 None
+    """
+    if os.path.basename(filename) != filename or filename.startswith('.'):
+        return None
+    path = PROFILE_DIR / filename
+    return path if path.is_file() else None
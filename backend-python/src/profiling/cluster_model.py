@@ -2,8 +2,20 @@ import pandas as pd
 import numpy as np
 from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler
-from src.database import engine
-from sqlalchemy import text
+from src.database import get_engine, truncate_tables
+from src import progress
+from src.response_cache import bump_data_version
+from src.analytics import invalidate_mirror, mirror_table
+from src.spark_backend import resolve_backend
+from src.id_dictionary import get_id_dictionary, decode_ids
+from src.feature_store import load_features
+
+
+# 画像阶段从特征库 user_features 读取的列
+PERSONA_FEATURES = ['user_id', 'total_spend', 'purchase_freq', 'register_days', 'fans_num', 'follow_num',
+                    'interaction_rate', 'purchase_intent', 'last_click_gap', 'item_discount',
+                    'preferred_category', 'n_interactions']
+
 
 # ==========================================================
 # 新增：生成 K-Means 迭代过程数据（专供前端 ECharts 使用）
@@ -12,7 +24,7 @@ def get_kmeans_steps_data(n_clusters=4):
     try:
         # 1. 提取绘图特征
         query = "SELECT loyalty_score, price_sensitivity FROM usr_persona LIMIT 300"
-        df = pd.read_sql(query, engine)
+        df = pd.read_sql(query, get_engine("serving", read=True))
         if df.empty: return {"status": "error", "message": "数据为空"}
         data = df[['loyalty_score', 'price_sensitivity']].values
 
@@ -38,41 +50,55 @@ def get_kmeans_steps_data(n_clusters=4):
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
-def train_user_clusters(n_clusters=4):
+def aggregate_user_features(raw_df):
+    """
+    按用户维度对逐行明细进行特征聚合，与特征库 user_features 的口径一致 (供基准脚本对比)；
+    Spark 路径见 src.spark_backend.persona_features
+    :param raw_df: 用户 x 行为 x 商品的逐行联查结果
+    """
+    user_groups = raw_df.groupby('user_id')
+    df = user_groups.agg({
+        'total_spend': 'first',
+        'purchase_freq': 'first',
+        'register_days': 'first',
+        'fans_num': 'first',
+        'follow_num': 'first',
+        'interaction_rate': 'mean',
+        'purchase_intent': 'mean',
+        'last_click_gap': 'max',
+        'item_discount': 'mean'
+    }).reset_index()
+
+    # 核心偏好品类：交互次数最多的品类，次数相同时取品类名最小者
+    pref_cat = raw_df.groupby(['user_id', 'category'], observed=True).size().reset_index(name='cnt')
+    df['preferred_category'] = pref_cat.sort_values(['cnt', 'category'], ascending=[False, True]).groupby(
+        'user_id')['category'].first().values
+    return df
+
+
+def train_user_clusters(n_clusters=4, handoff=None, backend=None):
     """
     全量画像构建：补齐社交、消费、偏好及敏感度维度
+    :param handoff: 可选的 EvaluationHandoff，用于把分群结果直接交给评估阶段
+    :param backend: 特征聚合的执行后端：pandas 读取特征库，spark 由 Spark 直接从业务库聚合；
+                    为空时使用 EXECUTION_BACKEND
     """
     try:
-        # 1. 多表联查：提取原始特征
-        query = """
-                SELECT u.*, \
-                       b.interaction_rate, \
-                       b.purchase_intent, \
-                       b.last_click_gap, \
-                       i.category, \
-                       i.price         as item_price, \
-                       i.discount_rate as item_discount
-                FROM dim_user u
-                         JOIN fact_user_behavior b ON u.user_id = b.user_id
-                         JOIN dim_item i ON b.item_id = i.item_id \
-                """
-        raw_df = pd.read_sql(query, engine)
-        if raw_df.empty:
-            return False, "数据库为空，请先入库数据。"
-
-        # 2. 按用户维度进行特征聚合
-        user_groups = raw_df.groupby('user_id')
-        df = user_groups.agg({
-            'total_spend': 'first',
-            'purchase_freq': 'first',
-            'register_days': 'first',
-            'fans_num': 'first',
-            'follow_num': 'first',
-            'interaction_rate': 'mean',
-            'purchase_intent': 'mean',
-            'last_click_gap': 'max',
-            'item_discount': 'mean'
-        }).reset_index()
+        # 1~2. 按用户维度聚合的原始特征
+        if resolve_backend(backend) == "spark":
+            from src.spark_backend import load_persona_features
+            df = load_persona_features()
+            if df.empty:
+                return False, "数据库为空，请先入库数据。"
+        else:
+            # 特征库中的用户特征 (已按用户聚合)，只保留有交互记录的用户
+            df = load_features("user_features", columns=PERSONA_FEATURES)
+            df = df[df['n_interactions'] > 0].drop(columns=['n_interactions']).reset_index(drop=True)
+            if df.empty:
+                return False, "数据库为空，请先入库数据。"
+            progress.emit("persona", 20, rows=len(df), message="用户特征加载完成")
+            df = decode_ids(df, get_id_dictionary(), columns=('user_id',))
+            df['preferred_category'] = df['preferred_category'].astype(str)
 
         # 3. 计算业务指标
         # 社交影响力
@@ -92,10 +118,6 @@ def train_user_clusters(n_clusters=4):
         df['consumption_level'] = df['spend_cluster'].map(spend_mapping)
         # ------------------------------------------
 
-        # 核心偏好品类
-        pref_cat = raw_df.groupby(['user_id', 'category']).size().reset_index(name='cnt')
-        df['preferred_category'] = pref_cat.sort_values('cnt', ascending=False).groupby('user_id')[
-            'category'].first().values
         # 价格敏感度
         df['price_sensitivity'] = df['item_discount'] * 10.0
         # 忠诚度评分
@@ -104,6 +126,7 @@ def train_user_clusters(n_clusters=4):
         df['is_churn_risk'] = (df['last_click_gap'] > 30).astype(int)
         # 活跃度标签
         df['activity_level'] = df['interaction_rate'].apply(lambda x: "活跃" if x > 10 else "沉睡")
+        progress.emit("persona", 50, rows=len(df), message="用户特征聚合完成")
 
         # 4. 执行多维度综合 K-means 聚类（用于生成最终画像标签）
         scaler = StandardScaler()
@@ -115,12 +138,12 @@ def train_user_clusters(n_clusters=4):
         # 5. 定义画像标签映射
         tag_map = {0: "潜力新客", 1: "高价值核心", 2: "流失风险", 3: "低频长尾"}
         df['persona_tag'] = df['cluster_label'].map(tag_map)
+        progress.emit("persona", 80, rows=len(df), message="K-Means 聚类完成")
 
         # 6. 回写至 usr_persona 表
-        with engine.begin() as conn:
-            conn.execute(text("SET FOREIGN_KEY_CHECKS = 0;"))
-            conn.execute(text("TRUNCATE TABLE usr_persona;"))
-            conn.execute(text("SET FOREIGN_KEY_CHECKS = 1;"))
+        invalidate_mirror("usr_persona")
+        with get_engine("bulk_write").begin() as conn:
+            truncate_tables(conn, "usr_persona")
 
             # 严格对应 SQL 表字段名
             write_df = df[[
@@ -131,6 +154,12 @@ def train_user_clusters(n_clusters=4):
 
             write_df.to_sql('usr_persona', con=conn, if_exists='append', index=False)
             print("画像分析完成！")
+        bump_data_version("usr_persona")
+        mirror_table("usr_persona", write_df)
+        progress.emit("persona", 100, rows=len(write_df), total=len(write_df))
+
+        if handoff is not None:
+            handoff.set_user_segments(write_df[['user_id', 'cluster_label', 'consumption_level']])
 
         return True, "深度画像构建完成，所有字段已补齐。"
 
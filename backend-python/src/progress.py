@@ -0,0 +1,85 @@
+"""
+结构化进度事件总线
+
+入库、聚类、User-CF、随机森林、评估等阶段调用 emit() 上报进度，
+事件包含阶段名、百分比、已处理行数与吞吐量。总线本身不关心事件去向：
+任务执行器通过 set_sink() 注册接收方 (写入任务事件文件，供 SSE 接口推送)，
+未注册时 emit() 不做任何事，独立运行脚本不受影响。
+"""
+import threading
+import time
+
+# 同一阶段两次事件的最小间隔 (秒)，避免逐行循环产生海量事件；0% / 100% 事件总会发出
+MIN_INTERVAL = 0.5
+
+_sink = None
+_lock = threading.Lock()
+_stage_started = {}
+_last_emit = {}
+_last_rows = {}
+
+
+def set_sink(sink):
+    """注册事件接收方：sink(event: dict)"""
+    global _sink
+    with _lock:
+        _sink = sink
+        _stage_started.clear()
+        _last_emit.clear()
+
+
+def clear_sink():
+    set_sink(None)
+
+
+def start_stage(stage):
+    """标记阶段开始时间，吞吐量从阶段开始计算 (未调用时以该阶段第一次 emit 为起点)"""
+    with _lock:
+        _stage_started[stage] = time.time()
+        _last_emit.pop(stage, None)
+        _last_rows.pop(stage, None)
+
+
+def stage_rows(stage):
+    """阶段最近一次上报的已处理行数 (供阶段指标记录)"""
+    return _last_rows.get(stage)
+
+
+def emit(stage, percent, rows=None, total=None, message=None):
+    """
+    上报阶段进度
+    :param stage: 阶段名，与流水线阶段保持一致 (ingest / persona / user_cf / rf / evaluate)
+    :param percent: 阶段内完成百分比 (0-100)
+    :param rows: 已处理行数 (用户数 / 记录数)
+    :param total: 总行数
+    """
+    sink = _sink
+    if sink is None:
+        return
+
+    now = time.time()
+    with _lock:
+        if rows is not None:
+            _last_rows[stage] = rows
+        started = _stage_started.setdefault(stage, now)
+        if 0 < percent < 100 and now - _last_emit.get(stage, 0) < MIN_INTERVAL:
+            return
+        _last_emit[stage] = now
+
+    elapsed = now - started
+    event = {
+        "type": "progress",
+        "stage": stage,
+        "percent": round(float(percent), 1),
+        "rows": rows,
+        "total": total,
+        "throughput": round(rows / elapsed, 1) if rows and elapsed > 0 else None,
+        "elapsed": round(elapsed, 3),
+        "message": message,
+        "ts": now,
+    }
+    try:
+        sink(event)
+    except Exception as e:
+        # 进度上报失败不能影响计算本身
+        print(f"⚠️ 进度事件写入失败: {e}")
@@ -1,11 +1,24 @@
 import pandas as pd
 import numpy as np
-from scipy.sparse import csr_matrix
-from sklearn.metrics.pairwise import cosine_similarity
 from sqlalchemy import text
-from src.database import engine
+from src.database import get_engine
+from src import progress
+from src.response_cache import bump_data_version
+from src.id_dictionary import get_id_dictionary
+from src.feature_store import load_features
 import gc
 
+# 隐式反馈加权得分：浏览 1 分、加购 5 分、收藏 3 分、点赞 2 分、购买意向 4 分
+# User-CF 的用户-商品矩阵与分群热门榜 (popularity) 共用同一口径
+IMPLICIT_SCORE_SQL = """
+    (COALESCE(pv_count, 0) * 1 + COALESCE(add2cart, 0) * 5 +
+     COALESCE(collect_num, 0) * 3 + COALESCE(like_num, 0) * 2 +
+     COALESCE(purchase_intent, 0) * 4)
+"""
+
+# 过滤掉无任何互动的记录
+IMPLICIT_FILTER_SQL = "(pv_count + add2cart + collect_num + like_num) > 0"
+
 
 class UserCFBaseline:
     def __init__(self, n_neighbors=10):
@@ -18,37 +31,36 @@ class UserCFBaseline:
     def load_data(self):
         """
         优化 1: 引入轻量级数据加载，过滤掉无意义的超低频互动
+        用户 x 商品隐式反馈得分取自特征库 interactions 表 (已按 IMPLICIT_FILTER_SQL 过滤并按用户-商品汇总)，
+        ID 为 int32 编码、得分为 float32，分组与建矩阵不再经过字符串
         """
-        query = """
-                SELECT user_id, \
-                       item_id,
-                       (COALESCE(pv_count, 0) * 1 + COALESCE(add2cart, 0) * 5 +
-                        COALESCE(collect_num, 0) * 3 + COALESCE(like_num, 0) * 2 +
-                        COALESCE(purchase_intent, 0) * 4) as score
-                FROM fact_user_behavior
-                WHERE (pv_count + add2cart + collect_num + like_num) > 0
-                """
-        df = pd.read_sql(query, engine)
+        df = load_features("interactions")
         if df.empty:
             print("⚠️ 行为表为空，跳过计算。")
             return None
+        ids = get_id_dictionary()
 
         # 计算全局热门
         popular = df.groupby('item_id')['score'].sum().sort_values(ascending=False)
-        self.global_popular_items = popular.index.tolist()[:100]  # 仅保留前100个热门作为兜底
-
-        # 构建稀疏矩阵
-        df['u_cat'] = df['user_id'].astype('category')
-        df['i_cat'] = df['item_id'].astype('category')
-        self.user_ids = df['u_cat'].cat.categories
-        self.item_ids = df['i_cat'].cat.categories
-        self.user_item_sparse = csr_matrix((df['score'], (df['u_cat'].cat.codes, df['i_cat'].cat.codes)))
+        self.global_popular_items = list(ids.decode('item_id', popular.index[:100]))  # 仅保留前100个热门作为兜底
+
+        # 构建稀疏矩阵 (scipy / sklearn 只在流水线工作进程中用到，延迟导入以免拖慢 API 启动)
+        # 行 / 列只保留有交互的用户与商品；字典编码与字符串同序，行列顺序与按字符串排序一致
+        from scipy.sparse import csr_matrix
+        user_codes, rows = np.unique(df['user_id'].to_numpy(), return_inverse=True)
+        item_codes, cols = np.unique(df['item_id'].to_numpy(), return_inverse=True)
+        self.user_ids = ids.decode('user_id', user_codes)
+        self.item_ids = ids.decode('item_id', item_codes)
+        # float32 矩阵上 cosine_similarity 同样输出 float32，用户相似度矩阵内存减半
+        self.user_item_sparse = csr_matrix((df['score'].to_numpy(dtype=np.float32), (rows, cols)),
+                                           shape=(len(user_codes), len(item_codes)))
         return self.user_item_sparse
 
     def fit(self):
         if self.user_item_sparse is None:
             self.load_data()
         if self.user_item_sparse is not None:
+            from sklearn.metrics.pairwise import cosine_similarity
             # 优化 2: 使用密集矩阵前先进行分块思维，防止内存溢出
             self.user_similarity = cosine_similarity(self.user_item_sparse)
             print("✅ 用户相似度计算完成。")
@@ -82,27 +94,32 @@ class UserCFBaseline:
                     break
         return recs[:top_n]
 
-    def save_results_to_db(self, top_n=5, batch_size=1000):
+    def save_results_to_db(self, top_n=5, batch_size=1000, handoff=None):
         """
         优化 4: 极简写入模式，减少数据库事务开销
+        :param handoff: 可选的 EvaluationHandoff，写库的同时把结果留在内存中供评估阶段使用
         """
         if self.user_item_sparse is None:
             self.load_data()
         if self.user_item_sparse is None: return
         self.fit()
 
-        cat_df = pd.read_sql("SELECT item_id, category FROM dim_item", engine)
-        item_to_cat = dict(zip(cat_df['item_id'], cat_df['category']))
+        cat_df = load_features("item_features", columns=('item_id', 'category'))
+        item_ids = get_id_dictionary().decode('item_id', cat_df['item_id'])
+        item_to_cat = dict(zip(item_ids, cat_df['category'].astype(object)))
 
-        with engine.begin() as conn:
+        with get_engine("bulk_write").begin() as conn:
             conn.execute(text("DELETE FROM recommendation_results WHERE model_type = 'User-CF'"))
 
         total_saved = 0
         current_batch = []
+        saved_frames = []
 
         print(f"🚀 开始生成 User-CF 推荐 (目标 Top-{top_n})...")
+        n_users = len(self.user_ids)
         for i, user_id in enumerate(self.user_ids):
             recs = self.recommend(i, top_n=top_n)
+            progress.emit("user_cf", (i + 1) / n_users * 100, rows=i + 1, total=n_users)
             for rank, item_id in enumerate(recs):
                 current_batch.append({
                     'user_id': user_id,
@@ -114,21 +131,31 @@ class UserCFBaseline:
                 })
 
             if len(current_batch) >= batch_size:
-                pd.DataFrame(current_batch).to_sql(
-                    'recommendation_results', con=engine, if_exists='append',
+                batch_df = pd.DataFrame(current_batch)
+                batch_df.to_sql(
+                    'recommendation_results', con=get_engine("bulk_write"), if_exists='append',
                     index=False, method='multi', chunksize=1000
                 )
+                if handoff is not None:
+                    saved_frames.append(batch_df[['user_id', 'item_id', 'category', 'score', 'rank']])
                 total_saved += len(current_batch)
                 current_batch = []
                 gc.collect()
 
         # 处理剩余数据
         if current_batch:
-            pd.DataFrame(current_batch).to_sql(
-                'recommendation_results', con=engine, if_exists='append', index=False, method='multi'
+            batch_df = pd.DataFrame(current_batch)
+            batch_df.to_sql(
+                'recommendation_results', con=get_engine("bulk_write"), if_exists='append', index=False, method='multi'
             )
+            if handoff is not None:
+                saved_frames.append(batch_df[['user_id', 'item_id', 'category', 'score', 'rank']])
             total_saved += len(current_batch)
 
+        if handoff is not None and saved_frames:
+            handoff.add_predictions('User-CF', pd.concat(saved_frames, ignore_index=True))
+
+        bump_data_version("recommendation_results:User-CF")
         print(f"✅ User-CF 优化写入完成，共存入 {total_saved} 条。")
 
 
@@ -1,108 +1,483 @@
 import pandas as pd
 import numpy as np
+from itertools import groupby
+from operator import itemgetter
 from sqlalchemy import text
-from src.database import engine
+from src.database import get_engine
+from src import progress
+from src.response_cache import bump_data_version
+from src.id_dictionary import get_id_dictionary, encode_ids
 
+# 参与对比实验的模型
+EVAL_MODELS = ['User-CF', 'RF-Optimized']
 
-def evaluate_models():
+# 单用户指标列（按用户求均值即为整体指标）
+USER_METRIC_COLS = ['precision', 'recall', 'ndcg', 'ap', 'hit']
+
+
+def _prepare_predictions(pred_df, k=None):
+    """
+    规范化推荐结果：去重、重排名次，并按 K 截断
+    若未提供 rank 列，则以行顺序作为推荐名次
+    """
+    pred = pred_df[['user_id', 'item_id'] + (['rank'] if 'rank' in pred_df.columns else [])].copy()
+    if 'rank' not in pred.columns:
+        pred['rank'] = pred.groupby('user_id').cumcount() + 1
+
+    # 同一用户重复推荐的商品只保留最靠前的名次，并重新生成连续名次
+    pred = pred.sort_values(['user_id', 'rank'], kind='mergesort').drop_duplicates(['user_id', 'item_id'])
+    pred['rank'] = pred.groupby('user_id').cumcount() + 1
+
+    if k is not None:
+        pred = pred[pred['rank'] <= k]
+    return pred
+
+
+def build_indicator_matrices(true_df, pred_df, user_index):
+    """
+    将 ID (字符串或 ID 字典的 int32 编码) 映射为连续下标，构造稀疏指示矩阵：
+    - 真值矩阵 T: 用户 x 商品，命中为 1
+    - 预测矩阵 P: 用户 x 商品，值为推荐名次 (1..K)
+    行顺序与 user_index 对齐，仅保留 user_index 中的用户
+    """
+    # 延迟导入：API 进程只用到 EVAL_MODELS 等常量，不需要加载 scipy
+    from scipy.sparse import csr_matrix
+
+    item_index = pd.Index(pd.concat([true_df['item_id'], pred_df['item_id']]).unique())
+    shape = (len(user_index), len(item_index))
+
+    t_rows = user_index.get_indexer(true_df['user_id'])
+    t_mask = t_rows >= 0
+    t_cols = item_index.get_indexer(true_df['item_id'])
+    truth = csr_matrix(
+        (np.ones(int(t_mask.sum()), dtype=np.float32), (t_rows[t_mask], t_cols[t_mask])), shape=shape
+    )
+
+    p_rows = user_index.get_indexer(pred_df['user_id'])
+    p_mask = p_rows >= 0
+    p_cols = item_index.get_indexer(pred_df['item_id'])
+    ranks = pred_df['rank'].to_numpy(dtype=np.float32)
+    pred = csr_matrix((ranks[p_mask], (p_rows[p_mask], p_cols[p_mask])), shape=shape)
+
+    # 真值去重后指示值统一为 1
+    truth.data[:] = 1.0
+    return truth, pred
+
+
+def compute_user_metrics(true_df, pred_df, k, user_index=None):
+    """
+    向量化计算单用户指标：一次稀疏逐元素乘积 + 行求和得到全部用户的
+    Precision@K / Recall@K / NDCG@K / AP@K / 是否命中
+    true_df: user_id, item_id；pred_df: 经 _prepare_predictions 规范化的推荐结果
+    """
+    if user_index is None:
+        user_index = pd.Index(true_df['user_id'].unique())
+    n_users = len(user_index)
+
+    truth, pred = build_indicator_matrices(true_df, pred_df, user_index)
+    # 命中矩阵：仅在真值位置保留推荐名次
+    hits = pred.multiply(truth).tocsr()
+    hits.eliminate_zeros()
+
+    n_true = truth.getnnz(axis=1).astype(np.float64)
+    n_pred = pred.getnnz(axis=1).astype(np.float64)
+    n_hits = hits.getnnz(axis=1).astype(np.float64)
+
+    # Precision 以实际推荐数为分母（阈值过滤后可能不足 K 个），未覆盖用户记为 0
+    precision = np.divide(n_hits, n_pred, out=np.zeros(n_users), where=n_pred > 0)
+    recall = np.divide(n_hits, n_true, out=np.zeros(n_users), where=n_true > 0)
+
+    # NDCG@K：DCG 按命中名次折损，IDCG 取 min(|真值|, K) 个理想位置
+    hit_rows = np.repeat(np.arange(n_users), np.diff(hits.indptr))
+    hit_ranks = hits.data.astype(np.float64)
+    dcg = np.bincount(hit_rows, weights=1.0 / np.log2(hit_ranks + 1), minlength=n_users)
+    ideal_len = np.minimum(n_true, k).astype(np.int64)
+    ideal_cum = np.concatenate([[0.0], np.cumsum(1.0 / np.log2(np.arange(2, k + 2)))])
+    idcg = ideal_cum[ideal_len]
+    ndcg = np.divide(dcg, idcg, out=np.zeros(n_users), where=idcg > 0)
+
+    # AP@K：按 (用户, 名次) 排序后，组内累计命中数 / 名次 即为各命中位置的 Precision
+    order = np.lexsort((hit_ranks, hit_rows))
+    sorted_rows, sorted_ranks = hit_rows[order], hit_ranks[order]
+    group_start = np.searchsorted(sorted_rows, sorted_rows, side='left')
+    cum_hits = np.arange(len(sorted_rows)) - group_start + 1
+    ap_sum = np.bincount(sorted_rows, weights=cum_hits / sorted_ranks, minlength=n_users)
+    ap = np.divide(ap_sum, ideal_len, out=np.zeros(n_users), where=ideal_len > 0)
+
+    return pd.DataFrame({
+        'precision': precision,
+        'recall': recall,
+        'ndcg': ndcg,
+        'ap': ap,
+        'hit': (n_hits > 0).astype(np.float64),
+    }, index=user_index)
+
+
+def _summarize(precision, recall, ndcg, ap, hit_rate):
+    """由平均 P/R 推导 F1，保持与历史指标一致的口径"""
+    f1 = (2 * precision * recall) / (precision + recall) if (precision + recall) > 0 else 0
+    return {
+        'precision_val': float(precision),
+        'recall_val': float(recall),
+        'f1_val': float(f1),
+        'ndcg_val': float(ndcg),
+        'map_val': float(ap),
+        'hit_rate': float(hit_rate),
+    }
+
+
+def compute_ranking_metrics(true_df, pred_df, k=None, user_segments=None, n_catalog_items=None):
+    """
+    单次向量化计算一个模型的离线排序指标
+    :param true_df: 真值 DataFrame (user_id, item_id)
+    :param pred_df: 推荐结果 DataFrame (user_id, item_id[, rank])
+    :param k: 截断位置，默认取推荐结果中的最大名次 (即 Top-N)
+    :param user_segments: user_id -> cluster_label 的 Series，用于分群指标
+    :param n_catalog_items: 商品库规模，用于计算覆盖率
+    :return: (整体指标 dict, 分群指标 DataFrame 或 None)
+    """
+    truth = true_df[['user_id', 'item_id']].drop_duplicates()
+    pred = _prepare_predictions(pred_df)
+    if k is None:
+        k = int(pred['rank'].max()) if not pred.empty else 1
+    pred = pred[pred['rank'] <= k]
+
+    user_metrics = compute_user_metrics(truth, pred, k)
+    means = user_metrics.mean() if len(user_metrics) else pd.Series(0.0, index=USER_METRIC_COLS)
+
+    overall = _summarize(means['precision'], means['recall'], means['ndcg'], means['ap'], means['hit'])
+    overall['k_value'] = k
+    n_items = n_catalog_items or truth['item_id'].nunique()
+    overall['coverage'] = float(pred['item_id'].nunique() / n_items) if n_items else 0.0
+    overall['user_count'] = len(user_metrics)
+    overall['hit_user_count'] = int(user_metrics['hit'].sum())
+
+    segments = None
+    if user_segments is not None:
+        seg = user_segments.reindex(user_metrics.index).fillna(-1).astype(int).rename('segment')
+        grouped = user_metrics.groupby(seg)
+        segments = _summarize_segments(grouped.mean(), grouped.size())
+
+    return overall, segments
+
+
+def _summarize_segments(seg_means, seg_counts):
+    """将分群均值表转换为 model_segment_metrics 的行格式"""
+    seg_rows = []
+    for segment, row in seg_means.iterrows():
+        seg_row = _summarize(row['precision'], row['recall'], row['ndcg'], row['ap'], row['hit'])
+        seg_row['segment'] = int(segment)
+        seg_row['user_count'] = int(seg_counts[segment])
+        seg_rows.append(seg_row)
+    return pd.DataFrame(seg_rows)
+
+
+class EvaluationHandoff:
     """
-    核心评价函数：直接对比数据库中的真实行为与模型生成的推荐结果
+    流水线内存交接容器：上游阶段产出的真值、推荐结果与分群信息直接在内存中
+    传递给 evaluate_models，省去“写入数据库后立即回读”的往返开销。
+    未提供的部分由 evaluate_models 回退到数据库读取。
+    汇总表刷新 (src.aggregates) 同样复用其中的推荐结果与画像明细。
+    真值、推荐名次与分群中的 user_id / item_id 均为 ID 字典的 int32 编码。
     """
+
+    def __init__(self):
+        self.ground_truth = None      # DataFrame: user_id, item_id (int32 编码)
+        self.predictions = {}         # {model_type: DataFrame(user_id, item_id, rank)} (int32 编码)
+        self.results = {}             # {model_type: DataFrame(user_id, item_id, category, score, rank)}
+        self.user_segments = None     # Series: user_id (int32 编码) -> cluster_label
+        self.personas = None          # DataFrame: user_id, cluster_label, consumption_level
+        self.n_catalog_items = None   # 商品库规模
+
+    def set_ground_truth(self, behavior_df):
+        """从包含 label / purchase_intent 的行为明细中抽取真值，口径与数据库查询一致"""
+        mask = (behavior_df['label'] == 1) | (behavior_df['purchase_intent'] == 1)
+        truth = behavior_df.loc[mask, ['user_id', 'item_id']].reset_index(drop=True)
+        self.ground_truth = encode_ids(truth, get_id_dictionary())
+
+    def add_predictions(self, model_type, result_df):
+        self.predictions[model_type] = encode_ids(
+            result_df[['user_id', 'item_id', 'rank']].reset_index(drop=True), get_id_dictionary())
+        if {'category', 'score'} <= set(result_df.columns):
+            self.results[model_type] = result_df[['user_id', 'item_id', 'category', 'score', 'rank']].reset_index(
+                drop=True)
+
+    def set_user_segments(self, persona_df):
+        segments = encode_ids(persona_df[['user_id', 'cluster_label']].reset_index(drop=True),
+                              get_id_dictionary(), columns=('user_id',))
+        self.user_segments = segments.set_index('user_id')['cluster_label']
+        if 'consumption_level' in persona_df.columns:
+            self.personas = persona_df[['user_id', 'cluster_label', 'consumption_level']].reset_index(drop=True)
+
+
+def _load_ground_truth(conn):
+    # 使用 CAST 确保 user_id 和 item_id 统一为字符类型，防止匹配失败
+    true_query = text("""
+                      SELECT CAST(user_id AS CHAR) as user_id,
+                             CAST(item_id AS CHAR) as item_id
+                      FROM fact_user_behavior
+                      WHERE label = 1
+                         OR purchase_intent = 1
+                      """)
+    return pd.read_sql(true_query, conn)
+
+
+def _load_predictions(conn, model):
+    # 读取模型生成的推荐结果，同样进行类型转换
+    query = text("""
+                 SELECT CAST(user_id AS CHAR) as user_id,
+                        CAST(item_id AS CHAR) as item_id,
+                        `rank`
+                 FROM recommendation_results
+                 WHERE model_type = :mtype
+                 """)
+    return pd.read_sql(query, conn, params={"mtype": model})
+
+
+class _MetricAccumulator:
+    """流式评估的累加器：只保存各指标的累计和与用户数，内存占用恒定"""
+
+    def __init__(self):
+        self.sums = pd.Series(0.0, index=USER_METRIC_COLS)
+        self.count = 0
+
+    def add(self, user_metrics):
+        self.sums = self.sums + user_metrics[USER_METRIC_COLS].sum()
+        self.count += len(user_metrics)
+
+    def means(self):
+        return self.sums / self.count if self.count else pd.Series(0.0, index=USER_METRIC_COLS)
+
+
+def _iter_user_groups(result):
+    """
+    将按 user_id 排序的游标结果按用户分组；若发现乱序 (如排序规则与 Python 字符串比较不一致)
+    立即报错，避免归并连接静默漏配
+    """
+    prev_user = None
+    for user_id, rows in groupby(result, key=itemgetter(0)):
+        if prev_user is not None and user_id <= prev_user:
+            raise ValueError(f"流式结果未按 user_id 严格排序: {prev_user!r} -> {user_id!r}")
+        prev_user = user_id
+        yield user_id, list(rows)
+
+
+def evaluate_model_streaming(model, n_catalog_items, chunk_users=20000, yield_per=10000, on_flush=None):
+    """
+    流式评估单个模型：真值与推荐结果均按 user_id 排序后通过服务端游标读取，
+    逐用户归并连接，每累计 chunk_users 个用户做一次向量化计算并折叠进累加器。
+    分片内直接以字符串 ID 计算 (不加载 ID 字典)，覆盖率由数据库 COUNT(DISTINCT item_id) 给出，
+    内存只与分片大小有关，指标口径与批量模式一致。
+    :param on_flush: 可选回调 on_flush(已处理用户数)，每个分片计算完成后调用，用于上报进度
+    :return: (整体指标 dict, 分群指标 DataFrame)；无推荐数据时返回 (None, None)
+    """
+    true_query = text("""
+                      SELECT CAST(b.user_id AS CHAR) as user_id,
+                             CAST(b.item_id AS CHAR) as item_id,
+                             p.cluster_label
+                      FROM fact_user_behavior b
+                               LEFT JOIN usr_persona p ON b.user_id = p.user_id
+                      WHERE b.label = 1
+                         OR b.purchase_intent = 1
+                      ORDER BY b.user_id
+                      """)
+    pred_query = text("""
+                      SELECT CAST(user_id AS CHAR) as user_id,
+                             CAST(item_id AS CHAR) as item_id,
+                             `rank`
+                      FROM recommendation_results
+                      WHERE model_type = :mtype
+                      ORDER BY user_id, `rank`
+                      """)
+
+    # 最大名次即 K；推荐过的不同商品数 (覆盖率分子) 同样在数据库中聚合
+    with get_engine("analytics").connect() as conn:
+        k, n_recommended = conn.execute(text("""
+                                             SELECT MAX(`rank`), COUNT(DISTINCT item_id)
+                                             FROM recommendation_results
+                                             WHERE model_type = :mtype
+                                             """), {"mtype": model}).one()
+    if not k:
+        return None, None
+    k = int(k)
+
+    overall_acc = _MetricAccumulator()
+    segment_acc = {}
+    buf_truth, buf_pred, buf_segments = [], [], {}
+
+    def flush():
+        if not buf_segments:
+            return
+        user_index = pd.Index(list(buf_segments.keys()), dtype=object)
+        segments = np.fromiter(buf_segments.values(), dtype=np.int64, count=len(buf_segments))
+        truth = pd.DataFrame(buf_truth, columns=['user_id', 'item_id']).drop_duplicates()
+        pred = _prepare_predictions(pd.DataFrame(buf_pred, columns=['user_id', 'item_id', 'rank']), k)
+        user_metrics = compute_user_metrics(truth, pred, k, user_index=user_index)
+        overall_acc.add(user_metrics)
+        for segment, part in user_metrics.groupby(segments):
+            segment_acc.setdefault(int(segment), _MetricAccumulator()).add(part)
+        if on_flush is not None:
+            on_flush(overall_acc.count)
+        buf_truth.clear()
+        buf_pred.clear()
+        buf_segments.clear()
+
+    with get_engine("analytics").connect() as truth_conn, get_engine("analytics").connect() as pred_conn:
+        truth_result = truth_conn.execution_options(stream_results=True, yield_per=yield_per).execute(true_query)
+        pred_result = pred_conn.execution_options(stream_results=True, yield_per=yield_per).execute(
+            pred_query, {"mtype": model})
+
+        pred_groups = _iter_user_groups(pred_result)
+        pred_user, pred_rows = next(pred_groups, (None, None))
+
+        for user_id, truth_rows in _iter_user_groups(truth_result):
+            # 推荐流中排在当前用户之前的用户没有真值，不参与排序指标
+            while pred_user is not None and pred_user < user_id:
+                pred_user, pred_rows = next(pred_groups, (None, None))
+
+            if pred_user == user_id:
+                buf_pred.extend(tuple(row) for row in pred_rows)
+                pred_user, pred_rows = next(pred_groups, (None, None))
+
+            buf_truth.extend((row[0], row[1]) for row in truth_rows)
+            label = truth_rows[0][2]
+            buf_segments[user_id] = -1 if label is None else int(label)
+            if len(buf_segments) >= chunk_users:
+                flush()
+        flush()
+
+    means = overall_acc.means()
+    overall = _summarize(means['precision'], means['recall'], means['ndcg'], means['ap'], means['hit'])
+    overall['k_value'] = k
+    overall['coverage'] = float(n_recommended / n_catalog_items) if n_catalog_items else 0.0
+    overall['user_count'] = overall_acc.count
+    overall['hit_user_count'] = int(round(overall_acc.sums['hit']))
+
+    seg_means = pd.DataFrame({seg: acc.means() for seg, acc in sorted(segment_acc.items())}).T
+    seg_counts = {seg: acc.count for seg, acc in segment_acc.items()}
+    return overall, _summarize_segments(seg_means, seg_counts)
+
+
+def _save_metrics(metrics_results, segment_results):
+    """结果持久化入库供前端展示"""
+    m_df = pd.DataFrame(metrics_results)
     try:
-        print("🔍 开始从数据库提取评测数据进行离线评估...")
+        with get_engine("bulk_write").begin() as conn:
+            # 清理旧指标并存入最新重构任务的指标
+            conn.execute(text("DELETE FROM model_metrics"))
+            m_df.to_sql('model_metrics', con=conn, if_exists='append', index=False)
 
-        # 1. 加载真值 (Ground Truth)
-        # 使用 CAST 确保 user_id 和 item_id 统一为字符类型，防止匹配失败
-        true_query = text("""
-                          SELECT CAST(user_id AS CHAR) as user_id,
-                                 CAST(item_id AS CHAR) as item_id
-                          FROM fact_user_behavior
-                          WHERE label = 1
-                             OR purchase_intent = 1
-                          """)
+            conn.execute(text("DELETE FROM model_segment_metrics"))
+            if segment_results:
+                pd.concat(segment_results, ignore_index=True).to_sql(
+                    'model_segment_metrics', con=conn, if_exists='append', index=False
+                )
+        bump_data_version("model_metrics")
+        print("🚀 全量实验对比指标已成功更新至数据库 model_metrics / model_segment_metrics 表。")
+    except Exception as e:
+        print(f"❌ 结果写入失败: {e}")
+
+
+def _collect_model_result(model, overall, segments, metrics_results, segment_results):
+    hit_user_count = overall.pop('hit_user_count')
+    overall.pop('user_count')
+    metrics_results.append({'model_type': model, **overall})
+    if segments is not None and not segments.empty:
+        segments.insert(0, 'model_type', model)
+        segment_results.append(segments)
+
+    print(f"✅ {model} 评估完成：命中用户数={hit_user_count}, P={overall['precision_val']:.4f}, "
+          f"R={overall['recall_val']:.4f}, NDCG@{overall['k_value']}={overall['ndcg_val']:.4f}, "
+          f"MAP={overall['map_val']:.4f}, 覆盖率={overall['coverage']:.4f}")
+
+
+def evaluate_models(handoff=None, streaming=False, chunk_users=20000):
+    """
+    核心评价函数：对比真实行为与模型生成的推荐结果
+    :param handoff: EvaluationHandoff，全量重构流水线传入内存中的真值与推荐结果；
+                    为空时 (如独立调用 /api/model/evaluate) 从数据库读取
+    :param streaming: 流式模式，通过服务端游标逐用户归并计算，适用于超大结果表
+    :param chunk_users: 流式模式下每次向量化计算的用户数
+    """
+    metrics_results = []
+    segment_results = []
 
-        with engine.connect() as conn:
-            true_df = pd.read_sql(true_query, conn)
+    if streaming:
+        print("🔍 开始以流式模式从数据库提取评测数据进行离线评估...")
+        try:
+            with get_engine("analytics").connect() as conn:
+                n_catalog_items = conn.execute(text("SELECT COUNT(*) FROM dim_item")).scalar()
+            for i, model in enumerate(EVAL_MODELS):
+                # 流式模式下总用户数未知，百分比按模型粒度推进，分片内只更新已处理用户数
+                overall, segments = evaluate_model_streaming(
+                    model, n_catalog_items, chunk_users=chunk_users,
+                    on_flush=lambda users, i=i, model=model: progress.emit(
+                        "evaluate", i / len(EVAL_MODELS) * 100, rows=users, message=f"{model} 评估中"))
+                progress.emit("evaluate", (i + 1) / len(EVAL_MODELS) * 100, message=f"{model} 评估完成")
+                if overall is None:
+                    print(f"⚠️ 警告：未找到模型 {model} 的推荐数据。")
+                    continue
+                _collect_model_result(model, overall, segments, metrics_results, segment_results)
+        except Exception as e:
+            print(f"❌ 流式评估异常: {e}")
+            return
+
+        if metrics_results:
+            _save_metrics(metrics_results, segment_results)
+        return
+
+    handoff = handoff or EvaluationHandoff()
+    try:
+        print("🔍 开始提取评测数据进行离线评估...")
+
+        # 1. 加载真值 (Ground Truth)、用户分群与商品库规模，内存中已有的部分直接复用
+        #    从数据库读取的部分同样编码为 int32，与内存中的交接结果口径一致
+        ids = get_id_dictionary()
+        with get_engine("analytics").connect() as conn:
+            true_df = handoff.ground_truth
+            if true_df is None:
+                true_df = encode_ids(_load_ground_truth(conn), ids)
+            user_segments = handoff.user_segments
+            if user_segments is None:
+                seg_df = pd.read_sql(
+                    text("SELECT CAST(user_id AS CHAR) as user_id, cluster_label FROM usr_persona"), conn)
+                user_segments = encode_ids(seg_df, ids, columns=('user_id',)).set_index('user_id')['cluster_label']
+            n_catalog_items = handoff.n_catalog_items
+            if n_catalog_items is None:
+                n_catalog_items = conn.execute(text("SELECT COUNT(*) FROM dim_item")).scalar()
 
         if true_df.empty:
-            print("❌ 评价失败：数据库中没有 label=1 的真实购买数据，请检查数据导入状态。")
+            print("❌ 评价失败：没有 label=1 的真实购买数据，请检查数据导入状态。")
             return
 
-        # 转换为集合映射以加速匹配: {user_id: {item_id1, item_id2...}}
-        true_interactions = true_df.groupby('user_id')['item_id'].apply(set).to_dict()
-        print(f"📊 评估诊断：成功加载 {len(true_interactions)} 个用户的真实购买记录。")
+        print(f"📊 评估诊断：成功加载 {true_df['user_id'].nunique()} 个用户的真实购买记录。")
 
     except Exception as e:
         print(f"❌ 数据库读取异常: {e}")
         return
 
-    # 2. 定义待评估的模型
-    models = ['User-CF', 'RF-Optimized']
-    metrics_results = []
-
-    for model in models:
-        # 读取模型生成的推荐结果，同样进行类型转换
-        query = text("""
-                     SELECT CAST(user_id AS CHAR) as user_id,
-                            CAST(item_id AS CHAR) as item_id
-                     FROM recommendation_results
-                     WHERE model_type = :mtype
-                     """)
-
-        with engine.connect() as conn:
-            pred_df = pd.read_sql(query, conn, params={"mtype": model})
+    # 2. 逐模型获取推荐结果并计算指标
+    for i, model in enumerate(EVAL_MODELS):
+        pred_df = handoff.predictions.get(model)
+        if pred_df is None:
+            with get_engine("analytics").connect() as conn:
+                pred_df = encode_ids(_load_predictions(conn, model), ids)
 
         if pred_df.empty:
-            print(f"⚠️ 警告：数据库中未找到模型 {model} 的推荐数据。")
+            print(f"⚠️ 警告：未找到模型 {model} 的推荐数据。")
             continue
 
-        # 转换为字典格式进行对比
-        pred_dict = pred_df.groupby('user_id')['item_id'].apply(list).to_dict()
-        precisions, recalls = [], []
-
-        # 3. 核心指标计算逻辑：逐个用户对比
-        for user_id, true_items in true_interactions.items():
-            if user_id in pred_dict:
-                pred_items = set(pred_dict[user_id])
-                # 计算交集，即模型成功预测出的商品
-                hit_items = true_items.intersection(pred_items)
-
-                # Precision: 推荐出的结果中有多少是用户真正购买的
-                precisions.append(len(hit_items) / len(pred_items) if len(pred_items) > 0 else 0)
-                # Recall: 用户买过的商品中有多少被系统成功推荐了
-                recalls.append(len(hit_items) / len(true_items) if len(true_items) > 0 else 0)
-            else:
-                # 若模型未覆盖该用户，则该用户指标记为 0
-                precisions.append(0)
-                recalls.append(0)
-
-        # 4. 计算所有用户的平均指标
-        p = np.mean(precisions) if precisions else 0
-        r = np.mean(recalls) if recalls else 0
-        f1 = (2 * p * r) / (p + r) if (p + r) > 0 else 0
-
-        metrics_results.append({
-            'model_type': model,
-            'precision_val': p,
-            'recall_val': r,
-            'f1_val': f1
-        })
-
-        hit_user_count = sum(1 for x in precisions if x > 0)
-        print(f"✅ {model} 评估完成：命中用户数={hit_user_count}, P={p:.4f}, R={r:.4f}")
-
-    # 5. 结果持久化入库供前端展示
+        # 3. 稀疏矩阵向量化计算全部指标
+        overall, segments = compute_ranking_metrics(
+            true_df, pred_df, user_segments=user_segments, n_catalog_items=n_catalog_items
+        )
+        _collect_model_result(model, overall, segments, metrics_results, segment_results)
+        progress.emit("evaluate", (i + 1) / len(EVAL_MODELS) * 100, rows=len(pred_df), message=f"{model} 评估完成")
+
+    # 4. 结果持久化入库供前端展示
     if metrics_results:
-        m_df = pd.DataFrame(metrics_results)
-        try:
-            with engine.begin() as conn:
-                # 清理旧指标并存入最新重构任务的指标
-                conn.execute(text("DELETE FROM model_metrics"))
-                m_df.to_sql('model_metrics', con=conn, if_exists='append', index=False)
-            print("🚀 全量实验对比指标已成功更新至数据库 model_metrics 表。")
-        except Exception as e:
-            print(f"❌ 结果写入失败: {e}")
+        _save_metrics(metrics_results, segment_results)
 
 
 if __name__ == "__main__":
-    evaluate_models()
\ No newline at end of file
+    evaluate_models()
@@ -0,0 +1,228 @@
+"""
+分群热门榜：冷启动 / 低于阈值用户的推荐兜底
+
+流水线按 User-CF 相同的隐式反馈加权得分，分别在全局以及 cluster_label、preferred_category、
+consumption_level 三个维度上统计商品热度，取每个分群的 Top-K 写入 popular_items_segment 表。
+
+API 进程把热门榜 (分群数 x Top-K) 与用户分群映射常驻内存：分群映射按 ID 字典的用户编码存为 int16 数组
+(每个用户几个字节)。数据版本号变化时由后台线程重新加载，请求线程始终使用当前状态、不等待加载。
+兜底时依次尝试：所属聚类 -> 偏好品类 -> 消费等级 -> 全局，每次查询为常数时间且不访问数据库。
+"""
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+from src.database import get_engine
+from src.recommendation.baseline_user_cf import IMPLICIT_SCORE_SQL, IMPLICIT_FILTER_SQL
+from src.response_cache import bump_data_version, get_data_version
+from src.analytics import read_analytics
+from src.id_dictionary import load_id_dictionary
+
+# 兜底维度的优先级 (越靠前越贴近用户)
+SEGMENT_TYPES = ('cluster_label', 'preferred_category', 'consumption_level')
+GLOBAL_SEGMENT = 'global'
+
+# 每个分群保留的热门商品数
+POPULAR_TOP_K = 50
+
+# API 进程检查数据版本号的最小间隔 (秒)
+RELOAD_INTERVAL = 1.0
+
+# 加载用户分群映射时每次读取的画像行数
+PERSONA_CHUNK_ROWS = 100000
+
+
+def _segment_values(series):
+    """分群取值统一转为字符串；含空值的整数列会被 pandas 读成浮点，需先还原为整数"""
+    if pd.api.types.is_float_dtype(series):
+        series = series.astype('Int64')
+    return series.astype(object).where(series.notna(), None).map(lambda v: None if v is None else str(v))
+
+
+def compute_popularity(top_k=POPULAR_TOP_K):
+    """
+    统计各分群的热门商品
+    :return: DataFrame(segment_type, segment_value, item_id, category, score, rank)
+    """
+    query = f"""
+            SELECT b.item_id,
+                   i.category,
+                   p.cluster_label,
+                   p.preferred_category,
+                   p.consumption_level,
+                   {IMPLICIT_SCORE_SQL} as score
+            FROM fact_user_behavior b
+                     JOIN dim_item i ON b.item_id = i.item_id
+                     LEFT JOIN usr_persona p ON b.user_id = p.user_id
+            WHERE {IMPLICIT_FILTER_SQL}
+            """
+    df = read_analytics(query, tables=("fact_user_behavior", "dim_item", "usr_persona"))
+    if df.empty:
+        return pd.DataFrame(columns=['segment_type', 'segment_value', 'item_id', 'category', 'score', 'rank'])
+
+    item_category = df.drop_duplicates('item_id').set_index('item_id')['category']
+    frames = []
+    for segment_type in (GLOBAL_SEGMENT,) + SEGMENT_TYPES:
+        if segment_type == GLOBAL_SEGMENT:
+            keyed = df.assign(segment_value=GLOBAL_SEGMENT)
+        else:
+            keyed = df.assign(segment_value=_segment_values(df[segment_type])).dropna(subset=['segment_value'])
+        totals = keyed.groupby(['segment_value', 'item_id'])['score'].sum().reset_index()
+        totals = totals.sort_values(['segment_value', 'score', 'item_id'], ascending=[True, False, True])
+        top = totals.groupby('segment_value').head(top_k).copy()
+        top['rank'] = top.groupby('segment_value').cumcount() + 1
+        top['segment_type'] = segment_type
+        frames.append(top)
+
+    result = pd.concat(frames, ignore_index=True)
+    result['category'] = result['item_id'].map(item_category)
+    return result[['segment_type', 'segment_value', 'item_id', 'category', 'score', 'rank']]
+
+
+def save_popularity(top_k=POPULAR_TOP_K):
+    """计算并落库分群热门榜 (全量替换)"""
+    popular = compute_popularity(top_k)
+    with get_engine("bulk_write").begin() as conn:
+        conn.execute(text("DELETE FROM popular_items_segment"))
+        popular.to_sql('popular_items_segment', con=conn, if_exists='append', index=False,
+                       method='multi', chunksize=2000)
+    bump_data_version("popular_items_segment")
+    print(f"✅ 分群热门榜已更新，共 {popular[['segment_type', 'segment_value']].drop_duplicates().shape[0]} 个分群。")
+    return popular
+
+
+class PopularityFallback:
+    """API 进程内的兜底榜单：热门榜与按 ID 字典编码的用户分群映射常驻内存"""
+
+    def __init__(self):
+        # (榜单 {(segment_type, segment_value): [item dict, ...]}, ID 字典,
+        #  {segment_type: (按用户编码索引的取值编号数组, 取值表)})
+        # 整体替换，读取方不会看到新旧混杂的状态
+        self._state = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+        # 后台加载线程 (同一时间最多一个)
+        self._loader = None
+
+    @staticmethod
+    def _load_lists(conn):
+        popular = pd.read_sql(text("""
+                                   SELECT segment_type, segment_value, item_id, category, score, `rank`
+                                   FROM popular_items_segment
+                                   ORDER BY segment_type, segment_value, `rank`
+                                   """), conn)
+        lists = {}
+        for (segment_type, segment_value), group in popular.groupby(['segment_type', 'segment_value'], sort=False):
+            # 分群内得分归一化到 (0, 1]，与模型得分的量纲保持一致
+            top_score = group['score'].max() or 1.0
+            lists[(segment_type, str(segment_value))] = [
+                {"item_id": row.item_id, "category": row.category,
+                 "score": round(float(row.score / top_score), 4), "rank": int(row.rank)}
+                for row in group.itertuples(index=False)
+            ]
+        return lists
+
+    @staticmethod
+    def _load_segments(conn, ids):
+        """
+        用户分群映射：每个维度一个按用户编码索引的 int16 数组 (取值表中的位置，-1 为无画像)，
+        每个用户只占几个字节；画像表分块读取，不整体载入内存
+        """
+        segments = {t: (np.full(len(ids.users), -1, dtype=np.int16), {}) for t in SEGMENT_TYPES}
+        for chunk in pd.read_sql(text(f"""
+                                      SELECT CAST(user_id AS CHAR) as user_id, {', '.join(SEGMENT_TYPES)}
+                                      FROM usr_persona
+                                      """), conn, chunksize=PERSONA_CHUNK_ROWS):
+            codes = ids.encode('user_id', chunk['user_id'])
+            known = codes >= 0
+            for segment_type, (values, vocab) in segments.items():
+                column = _segment_values(chunk[segment_type])[known]
+                values[codes[known]] = [-1 if v is None else vocab.setdefault(v, len(vocab)) for v in column]
+        return {t: (values, list(vocab)) for t, (values, vocab) in segments.items()}
+
+    @classmethod
+    def _load(cls):
+        # 读主库：热门榜按数据版本号重新加载，读副本可能加载到复制延迟前的旧榜单
+        # 画像按入库时生成的 ID 字典编码 (字典缺失时所有用户都使用全局榜)
+        ids = load_id_dictionary()
+        with get_engine("serving").connect() as conn:
+            lists = cls._load_lists(conn)
+            segments = cls._load_segments(conn, ids) if ids is not None else None
+        return lists, ids, segments
+
+    def _reload(self, version):
+        try:
+            state = self._load()
+        except Exception as e:
+            # 加载失败时保留旧榜单继续服务，下一次版本检查会重试
+            print(f"⚠️ 分群热门榜加载失败: {e}")
+            return
+        with self._lock:
+            self._state, self._version = state, version
+
+    def refresh(self, force=False):
+        """
+        检查数据版本号，变化时重新加载榜单
+        :param force: 同步加载 (启动时使用)；否则交给后台线程，调用方立即返回
+        """
+        now = time.monotonic()
+        if not force and now - self._checked_at < RELOAD_INTERVAL:
+            return
+        with self._lock:
+            self._checked_at = now
+            loading = self._loader is not None and self._loader.is_alive()
+        if not force and loading:
+            return
+        version = get_data_version()
+        if version == self._version and self._state is not None:
+            return
+        if force:
+            self._reload(version)
+            return
+        with self._lock:
+            if self._loader is not None and self._loader.is_alive():
+                return
+            # 一次重建会多次递增版本号：加载期间的新版本留给下一次检查，不会排队多次加载
+            self._loader = threading.Thread(target=self._reload, args=(version,),
+                                            name="popularity-reload", daemon=True)
+            self._loader.start()
+
+    @staticmethod
+    def _profile(ids, segments, user_id):
+        """用户的 (cluster_label, preferred_category, consumption_level)；未建画像时返回 None"""
+        if ids is None or segments is None:
+            return None
+        try:
+            code = ids.users.get_loc(str(user_id))
+        except KeyError:
+            return None
+        profile = tuple(None if values[code] < 0 else vocab[values[code]]
+                        for values, vocab in (segments[t] for t in SEGMENT_TYPES))
+        return profile if any(v is not None for v in profile) else None
+
+    def get(self, user_id, top_n=5):
+        """
+        按优先级返回第一个可用分群的热门商品 (只查内存，不访问数据库)
+        :return: (items, segment)；榜单未加载时返回 (None, None)，调用方应回退到数据库
+        """
+        self.refresh()
+        state = self._state
+        if state is None or not state[0]:
+            return None, None
+        lists, ids, segments = state
+        # 未建画像的用户 (冷启动) 直接使用全局榜
+        profile = self._profile(ids, segments, user_id) or (None,) * len(SEGMENT_TYPES)
+        candidates = [(t, v) for t, v in zip(SEGMENT_TYPES, profile) if v is not None]
+        candidates.append((GLOBAL_SEGMENT, GLOBAL_SEGMENT))
+        for key in candidates:
+            items = lists.get(key)
+            if items:
+                return items[:top_n], GLOBAL_SEGMENT if key[0] == GLOBAL_SEGMENT else f"{key[0]}:{key[1]}"
+        return None, None
+
+
+popularity_fallback = PopularityFallback()
@@ -2,42 +2,271 @@ import pandas as pd
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.cluster import KMeans  # 新增：用于计算手肘法
 from sklearn.metrics import precision_recall_fscore_support  # 新增：用于敏感度趋势分析
-from src.database import engine
+from src.database import get_engine
 from sqlalchemy import text
+from src import progress
+from src.response_cache import bump_data_version
+from src.analytics import read_analytics, iter_analytics
+from src.recommendation.serving_store import serving_store
+from src.id_dictionary import get_id_dictionary, encode_ids, decode_ids, compact_dtypes
+from src.feature_store import load_features, feature_categories, one_hot_columns
 import joblib
+import copy
+import multiprocessing
+import json
 import os
+import time
+import warnings
 import numpy as np
 import gc
+from pathlib import Path
 from concurrent.futures import ProcessPoolExecutor
-from sklearn.model_selection import train_test_split  # 核心新增：数据集拆分工具
 
 # 全局共享变量，减少子进程序列化开销
 _shared_data = {}
 
+# 模型目录：模型文件、元数据 (水位线、验证 F1) 与全量训练时的困难验证集
+RF_MODEL_DIR = Path(os.getenv("RF_MODEL_DIR", "libs"))
+RF_MODEL_PATH = RF_MODEL_DIR / "rf_model.pkl"
+RF_META_PATH = RF_MODEL_DIR / "rf_model.json"
+RF_VALIDATION_PATH = RF_MODEL_DIR / "rf_validation.pkl"
+
+# 森林规模：全量训练的树数即增量模式下保持的树数上限
+RF_TREE_BUDGET = 150
+# 增量训练每次追加的树数 (同时淘汰同样数量最早的树)
+RF_INCREMENTAL_TREES = int(os.getenv("RF_INCREMENTAL_TREES", "30"))
+
+# 训练集加载：行为 x 画像 (未标注的行为不参与训练，类别计数使用相同的过滤条件)；商品属性、品类独热列与用户品类亲和度取自特征库 (src.feature_store)
+# 按 behavior_id 排序：顺序抽样按行到达的顺序决定去留，DuckDB 并行扫描的输出顺序不固定，不排序时同样的数据会抽出不同的样本
+RF_TRAINING_QUERY = """
+        SELECT b.behavior_id, \
+               b.user_id, \
+               b.item_id, \
+               b.label, \
+               COALESCE(b.pv_count, 0)    as pv_count,
+               COALESCE(b.add2cart, 0)    as add2cart,
+               COALESCE(b.collect_num, 0) as collect_num,
+               COALESCE(b.like_num, 0)    as like_num,
+               COALESCE(b.purchase_intent, 0) as purchase_intent,
+               p.cluster_label, \
+               p.is_churn_risk,
+               p.loyalty_score, \
+               p.price_sensitivity
+        FROM fact_user_behavior b
+                 JOIN usr_persona p ON b.user_id = p.user_id
+        WHERE b.label IS NOT NULL
+        ORDER BY b.behavior_id
+        """
+
+# 各类别的总样本数与水位线之后的新样本数
+RF_CLASS_COUNT_QUERY = """
+        SELECT b.label,
+               COUNT(*) as n,
+               SUM(CASE WHEN b.behavior_id > :since THEN 1 ELSE 0 END) as n_new
+        FROM fact_user_behavior b
+                 JOIN usr_persona p ON b.user_id = p.user_id
+        WHERE b.label IS NOT NULL
+        GROUP BY b.label
+        """
+
+# 水位线之前数据的校验值：重新导入后 behavior_id 相同但内容不同 (或行数变化) 时不能增量训练
+RF_WATERMARK_QUERY = """
+        SELECT COUNT(*)                     as n,
+               SUM(label)                   as labels,
+               SUM(COALESCE(pv_count, 0))   as pv_count,
+               SUM(COALESCE(add2cart, 0))   as add2cart
+        FROM fact_user_behavior
+        WHERE behavior_id <= :watermark
+        """
+
+# 模型使用的商品属性
+RF_ITEM_FEATURES = ['price', 'discount_rate', 'has_video']
+
+# 训练 / 验证集构建参数
+RF_VAL_FRACTION = 0.2  # 验证集比例 (按正负样本分层)
+RF_NEG_RATIO = 4  # 训练集 负:正
+RF_VAL_NOISE = 10  # 验证集额外注入的负样本倍数 (模拟真实海选场景，抑制折线图虚高)
+RF_VAL_NEG_RATIO = 20  # 验证集实际保留的 负:正 上限，其余负样本以样本权重折算
+KMEANS_SAMPLE_ROWS = 50000  # 手肘法的均匀抽样行数
+RF_SEED = 42
+
+BEHAVIOR_COLS = ['user_id', 'item_id', 'pv_count', 'add2cart', 'collect_num', 'like_num']
+KMEANS_COLS = ['loyalty_score', 'price_sensitivity', 'pv_count', 'add2cart']
+
+
+def _load_item_features():
+    """商品属性 + 品类 + 按特征库品类表对齐的独热列"""
+    columns = ['item_id', 'category'] + RF_ITEM_FEATURES + one_hot_columns(feature_categories())
+    return load_features("item_features", columns=columns)
+
+
+def _load_user_category_affinity():
+    """用户 x 品类亲和度：该用户在该品类下的 pv 之和"""
+    affinity = load_features("user_category", columns=('user_id', 'category', 'pv_count'))
+    affinity = affinity.rename(columns={'pv_count': 'cat_pref_score'})
+    affinity['cat_pref_score'] = affinity['cat_pref_score'].astype(np.float32)
+    return affinity
+
+
+class _SequentialSampler:
+    """
+    顺序抽样 (总数已知的蓄水池抽样)：从 total 行的数据流中等概率地恰好选出 size 行，逐块决定、无需回看
+    每块选中的行数服从超几何分布，块内位置均匀随机
+    """
+
+    def __init__(self, total, size, rng):
+        self.remaining = int(total)
+        self.needed = int(min(size, total))
+        self.rng = rng
+
+    def take(self, n):
+        """返回长度 n 的布尔掩码"""
+        mask = np.zeros(n, dtype=bool)
+        # 查询之间数据有变化时，以实际行数为准
+        self.remaining = max(self.remaining, n)
+        k = int(self.rng.hypergeometric(self.needed, self.remaining - self.needed, n)) if n else 0
+        mask[self.rng.choice(n, size=k, replace=False)] = True
+        self.remaining -= n
+        self.needed -= k
+        return mask
+
+
+class TrainingSets:
+    """
+    流式构建的训练 / 验证数据
+    - train / val: 已关联商品特征与品类亲和度的样本 (含 label)
+    - val_weight: 验证样本权重，负样本按抽样比例折算，与全量负样本 + 噪声注入的验证集口径一致
+    - kmeans_sample / kmeans_scale: 手肘法的均匀抽样及 SSE 折算系数
+    - active_users: 有行为记录的用户编码
+    - rows / max_behavior_id: 扫描的行数与最大 behavior_id (下一次增量训练的水位线)
+    - hard: 按 hard_ids 重新构造特征的困难验证样本
+    """
+
+    def __init__(self):
+        self.train = None
+        self.val = None
+        self.val_weight = None
+        self.kmeans_sample = None
+        self.kmeans_scale = 1.0
+        self.active_users = None
+        self.rows = 0
+        self.max_behavior_id = 0
+        self.hard = None
+
+
+def _class_counts(since):
+    """:return: (水位线之后的正样本数, 水位线之后的负样本数, 全部样本数)"""
+    counts = read_analytics(RF_CLASS_COUNT_QUERY, tables=("fact_user_behavior", "usr_persona"),
+                            params={"since": since})
+    new = dict(zip(counts['label'].astype(int), counts['n_new'].fillna(0).astype(int)))
+    return new.get(1, 0), new.get(0, 0), int(counts['n'].sum())
+
 
-def _init_worker(behavior_summary, user_cat_affinity, all_items_prepped, feature_names):
+def build_training_sets(ids, all_items, user_cat_affinity, since=None, hard_ids=None):
     """
-    子进程初始化：加载预处理好的特征数据
+    分块流式读取行为 x 画像联查，一遍扫描构建训练集与验证集，不在内存中保留完整联查结果：
+    - 先用聚合查询得到正负样本数，按类别顺序抽样出恰好 RF_VAL_FRACTION 的验证集 (分层拆分)
+    - 训练集保留全部正样本，负样本顺序抽样到 RF_NEG_RATIO 倍
+    - 验证集保留全部正样本，负样本最多保留 RF_VAL_NEG_RATIO 倍，按权重还原
+      “全部验证负样本 + RF_VAL_NOISE 倍噪声”的比例
+    - 只对被选中的样本关联商品特征与品类亲和度
+    训练内存随抽样后的样本量增长，而不是随事实表增长；预测阶段的行为计数与评估真值取自特征库 user_items 表
+    :param since: 增量训练的水位线，只从 behavior_id 大于它的新行为中抽取训练 / 验证样本；
+                  手肘法抽样仍覆盖全部数据
+    :param hard_ids: 困难验证集的 behavior_id；在同一遍扫描中按当前的画像与特征库重新构造这些样本的特征
+    """
+    since = -1 if since is None else int(since)
+    n_pos, n_neg, total = _class_counts(since)
+    rng = np.random.default_rng(RF_SEED)
+    val_pos, val_neg = round(n_pos * RF_VAL_FRACTION), round(n_neg * RF_VAL_FRACTION)
+    split = {1: _SequentialSampler(n_pos, val_pos, rng), 0: _SequentialSampler(n_neg, val_neg, rng)}
+    train_neg = _SequentialSampler(n_neg - val_neg, (n_pos - val_pos) * RF_NEG_RATIO, rng)
+    val_neg_kept = _SequentialSampler(val_neg, val_pos * RF_VAL_NEG_RATIO, rng)
+    kmeans = _SequentialSampler(total, KMEANS_SAMPLE_ROWS, rng)
+
+    sets = TrainingSets()
+    train_parts, val_parts, kmeans_parts, user_parts = [], [], [], []
+    hard_parts = []
+    for chunk in iter_analytics(RF_TRAINING_QUERY, tables=("fact_user_behavior", "usr_persona")):
+        chunk = compact_dtypes(encode_ids(chunk, ids))
+        sets.rows += len(chunk)
+        behavior_id = chunk['behavior_id'].to_numpy()
+        sets.max_behavior_id = max(sets.max_behavior_id, int(behavior_id.max()))
+        user_parts.append(chunk['user_id'].unique())
+        kmeans_parts.append(chunk.loc[kmeans.take(len(chunk)), KMEANS_COLS])
+
+        # 分层拆分：每个类别各自顺序抽样 (只在水位线之后的新行为中进行)
+        labels = np.where(behavior_id > since, chunk['label'].to_numpy(), -1)
+        in_val = np.zeros(len(chunk), dtype=bool)
+        for label, sampler in split.items():
+            rows = np.flatnonzero(labels == label)
+            in_val[rows[sampler.take(len(rows))]] = True
+        keep_train = ~in_val & (labels == 1)
+        keep_val = in_val & (labels == 1)
+        rows = np.flatnonzero(~in_val & (labels == 0))
+        keep_train[rows[train_neg.take(len(rows))]] = True
+        rows = np.flatnonzero(in_val & (labels == 0))
+        keep_val[rows[val_neg_kept.take(len(rows))]] = True
+
+        train_parts.append(chunk[keep_train])
+        val_parts.append(chunk[keep_val])
+        if hard_ids is not None:
+            hard_parts.append(chunk[np.isin(behavior_id, hard_ids)])
+        progress.emit("rf", 10 * sets.rows / max(total, 1), rows=sets.rows, total=total,
+                      message="正在流式构建训练集")
+
+    if not sets.rows:
+        raise RuntimeError("行为 x 画像联查结果为空，无法训练随机森林")
+
+    def enrich(parts):
+        # purchase_intent 仅用于评估真值，不参与模型特征
+        df = pd.concat(parts, ignore_index=True).drop(columns=['purchase_intent'])
+        df = df.merge(all_items, on='item_id')
+        df = df.merge(user_cat_affinity, on=['user_id', 'category'], how='left')
+        df['cat_pref_score'] = df['cat_pref_score'].fillna(0)
+        return df
+
+    sets.train = enrich(train_parts).sample(frac=1, random_state=RF_SEED, ignore_index=True)
+    sets.val = enrich(val_parts).sample(frac=1, random_state=RF_SEED, ignore_index=True)
+    kept_neg = int((sets.val['label'] == 0).sum())
+    neg_weight = val_neg * (1 + RF_VAL_NOISE) / kept_neg if kept_neg else 1.0
+    sets.val_weight = np.where(sets.val['label'] == 0, neg_weight, 1.0)
+    if hard_ids is not None:
+        sets.hard = enrich(hard_parts)
+
+    sets.kmeans_sample = pd.concat(kmeans_parts, ignore_index=True)
+    sets.kmeans_scale = sets.rows / max(len(sets.kmeans_sample), 1)
+    sets.active_users = np.unique(np.concatenate(user_parts))
+
+    scope = f"水位线 {since} 之后的" if since >= 0 else ""
+    print(f"📦 训练集构建完成：扫描 {sets.rows} 行，{scope}训练集 {len(sets.train)} 行 "
+          f"(正 {int(sets.train['label'].sum())})，验证集 {len(sets.val)} 行 (负样本权重 {neg_weight:.2f})")
+    return sets
+
+
+def _init_worker(user_cat_affinity, all_items_prepped, feature_names):
+    """
+    子进程初始化：加载预处理好的特征数据 (用户 x 商品行为计数按批次从特征库读取)
     """
     global _shared_data
-    _shared_data['behavior_summary'] = behavior_summary
     _shared_data['user_cat_affinity'] = user_cat_affinity
     _shared_data['all_items_prepped'] = all_items_prepped
     _shared_data['feature_names'] = feature_names
     # 预加载模型到内存
-    _shared_data['model'] = joblib.load('libs/rf_model.pkl')
+    _shared_data['model'] = joblib.load(RF_MODEL_PATH)
 
 
 def _predict_user_batch_extreme_precision(user_batch, top_n=5, threshold=0.6):
     """
     高性能预测函数：剔除重复的独热编码逻辑
+    user_id / item_id 均为 ID 字典的 int32 编码，笛卡尔积与关联都在整数键上完成
     """
     global _shared_data
     try:
         rf = _shared_data['model']
         # all_items_prepped 已经是包含 dummy 变量的完整商品表
         all_items = _shared_data['all_items_prepped']
-        behavior_summary = _shared_data['behavior_summary']
+        behavior_summary = load_features("user_items", columns=BEHAVIOR_COLS, users=user_batch['user_id'].to_numpy())
         user_cat_affinity = _shared_data['user_cat_affinity']
         feature_names = _shared_data['feature_names']
 
@@ -48,9 +277,9 @@ def _predict_user_batch_extreme_precision(user_batch, top_n=5, threshold=0.6):
         combined = combined.merge(behavior_summary, on=['user_id', 'item_id'], how='left')
         combined = combined.merge(user_cat_affinity, on=['user_id', 'category'], how='left')
 
-        # 3. 缺失值填充
+        # 3. 缺失值填充 (左连接后的整数列会变为 float64，统一压回 float32)
         fill_cols = ['pv_count', 'add2cart', 'collect_num', 'like_num', 'cat_pref_score']
-        combined[fill_cols] = combined[fill_cols].fillna(0)
+        combined[fill_cols] = combined[fill_cols].fillna(0).astype(np.float32)
 
         # 4. 对齐特征列（确保包含所有 dummy 变量）
         for col in feature_names:
@@ -87,10 +316,11 @@ def _predict_user_batch_extreme_precision(user_batch, top_n=5, threshold=0.6):
 # 新增：元数据记录辅助函数
 # ==========================================================
 
-def record_kmeans_metrics(df):
+def record_kmeans_metrics(df, scale=1.0):
     """
     计算 K-Means 手肘法数据并存入数据库
     修正：防御性特征选择，防止字段缺失报错，对齐数据库字段名
+    :param scale: df 为均匀抽样时传入 总行数 / 抽样行数，SSE 按比例折算回全量口径
     """
     print(">>> 正在计算 K-Means 手肘法指标...")
     try:
@@ -118,12 +348,13 @@ def record_kmeans_metrics(df):
             km = KMeans(n_clusters=k, random_state=42, n_init=10)
             km.fit(cluster_df)
             # 2. 字段名必须与 main.py 的 SQL 查询 (k_value/sse_value) 保持一致
-            elbow_data.append({'k_value': k, 'sse_value': float(km.inertia_)})
+            elbow_data.append({'k_value': k, 'sse_value': float(km.inertia_) * scale})
 
-        with engine.begin() as conn:
+        with get_engine("bulk_write").begin() as conn:
             # 3. 强制清空旧数据并插入
             conn.execute(text("DELETE FROM kmeans_metrics"))
             pd.DataFrame(elbow_data).to_sql('kmeans_metrics', con=conn, if_exists='append', index=False)
+        bump_data_version("kmeans_metrics")
 
         print("✅ SSE 指标已成功存入 kmeans_metrics 表。")
     except Exception as e:
@@ -131,9 +362,10 @@ def record_kmeans_metrics(df):
         print(f"⚠️ K-Means 指标记录失败。错误详情: {e}")
 
 
-def record_rf_sensitivity(rf, X_val, y_val):
+def record_rf_sensitivity(rf, X_val, y_val, sample_weight=None):
     """
     使用独立的验证集计算随机森林阈值敏感度趋势，并存入数据库。
+    :param sample_weight: 验证样本权重 (负样本为抽样保留时按比例折算)
     """
     print(">>> 正在基于验证集分析随机森林阈值敏感度趋势...")
     try:
@@ -149,7 +381,7 @@ def record_rf_sensitivity(rf, X_val, y_val):
             # 3. 计算 P/R/F1 指标
             # 随着阈值 t 的增加，Precision (准确率) 会上升，Recall (召回率) 会合理下降
             p, r, f, _ = precision_recall_fscore_support(
-                y_val, preds, average='binary', zero_division=0
+                y_val, preds, average='binary', zero_division=0, sample_weight=sample_weight
             )
 
             sensitivity_data.append({
@@ -160,7 +392,7 @@ def record_rf_sensitivity(rf, X_val, y_val):
             })
 
         # 4. 持久化到数据库
-        with engine.begin() as conn:
+        with get_engine("bulk_write").begin() as conn:
             conn.execute(text("DELETE FROM rf_sensitivity_metrics"))
             pd.DataFrame(sensitivity_data).to_sql(
                 'rf_sensitivity_metrics',
@@ -168,115 +400,222 @@ def record_rf_sensitivity(rf, X_val, y_val):
                 if_exists='append',
                 index=False
             )
+        bump_data_version("rf_sensitivity_metrics")
         print("✅ 真实敏感度指标已落库。")
     except Exception as e:
         print(f"⚠️ RF 敏感度分析失败: {e}")
 
 
-def train_recommendation_model(top_n=5, threshold=0.6):
+# ==========================================================
+# 模型持久化与增量训练
+# ==========================================================
+
+def _atomic_dump(path, write):
+    """先写临时文件再原子替换，预测子进程不会读到写了一半的模型"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def _save_model(rf, meta, validation=None):
+    _atomic_dump(RF_MODEL_PATH, lambda tmp: joblib.dump(rf, tmp))
+    if validation is not None:
+        _atomic_dump(RF_VALIDATION_PATH, lambda tmp: joblib.dump(validation, tmp))
+    # 元数据最后写入：中途失败时水位线停留在旧值，下次增量只会多训练一部分数据
+    _atomic_dump(RF_META_PATH, lambda tmp: tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8'))
+
+
+def _watermark_check(watermark):
+    row = read_analytics(RF_WATERMARK_QUERY, tables=("fact_user_behavior",), params={"watermark": watermark}).iloc[0]
+    return [int(v) if pd.notna(v) else 0 for v in row]
+
+
+def _load_incremental_base():
+    """
+    增量训练的基准：上一次的模型、元数据与困难验证集 (behavior_id 与样本权重)
+    文件缺失，或水位线之前的行为数据已被改写 (重新入库的数据不是在原有数据之后追加) 时返回 None
+    困难验证集只保存 behavior_id，特征在每次比较时按当前的画像与特征库重新构造：
+    画像重新聚类 (簇编号可能变化)、特征库重建后，比较的依然是预测时实际使用的特征
+    """
+    try:
+        meta = json.loads(RF_META_PATH.read_text(encoding='utf-8'))
+        model = joblib.load(RF_MODEL_PATH)
+        validation = joblib.load(RF_VALIDATION_PATH)
+        validation = pd.Series(validation['weight'], index=validation['behavior_id'])
+    except Exception as e:
+        print(f"⚠️ 没有可增量更新的模型 ({e})，改为全量训练")
+        return None
+    if _watermark_check(meta['watermark']) != meta['watermark_check']:
+        print("⚠️ 水位线之前的行为数据已变化 (数据被重新导入)，改为全量训练")
+        return None
+    return meta, model, validation
+
+
+def _grow_forest(previous, X_new, y_new, seed):
+    """
+    warm_start 追加 RF_INCREMENTAL_TREES 棵以新数据训练的树，再淘汰最早的树，保持 RF_TREE_BUDGET 棵
+    (estimators_ 按训练先后排列)；在副本上进行，上一版本模型留作对比
+    :param seed: 本次更新的随机种子。warm_start 按已有树数跳过种子序列，淘汰后树数恒为 RF_TREE_BUDGET，
+                 沿用固定种子会让每批新树拿到完全相同的种子，因此每次更新须使用不同的种子
+    """
+    rf = copy.deepcopy(previous)
+    rf.set_params(warm_start=True, n_estimators=len(rf.estimators_) + RF_INCREMENTAL_TREES, random_state=seed)
+    with warnings.catch_warnings():
+        # 每批新树按其自身训练数据计算 balanced 类别权重，正是这里需要的行为
+        warnings.filterwarnings("ignore", message=".*class_weight presets.*")
+        rf.fit(X_new, y_new)
+    rf.estimators_ = rf.estimators_[-RF_TREE_BUDGET:]
+    rf.set_params(warm_start=False, n_estimators=len(rf.estimators_))
+    return rf
+
+
+def _weighted_f1(rf, X, y, weight, threshold):
+    preds = (rf.predict_proba(X)[:, 1] >= threshold).astype(int)
+    _, _, f1, _ = precision_recall_fscore_support(y, preds, average='binary', zero_division=0,
+                                                  sample_weight=weight)
+    return float(f1)
+
+
+def _model_meta(rf, sets, f1, threshold, mode, updates):
+    return {
+        "mode": mode,
+        "updates": updates,
+        "trained_at": time.time(),
+        "n_estimators": len(rf.estimators_),
+        "watermark": sets.max_behavior_id,
+        "watermark_check": _watermark_check(sets.max_behavior_id),
+        "threshold": threshold,
+        "f1": f1,
+        "features": list(rf.feature_names_in_),
+    }
+
+
+def _features(df):
+    """品类已展开为独热列，原始品类列只用于关联；behavior_id 只用于水位线与困难验证集"""
+    non_feature_cols = ['label', 'behavior_id', 'user_id', 'item_id', 'category']
+    return df.drop(non_feature_cols, axis=1), df['label']
+
+
+def _feature_frames(sets):
+    return _features(sets.train) + _features(sets.val)
+
+
+def train_recommendation_model(top_n=5, threshold=0.6, handoff=None, incremental=False):
     """
     针对性优化版本：
     1. 保持详细指标：通过 class_weight='balanced' 和高质量训练集确保预测能力。
     2. 抑制折线图虚高：通过为验证集手动引入“负采样干扰”模拟真实海选场景。
     3. 进度反馈：加入分片执行的百分比打印。
+    4. 增量模式：在上一版本模型上追加以水位线之后的新行为训练的树、淘汰最早的树，
+       困难验证集上 F1 不下降才发布新模型，训练耗时随增量数据量而不是全量数据增长。
+    :param handoff: 可选的 EvaluationHandoff，特征库中的评估真值与全量预测结果直接交给评估阶段
+    :param incremental: 增量训练；没有可用的上一版本模型 (或数据被重新导入、特征列变化) 时回退到全量训练
     """
     try:
         print("\n" + "========================================")
         print("🚀 RF-Optimized 深度调优模式启动")
-        print(f"📏 策略参数：阈值({threshold}) | Top-{top_n}")
+        print(f"📏 策略参数：阈值({threshold}) | Top-{top_n} | {'增量' if incremental else '全量'}训练")
         print("========================================")
 
-        # 1. 训练数据加载
-        query = """
-                SELECT b.user_id, \
-                       b.item_id, \
-                       b.label, \
-                       i.category,
-                       COALESCE(b.pv_count, 0)    as pv_count,
-                       COALESCE(b.add2cart, 0)    as add2cart,
-                       COALESCE(b.collect_num, 0) as collect_num,
-                       COALESCE(b.like_num, 0)    as like_num,
-                       p.cluster_label, \
-                       p.is_churn_risk,
-                       p.loyalty_score, \
-                       p.price_sensitivity,
-                       i.price, \
-                       i.discount_rate, \
-                       i.has_video
-                FROM fact_user_behavior b
-                         JOIN usr_persona p ON b.user_id = p.user_id
-                         JOIN dim_item i ON b.item_id = i.item_id
-                """
-        df_raw = pd.read_sql(query, engine)
-
-        # 2. 数据拆分
-        print(">>> 正在执行非对称拆分...")
-        train_pool, val_pool = train_test_split(
-            df_raw, test_size=0.2, random_state=42, stratify=df_raw['label']
-        )
-
-        # 3. 训练集平衡处理：保持 1:4 比例确保模型学到足够特征
-        pos_train = train_pool[train_pool['label'] == 1]
-        neg_train = train_pool[train_pool['label'] == 0]
-        target_neg_count = len(pos_train) * 4
-        if len(neg_train) > target_neg_count:
-            neg_train = neg_train.sample(n=target_neg_count, random_state=42)
-        df_train_balanced = pd.concat([pos_train, neg_train]).sample(frac=1, random_state=42)
-
-        # 4. 特征工程
-        user_cat_affinity = df_train_balanced.groupby(['user_id', 'category']).agg(
-            cat_pref_score=('pv_count', 'sum')).reset_index()
-
-        # 训练集特征准备
-        X_train_raw = df_train_balanced.drop(['label', 'user_id', 'item_id'], axis=1)
-        X_train = pd.get_dummies(X_train_raw, columns=['category'])
-        y_train = df_train_balanced['label']
-
-        # --- 验证集噪声注入 (解决折线图虚高) ---
-        val_with_pref = val_pool.merge(user_cat_affinity, on=['user_id', 'category'], how='left').fillna(0)
-        neg_val_noise = val_with_pref[val_with_pref['label'] == 0].sample(frac=10, replace=True, random_state=42)
-        val_tough = pd.concat([val_with_pref, neg_val_noise]).sample(frac=1, random_state=42)
-
-        X_val_raw = val_tough.drop(['label', 'user_id', 'item_id'], axis=1)
-        X_val = pd.get_dummies(X_val_raw, columns=['category'])
-        y_val = val_tough['label']
-        X_val = X_val.reindex(columns=X_train.columns, fill_value=0)
-
-        # 5. 模型拟合
-        print(f">>> 正在拟合模型 (训练集规模: {len(X_train)})...")
-        rf = RandomForestClassifier(
-            n_estimators=150, max_depth=15, min_samples_leaf=10,
-            class_weight='balanced', n_jobs=-1, random_state=42
-        )
-        rf.fit(X_train, y_train)
-
-        # 6. 记录元数据
-        record_kmeans_metrics(df_raw)
-        record_rf_sensitivity(rf, X_val, y_val)
-
-        # 7. 保存并执行全量预测
-        if not os.path.exists('libs'): os.makedirs('libs')
-        joblib.dump(rf, 'libs/rf_model.pkl')
+        # 1. 训练数据构建：分块流式读取行为 x 画像联查，正样本全部保留、负样本顺序抽样，
+        #    一遍扫描完成分层拆分 (见 build_training_sets)，完整联查结果不会整体驻留内存
+        #    ID 编码为 int32，数值列压缩为 float32 / int8 (随机森林内部本就以 float32 处理特征)
+        #    商品特征 (含独热品类) 与用户品类亲和度直接读取特征库，不再重复联查与 get_dummies
+        #    增量模式下只从水位线之后的新行为中抽取训练 / 验证样本
+        ids = get_id_dictionary()
+        all_items = _load_item_features()
+        user_cat_affinity = _load_user_category_affinity()
+        base = _load_incremental_base() if incremental else None
+        sets = build_training_sets(ids, all_items, user_cat_affinity,
+                                   since=base[0]['watermark'] if base else None,
+                                   hard_ids=base[2].index.to_numpy() if base else None)
+
+        # 2. 特征准备
+        X_train, y_train, X_val, y_val = _feature_frames(sets)
+        if base is not None and list(X_train.columns) != list(base[1].feature_names_in_):
+            print("⚠️ 模型特征列已变化 (如出现新品类)，改为全量训练")
+            base = None
+            sets = build_training_sets(ids, all_items, user_cat_affinity)
+            X_train, y_train, X_val, y_val = _feature_frames(sets)
+
+        # 3. 模型拟合
+        progress.emit("rf", 10, rows=len(X_train), message="训练集构建完成，开始拟合")
+        if base is None:
+            print(f">>> 正在拟合模型 (训练集规模: {len(X_train)})...")
+            rf = RandomForestClassifier(
+                n_estimators=RF_TREE_BUDGET, max_depth=15, min_samples_leaf=10,
+                class_weight='balanced', n_jobs=-1, random_state=RF_SEED
+            )
+            rf.fit(X_train, y_train)
+            X_hard, y_hard, w_hard = X_val, y_val, sets.val_weight
+            f1 = _weighted_f1(rf, X_hard, y_hard, w_hard, threshold)
+            # 本次的验证集即后续增量训练共用的困难验证集 (只保存 behavior_id 与权重)
+            _save_model(rf, _model_meta(rf, sets, f1, threshold, "full", 0),
+                        validation={"behavior_id": sets.val['behavior_id'].to_numpy(), "weight": sets.val_weight})
+        else:
+            # 困难验证集 = 全量训练时保存的验证样本 (按当前特征重新构造) + 本次新数据中拆出的验证样本，
+            # 新旧模型都未见过
+            meta, previous, validation = base
+            X_hard, y_hard = _features(pd.concat([sets.hard, sets.val], ignore_index=True))
+            w_hard = np.concatenate([validation.reindex(sets.hard['behavior_id']).to_numpy(), sets.val_weight])
+            if y_train.nunique() < 2:
+                print("ℹ️ 水位线之后没有足够的新样本 (需同时包含正负样本)，沿用当前模型")
+                rf = previous
+            else:
+                print(f">>> 正在增量拟合模型 (新增训练样本: {len(X_train)}, 追加 {RF_INCREMENTAL_TREES} 棵树)...")
+                candidate = _grow_forest(previous, X_train, y_train, seed=RF_SEED + meta['updates'] + 1)
+                f1_old = _weighted_f1(previous, X_hard, y_hard, w_hard, threshold)
+                f1_new = _weighted_f1(candidate, X_hard, y_hard, w_hard, threshold)
+                if f1_new >= f1_old:
+                    print(f"✅ 困难验证集 F1 {f1_old:.4f} -> {f1_new:.4f}，发布增量模型")
+                    rf = candidate
+                    _save_model(rf, _model_meta(rf, sets, f1_new, threshold, "incremental", meta['updates'] + 1))
+                else:
+                    print(f"⚠️ 困难验证集 F1 下降 ({f1_old:.4f} -> {f1_new:.4f})，沿用上一版本模型")
+                    rf = previous
+
+        # 4. 记录元数据 (敏感度曲线基于当前发布的模型)
+        record_kmeans_metrics(sets.kmeans_sample, scale=sets.kmeans_scale)
+        record_rf_sensitivity(rf, X_hard, y_hard, sample_weight=w_hard)
+        progress.emit("rf", 30, message="模型拟合与元数据记录完成")
+
+        # 5. 执行全量预测：子进程从模型目录加载当前发布的模型
         feature_names = rf.feature_names_in_
 
-        all_users = pd.read_sql(
-            "SELECT user_id, cluster_label, is_churn_risk, loyalty_score, price_sensitivity FROM usr_persona", engine)
-        all_items = pd.read_sql("SELECT item_id, price, discount_rate, has_video, category FROM dim_item", engine)
-
-        dummies = pd.get_dummies(all_items['category'], prefix='category')
-        all_items_prepped = pd.concat([all_items, dummies], axis=1)
-        behavior_summary = df_raw[['user_id', 'item_id', 'pv_count', 'add2cart', 'collect_num', 'like_num']]
-        active_users = all_users[all_users['user_id'].isin(df_raw['user_id'].unique())]
+        all_users = read_analytics(
+            "SELECT user_id, cluster_label, is_churn_risk, loyalty_score, price_sensitivity FROM usr_persona",
+            tables=("usr_persona",))
+        all_users = compact_dtypes(encode_ids(all_users, ids))
+        if handoff is not None:
+            handoff.n_catalog_items = len(all_items)
+            # 评估真值取自特征库的用户 x 商品汇总，不在扫描训练数据时缓存行为明细
+            truth = load_features("user_items", columns=('user_id', 'item_id', 'relevant'))
+            handoff.ground_truth = truth.loc[truth['relevant'] == 1, ['user_id', 'item_id']].reset_index(drop=True)
+            del truth
+
+        active_users = all_users[all_users['user_id'].isin(sets.active_users)]
+        del sets, X_train, y_train, X_val, y_val, X_hard, y_hard, w_hard, base, rf
+        gc.collect()
 
         # 分片逻辑
         num_chunks = 20
-        user_chunks = np.array_split(active_users, num_chunks)
+        # 按行号切分再取 iloc：新版 pandas 中 np.array_split 作用于 DataFrame 会退化为 ndarray
+        user_chunks = [active_users.iloc[idx] for idx in np.array_split(np.arange(len(active_users)), num_chunks)]
         predictions = []
+        n_active = len(active_users)
+        users_done = 0
 
         print(f">>> 开始并行预测，分片总数: {num_chunks}")
+        # spawn：流水线阶段在线程池中并发执行 (还有进度上报、租约续约线程)，
+        # 从多线程进程 fork 出的子进程可能卡在 fork 时被其他线程持有的锁上
         with ProcessPoolExecutor(
-                max_workers=4, initializer=_init_worker,
-                initargs=(behavior_summary, user_cat_affinity, all_items_prepped, feature_names)
+                max_workers=4, mp_context=multiprocessing.get_context("spawn"), initializer=_init_worker,
+                initargs=(user_cat_affinity, all_items, feature_names)
         ) as executor:
             futures = [executor.submit(_predict_user_batch_extreme_precision, chunk, top_n, threshold) for chunk in
                        user_chunks]
@@ -285,19 +624,27 @@ def train_recommendation_model(top_n=5, threshold=0.6):
             for i, f in enumerate(futures):
                 res = f.result()
                 if not res.empty:
-                    predictions.extend(res.to_dict(orient='records'))
+                    predictions.append(res)
 
-                # 计算并打印百分比进度
-                progress = (i + 1) / num_chunks * 100
-                print(f"📊 预测进度: {progress:.0f}% ({i + 1}/{num_chunks} 分片已完成)")
+                # 计算并打印百分比进度，同时上报进度事件 (预测阶段占 30% - 90%)
+                pct = (i + 1) / num_chunks * 100
+                print(f"📊 预测进度: {pct:.0f}% ({i + 1}/{num_chunks} 分片已完成)")
+                users_done += len(user_chunks[i])
+                progress.emit("rf", 30 + pct * 0.6, rows=users_done, total=n_active)
 
-        # 8. 写入结果
+        # 6. 写入结果
         if predictions:
-            res_df = pd.DataFrame(predictions)
-            with engine.begin() as conn:
+            # 写库前解码回字符串 ID
+            res_df = decode_ids(pd.concat(predictions, ignore_index=True), ids)
+            res_df['category'] = res_df['category'].astype(str)
+            with get_engine("bulk_write").begin() as conn:
                 conn.execute(text("DELETE FROM recommendation_results WHERE model_type = 'RF-Optimized'"))
                 res_df.to_sql('recommendation_results', con=conn, if_exists='append', index=False, method='multi',
                               chunksize=2000)
+            bump_data_version("recommendation_results:RF-Optimized")
+            if handoff is not None:
+                handoff.add_predictions('RF-Optimized', res_df)
+        progress.emit("rf", 100, rows=n_active, total=n_active, message="推荐结果写入完成")
 
         print(f"✅ 执行完毕。详细指标已通过全量预测更新。")
         return True, "Success"
@@ -307,11 +654,14 @@ def train_recommendation_model(top_n=5, threshold=0.6):
 
 
 def get_top_recommendations(user_id, top_n=5):
-    """查询接口"""
+    """查询接口：优先读取内存映射的服务文件，不可用时查询数据库"""
     try:
+        found = serving_store.lookup([str(user_id)], 'RF-Optimized', top_n)
+        if found is not None:
+            return [{k: rec[k] for k in ('item_id', 'category', 'score')} for rec in found.get(str(user_id), [])]
         db_query = text(
             "SELECT item_id, category, score FROM recommendation_results WHERE user_id = :uid AND model_type = 'RF-Optimized' ORDER BY `rank` ASC LIMIT :limit")
-        results = pd.read_sql(db_query, engine, params={"uid": str(user_id), "limit": top_n})
+        results = pd.read_sql(db_query, get_engine("serving", read=True), params={"uid": str(user_id), "limit": top_n})
         return results.to_dict(orient='records') if not results.empty else []
     except:
         return []
\ No newline at end of file
@@ -0,0 +1,116 @@
+"""
+推荐结果在线查询
+
+单用户与批量查询共用同一套逻辑：优先从内存映射的服务文件 (serving_store) 读取，
+服务文件不可用时按用户分片以一条带索引的 IN 查询取回推荐结果
+(命中 recommendation_results 的 idx_user_model 索引)。
+查不到结果的用户按所属分群取内存中的热门榜兜底 (popularity)，热门榜不可用时才查询数据库。
+"""
+import pandas as pd
+from sqlalchemy import bindparam, text
+
+from src.database import get_engine
+from src.recommendation.serving_store import serving_store
+from src.recommendation.popularity import popularity_fallback
+from src.metrics import counter
+
+RECOMMEND_LOOKUPS = counter(
+    "recommend_lookup_users_total", "推荐查询的用户数 (按数据来源)", labelnames=("model_type", "source"))
+RECOMMEND_FALLBACKS = counter(
+    "recommend_fallback_users_total", "走兜底推荐的用户数 (按兜底分群维度)", labelnames=("segment_type",))
+
+# 单条 IN 查询包含的用户数上限，避免 SQL 过长
+LOOKUP_CHUNK_SIZE = 1000
+
+_RESULTS_QUERY = text("""
+                      SELECT user_id, item_id, category, score, `rank`
+                      FROM recommendation_results
+                      WHERE model_type = :mtype
+                        AND user_id IN :uids
+                        AND `rank` <= :top_n
+                      ORDER BY user_id, `rank`
+                      """).bindparams(bindparam("uids", expanding=True))
+
+_FALLBACK_QUERY = text("""
+                       SELECT item_id, category, 0.5 as score, 0 as `rank`
+                       FROM dim_item LIMIT :top_n
+                       """)
+
+
+def fetch_recommendations(conn, user_ids, model_type='RF-Optimized', top_n=5):
+    """
+    批量读取推荐结果
+    :return: {user_id: [{item_id, category, score, rank}, ...]}，没有结果的用户不在字典中
+    """
+    found = {}
+    for start in range(0, len(user_ids), LOOKUP_CHUNK_SIZE):
+        chunk = user_ids[start:start + LOOKUP_CHUNK_SIZE]
+        rows = conn.execute(_RESULTS_QUERY, {"mtype": model_type, "uids": chunk, "top_n": top_n})
+        for row in rows:
+            item = dict(row._mapping)
+            found.setdefault(str(item.pop('user_id')), []).append(item)
+    return found
+
+
+def lookup_recommendations(user_ids, model_type='RF-Optimized', top_n=5):
+    """
+    查询一组用户的推荐结果：服务文件命中时不访问数据库
+    :return: {user_id: [...]}，没有结果的用户不在字典中
+    """
+    found = serving_store.lookup(user_ids, model_type, top_n)
+    source = "serving_store"
+    if found is None:
+        source = "database"
+        with get_engine("serving", read=True).connect() as conn:
+            found = fetch_recommendations(conn, user_ids, model_type, top_n)
+    RECOMMEND_LOOKUPS.inc(len(user_ids), model_type=model_type, source=source)
+    return found
+
+
+def load_model_results(model_type):
+    """读取某模型的全部推荐结果，用于生成服务文件"""
+    query = text("""
+                 SELECT user_id, item_id, category, score, `rank`
+                 FROM recommendation_results
+                 WHERE model_type = :mtype
+                 """)
+    return pd.read_sql(query, get_engine("analytics"), params={"mtype": model_type})
+
+
+def fetch_fallback(conn, top_n=5):
+    """最后一级兜底：热门榜尚未生成时返回默认商品列表"""
+    return [dict(row._mapping) for row in conn.execute(_FALLBACK_QUERY, {"top_n": top_n})]
+
+
+def get_fallback(user_id, top_n=5):
+    """
+    冷启动 / 低于阈值用户的兜底推荐
+    :return: (items, 使用的分群，如 cluster_label:1)
+    """
+    items, segment = popularity_fallback.get(user_id, top_n)
+    if items is None:
+        with get_engine("serving", read=True).connect() as conn:
+            items, segment = fetch_fallback(conn, top_n), "default"
+    RECOMMEND_FALLBACKS.inc(segment_type=segment.split(':', 1)[0])
+    return items, segment
+
+
+def iter_batch_recommendations(user_ids, model_type='RF-Optimized', top_n=5, chunk_size=LOOKUP_CHUNK_SIZE):
+    """
+    逐分片生成批量查询结果，供 NDJSON 流式响应使用：内存只与分片大小有关
+    :return: 生成器，每个元素为 {user_id, model_type, fallback, fallback_segment, items}
+    """
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        found = lookup_recommendations(chunk, model_type, top_n)
+        for user_id in chunk:
+            items, segment = found.get(user_id), None
+            if items is None:
+                items, segment = get_fallback(user_id, top_n)
+            yield {
+                "user_id": user_id,
+                "model_type": model_type,
+                "fallback": segment is not None,
+                "fallback_segment": segment,
+                "items": items,
+            }
@@ -0,0 +1,196 @@
+"""
+预计算推荐结果的内存映射服务存储
+
+推荐结果在两次流水线运行之间不会变化，因此流水线在写库之外额外产出一份紧凑的服务文件：
+- users.npy:        排序后的 user_id 字典 (定长字节串)，二分查找定位用户
+- items.npy / item_category.npy / categories.json: 商品字典与品类编码
+- <model>.offsets.npy: CSR 风格的偏移数组，第 i 个用户的结果位于 [offsets[i], offsets[i+1])
+- <model>.items.npy (int32 商品编码) / <model>.scores.npy (float32 得分)，已按名次排序
+
+每次发布写入新的版本目录，再原子替换 CURRENT 指针文件；API 进程以 mmap 方式打开，
+多个 worker 共享同一份操作系统页缓存。检测到指针变化后整体切换快照，
+正在处理的请求继续使用旧快照。服务文件缺失或不含某模型时，调用方回退到数据库查询。
+"""
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+SERVING_DIR = Path(os.getenv("SERVING_DIR", "runtime/serving"))
+
+# 保留的历史版本数 (含当前版本)，旧版本可能仍被其他 worker 映射，不立即删除
+KEEP_VERSIONS = 3
+
+# API 进程检查 CURRENT 指针是否变化的最小间隔 (秒)
+REFRESH_INTERVAL = 1.0
+
+_POINTER = "CURRENT"
+
+
+def _model_key(model_type):
+    return model_type.replace('/', '_')
+
+
+def _encode(values):
+    """字符串数组 -> 定长字节串数组 (可直接 mmap，且支持 searchsorted)"""
+    return np.asarray([str(v).encode('utf-8') for v in values], dtype=bytes)
+
+
+def build_serving_store(frames, root=SERVING_DIR):
+    """
+    构建并发布服务文件
+    :param frames: {model_type: DataFrame(user_id, item_id, category, score, rank)}
+    :return: 新版本目录
+    """
+    root = Path(root)
+    frames = {model: df.astype({'user_id': str, 'item_id': str}) for model, df in frames.items()}
+    all_results = pd.concat(frames.values(), ignore_index=True)
+
+    users = np.sort(all_results['user_id'].unique())
+    items = pd.Index(np.sort(all_results['item_id'].unique()))
+    item_category = all_results.drop_duplicates('item_id').set_index('item_id')['category'].reindex(items)
+    category_codes, categories = pd.factorize(item_category.fillna('Other'))
+
+    version = f"{time.strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    target = root / version
+    staging = root / f".{version}.tmp"
+    staging.mkdir(parents=True)
+
+    np.save(staging / "users.npy", _encode(users))
+    np.save(staging / "items.npy", _encode(items))
+    np.save(staging / "item_category.npy", category_codes.astype(np.int32))
+    (staging / "categories.json").write_text(json.dumps(list(categories), ensure_ascii=False), encoding='utf-8')
+
+    meta = {"version": version, "created_at": time.time(), "n_users": len(users), "models": {}}
+    user_index = pd.Index(users)
+    for model, df in frames.items():
+        df = df.sort_values(['user_id', 'rank'], kind='stable')
+        counts = np.bincount(user_index.get_indexer(df['user_id']), minlength=len(users))
+        offsets = np.zeros(len(users) + 1, dtype=np.int64)
+        np.cumsum(counts, out=offsets[1:])
+        key = _model_key(model)
+        np.save(staging / f"{key}.offsets.npy", offsets)
+        np.save(staging / f"{key}.items.npy", items.get_indexer(df['item_id']).astype(np.int32))
+        np.save(staging / f"{key}.scores.npy", df['score'].to_numpy(dtype=np.float32))
+        meta['models'][model] = {"key": key, "rows": len(df), "users": int((counts > 0).sum())}
+    (staging / "meta.json").write_text(json.dumps(meta, ensure_ascii=False), encoding='utf-8')
+
+    # 版本目录就绪后再原子切换指针，读取方不会看到不完整的版本
+    os.replace(staging, target)
+    pointer_tmp = root / f".{_POINTER}.tmp"
+    pointer_tmp.write_text(version, encoding='utf-8')
+    os.replace(pointer_tmp, root / _POINTER)
+
+    _cleanup(root, keep=version)
+    summary = ", ".join(f"{model} {info['rows']} 条" for model, info in meta['models'].items())
+    print(f"✅ 服务文件已发布: {version} ({summary})")
+    return target
+
+
+def _cleanup(root, keep):
+    versions = sorted(p for p in root.iterdir() if p.is_dir() and not p.name.startswith('.'))
+    for path in versions[:-KEEP_VERSIONS]:
+        if path.name != keep:
+            shutil.rmtree(path, ignore_errors=True)
+
+
+class _Snapshot:
+    """某一版本服务文件的只读映射"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.meta = json.loads((self.path / "meta.json").read_text(encoding='utf-8'))
+        self.users = np.load(self.path / "users.npy", mmap_mode='r')
+        self.items = np.load(self.path / "items.npy", mmap_mode='r')
+        self.item_category = np.load(self.path / "item_category.npy", mmap_mode='r')
+        self.categories = json.loads((self.path / "categories.json").read_text(encoding='utf-8'))
+        self.models = {}
+        for model, info in self.meta['models'].items():
+            key = info['key']
+            self.models[model] = (
+                np.load(self.path / f"{key}.offsets.npy", mmap_mode='r'),
+                np.load(self.path / f"{key}.items.npy", mmap_mode='r'),
+                np.load(self.path / f"{key}.scores.npy", mmap_mode='r'),
+            )
+
+    def lookup(self, user_ids, model_type, top_n):
+        """
+        :return: {user_id: [{item_id, category, score, rank}, ...]}，没有结果的用户不在字典中
+        """
+        offsets, item_codes, scores = self.models[model_type]
+        keys = _encode(user_ids)
+        pos = np.searchsorted(self.users, keys)
+        found = {}
+        for user_id, key, i in zip(user_ids, keys, pos):
+            if i >= len(self.users) or self.users[i] != key:
+                continue
+            start, end = int(offsets[i]), int(offsets[i + 1])
+            end = min(end, start + top_n)
+            if start == end:
+                continue
+            codes = item_codes[start:end]
+            found[user_id] = [
+                {
+                    "item_id": self.items[code].decode('utf-8'),
+                    "category": self.categories[self.item_category[code]],
+                    "score": float(score),
+                    "rank": rank,
+                }
+                for rank, (code, score) in enumerate(zip(codes, scores[start:end]), start=1)
+            ]
+        return found
+
+
+class ServingStore:
+    """API 进程内的服务文件读取方：按需检测新版本并原子切换快照"""
+
+    def __init__(self, root=SERVING_DIR):
+        self.root = Path(root)
+        self._snapshot = None
+        self._version = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def refresh(self, force=False):
+        now = time.monotonic()
+        if not force and now - self._checked_at < REFRESH_INTERVAL:
+            return self._snapshot
+        with self._lock:
+            self._checked_at = now
+            try:
+                version = (self.root / _POINTER).read_text(encoding='utf-8').strip()
+            except FileNotFoundError:
+                self._snapshot, self._version = None, None
+                return None
+            if version != self._version:
+                try:
+                    snapshot = _Snapshot(self.root / version)
+                except Exception as e:
+                    # 新版本不可读时保留旧快照继续服务
+                    print(f"⚠️ 服务文件 {version} 加载失败: {e}")
+                    return self._snapshot
+                self._snapshot, self._version = snapshot, version
+                print(f"📦 已切换到服务文件版本 {version}")
+        return self._snapshot
+
+    def lookup(self, user_ids, model_type='RF-Optimized', top_n=5):
+        """
+        :return: {user_id: [...]}；服务文件缺失或不含该模型时返回 None，调用方应回退到数据库
+        """
+        snapshot = self.refresh()
+        if snapshot is None or model_type not in snapshot.models:
+            return None
+        return snapshot.lookup(list(user_ids), model_type, top_n)
+
+    def status(self):
+        snapshot = self.refresh()
+        return snapshot.meta if snapshot is not None else None
+
+
+serving_store = ServingStore()
@@ -0,0 +1,129 @@
+"""
+看板统计接口的进程内响应缓存
+
+统计类接口的结果只会在流水线阶段写库后变化，因此缓存键为 (接口名, 参数)，
+并与全局数据版本号绑定：入库、画像、推荐、评估等写入方完成写库后调用 bump_data_version()，
+版本号变化后旧缓存自然失效，无需逐个清理。
+
+数据版本号保存在共享状态存储中 (src.state_store，写入方可能在任务工作进程或其他主机上)，
+读改写过程持有文件锁 / 数据库行锁。
+同一个键的并发未命中会被合并：只有一个请求执行查询，其余请求等待并复用其结果。
+"""
+import functools
+import threading
+
+from src.state_store import FileStateStore, get_state_store
+
+
+def _version_store(path):
+    # 指定 path 时使用独立的版本文件 (如压测脚本)，否则使用全局共享存储
+    return FileStateStore(version_path=path) if path else get_state_store()
+
+
+def get_data_version(path=None):
+    """当前全局数据版本号"""
+    return _version_store(path).get_data_version()
+
+
+def bump_data_version(reason, path=None):
+    """
+    写入方在数据落库后调用，使依赖旧数据的缓存全部失效
+    :param reason: 变更来源 (表名 / 阶段名)，便于排查
+    :return: 新的版本号
+    """
+    try:
+        return _version_store(path).bump_data_version(reason)
+    except Exception as e:
+        # 版本号写入失败不应让已完成的写库操作报错，但需要提示缓存可能陈旧
+        print(f"⚠️ 数据版本号更新失败 ({reason}): {e}")
+        return None
+
+
+class ResponseCache:
+    """按 (键, 数据版本) 缓存接口结果，并合并同一键的并发未命中"""
+
+    def __init__(self, version_path=None):
+        self.version_path = version_path
+        self._entries = {}
+        self._key_locks = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get_or_compute(self, key, compute, cacheable=lambda value: True):
+        """
+        命中则直接返回；未命中时同一个键只有一个线程执行 compute()
+        :param cacheable: 判断结果是否可缓存 (如查询出错的结果不缓存)
+        """
+        version = get_data_version(self.version_path)
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] == version:
+            self.hits += 1
+            return entry[1]
+
+        with self._key_lock(key):
+            # 等锁期间其他线程可能已经算好了同一版本的结果
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == version:
+                self.coalesced += 1
+                return entry[1]
+            self.misses += 1
+            value = compute()
+            if cacheable(value):
+                self._entries[key] = (version, value)
+            return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "entries": len(self._entries),
+            "data_version": get_data_version(self.version_path),
+        }
+
+
+response_cache = ResponseCache()
+
+
+def register_cache_metrics():
+    """把缓存命中统计注册到 /metrics (仅 API 进程需要)"""
+    from src.metrics import REGISTRY
+    REGISTRY.add_collector(_cache_collector)
+
+
+def _cache_collector():
+    from src.metrics import gauge_lines
+    stats = response_cache.stats()
+    lines = gauge_lines("response_cache_requests_total", "看板接口缓存请求数 (按结果)", [
+        ((("result", result),), stats[key])
+        for result, key in (("hit", "hits"), ("miss", "misses"), ("coalesced", "coalesced"))
+    ], kind="counter")
+    lines.extend(gauge_lines("response_cache_entries", "缓存条目数", [((), stats['entries'])]))
+    lines.extend(gauge_lines("data_version", "全局数据版本号", [((), stats['data_version'])]))
+    return lines
+
+
+def cached_response(name):
+    """
+    接口装饰器：以接口名和调用参数为键缓存返回值，仅缓存 status 为 success 的结果
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            key = (name, args, tuple(sorted(kwargs.items())))
+            return response_cache.get_or_compute(
+                key, lambda: func(*args, **kwargs),
+                cacheable=lambda value: isinstance(value, dict) and value.get("status") == "success",
+            )
+        return wrapper
+    return decorator
@@ -0,0 +1,204 @@
+"""
+入库与画像特征的 Spark 执行后端
+
+默认的 pandas 路径在单个进程内完成 CSV 解析、分表与按用户的特征聚合，只能使用一个 CPU 核心，
+且全量数据必须同时放进内存。设置 EXECUTION_BACKEND=spark (或单次任务传入 backend="spark") 后：
+- CSV 解析、dim_user / dim_item / fact_user_behavior 拆分由 Spark DataFrame 在 local[*] 模式下并行执行，
+  通过随仓库分发的 MySQL JDBC 驱动 (libs/mysql-connector-java-8.0.15.jar) 分区并发写入业务库
+- 画像阶段的多表关联与按用户聚合同样由 Spark 完成，只有聚合后的每用户一行特征转换为 pandas，
+  后续的 K-Means 聚类与标签计算与 pandas 路径共用同一份代码
+
+pyspark 与 Java 运行时为可选依赖，只在选择 spark 后端时加载；Spark 后端仅支持 MySQL 业务库。
+"""
+import atexit
+import os
+import threading
+from pathlib import Path
+
+from sqlalchemy import text
+
+from src.database import get_engine
+
+EXECUTION_BACKENDS = ("pandas", "spark")
+EXECUTION_BACKEND = os.getenv("EXECUTION_BACKEND", "pandas")
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+SPARK_MASTER = os.getenv("SPARK_MASTER", "local[*]")
+SPARK_JDBC_JAR = Path(os.getenv("SPARK_JDBC_JAR", BACKEND_DIR / "libs" / "mysql-connector-java-8.0.15.jar"))
+SPARK_JDBC_DRIVER = "com.mysql.cj.jdbc.Driver"
+SPARK_DRIVER_MEMORY = os.getenv("SPARK_DRIVER_MEMORY", "4g")
+SPARK_SHUFFLE_PARTITIONS = int(os.getenv("SPARK_SHUFFLE_PARTITIONS", str((os.cpu_count() or 1) * 2)))
+# JDBC 读写的并发分区数与每批写入行数
+SPARK_JDBC_PARTITIONS = int(os.getenv("SPARK_JDBC_PARTITIONS", str(os.cpu_count() or 1)))
+SPARK_JDBC_BATCH = int(os.getenv("SPARK_JDBC_BATCH", "10000"))
+
+# 画像特征中的数值列：MySQL DECIMAL 读入后为 Decimal 对象，统一转换为 double
+PERSONA_NUMERIC_FEATURES = ('total_spend', 'purchase_freq', 'register_days', 'fans_num', 'follow_num',
+                            'interaction_rate', 'purchase_intent', 'last_click_gap', 'item_discount')
+
+_spark = None
+_spark_lock = threading.Lock()
+
+
+def resolve_backend(name=None):
+    """单次任务指定的执行后端优先，否则使用 EXECUTION_BACKEND"""
+    name = name or EXECUTION_BACKEND
+    if name not in EXECUTION_BACKENDS:
+        raise ValueError(f"未知的执行后端: {name} (可选 {' / '.join(EXECUTION_BACKENDS)})")
+    return name
+
+
+def get_spark():
+    """
+    进程内共享的 SparkSession (首次调用时启动 JVM)
+    任务在独立的工作进程中执行，每个工作进程各自持有一个 local[*] 会话
+    """
+    global _spark
+    with _spark_lock:
+        if _spark is None:
+            try:
+                from pyspark.sql import SparkSession
+            except ImportError:
+                raise RuntimeError("未安装 pyspark，无法使用 Spark 执行后端 (pip install pyspark，并安装 Java 运行时)")
+            if not SPARK_JDBC_JAR.exists():
+                raise RuntimeError(f"未找到 MySQL JDBC 驱动: {SPARK_JDBC_JAR}")
+            _spark = (
+                SparkSession.builder
+                .appName("smart-ecomm-strategy")
+                .master(SPARK_MASTER)
+                .config("spark.jars", str(SPARK_JDBC_JAR))
+                .config("spark.driver.memory", SPARK_DRIVER_MEMORY)
+                .config("spark.sql.shuffle.partitions", str(SPARK_SHUFFLE_PARTITIONS))
+                .config("spark.sql.session.timeZone", "UTC")
+                .config("spark.ui.enabled", "false")
+                .getOrCreate()
+            )
+            _spark.sparkContext.setLogLevel("WARN")
+            atexit.register(stop_spark)
+            print(f"⚡ Spark 会话已启动 ({SPARK_MASTER}, 驱动内存 {SPARK_DRIVER_MEMORY})")
+        return _spark
+
+
+def stop_spark():
+    global _spark
+    with _spark_lock:
+        if _spark is not None:
+            _spark.stop()
+            _spark = None
+
+
+def jdbc_options():
+    """由业务库连接串生成 Spark JDBC 的 url 与连接属性"""
+    url = get_engine("bulk_write").url
+    if url.get_backend_name() != "mysql":
+        raise RuntimeError(f"Spark 执行后端仅支持 MySQL 业务库 (当前: {url.get_backend_name()})")
+    jdbc_url = (
+        f"jdbc:mysql://{url.host or 'localhost'}:{url.port or 3306}/{url.database}"
+        "?useUnicode=true&characterEncoding=UTF-8&useSSL=false&serverTimezone=UTC"
+        "&allowPublicKeyRetrieval=true&rewriteBatchedStatements=true"
+    )
+    properties = {"user": url.username or "", "password": url.password or "", "driver": SPARK_JDBC_DRIVER}
+    return jdbc_url, properties
+
+
+# ==========================================================
+# 入库：CSV 解析与分表
+# ==========================================================
+
+def read_source_csv(file_path):
+    """并行解析源 CSV；拆分出的三张表都要扫描源数据，因此缓存解析结果"""
+    spark = get_spark()
+    from pyspark import StorageLevel
+
+    return spark.read.csv(str(file_path), header=True, inferSchema=True).persist(StorageLevel.MEMORY_AND_DISK)
+
+
+def split_star_schema(source):
+    """
+    按与 pandas 路径相同的字段拆分维度表与事实表
+    核心字段缺失时返回 None
+    """
+    from src.preprocessing.data_loader import REQUIRED_COLS, USER_COLS, ITEM_COLS, BEHAVIOR_COLS
+
+    if not all(col in source.columns for col in REQUIRED_COLS):
+        return None
+    return {
+        "dim_user": source.select(*USER_COLS).dropDuplicates(['user_id']),
+        "dim_item": source.select(*ITEM_COLS).dropDuplicates(['item_id']),
+        "fact_user_behavior": source.select(*BEHAVIOR_COLS),
+    }
+
+
+def write_table(sdf, table):
+    """按分区并发追加写入业务库 (每个分区一个 JDBC 连接，分批提交)"""
+    jdbc_url, properties = jdbc_options()
+    (sdf.repartition(SPARK_JDBC_PARTITIONS)
+        .write
+        .option("batchsize", SPARK_JDBC_BATCH)
+        .option("numPartitions", SPARK_JDBC_PARTITIONS)
+        .jdbc(jdbc_url, table, mode="append", properties=properties))
+
+
+# ==========================================================
+# 画像特征：多表关联与按用户聚合
+# ==========================================================
+
+def read_table(table, partition_column=None):
+    """
+    经 JDBC 读取整表
+    :param partition_column: 数值型自增列，按其取值范围拆成多个分区并发读取
+    """
+    spark = get_spark()
+    jdbc_url, properties = jdbc_options()
+    if partition_column is None:
+        return spark.read.jdbc(jdbc_url, table, properties=properties)
+
+    with get_engine("analytics").connect() as conn:
+        low, high = conn.execute(text(f"SELECT MIN({partition_column}), MAX({partition_column}) FROM {table}")).one()
+    if low is None:
+        return spark.read.jdbc(jdbc_url, table, properties=properties)
+    return spark.read.jdbc(jdbc_url, table, column=partition_column, lowerBound=int(low),
+                           upperBound=int(high) + 1, numPartitions=SPARK_JDBC_PARTITIONS,
+                           properties=properties)
+
+
+def persona_features(dim_user, fact_behavior, dim_item):
+    """
+    与 cluster_model 中 pandas 聚合等价的 Spark 实现，返回每用户一行的 pandas DataFrame (按 user_id 排序)
+    偏好品类取交互次数最多的品类，次数相同时取品类名最小者
+    """
+    from pyspark.sql import Window, functions as F
+
+    joined = (
+        dim_user.join(fact_behavior.select('user_id', 'item_id', 'interaction_rate',
+                                           'purchase_intent', 'last_click_gap'), 'user_id')
+        .join(dim_item.select('item_id', 'category', F.col('discount_rate').alias('item_discount')), 'item_id')
+    )
+    features = joined.groupBy('user_id').agg(
+        F.first('total_spend').alias('total_spend'),
+        F.first('purchase_freq').alias('purchase_freq'),
+        F.first('register_days').alias('register_days'),
+        F.first('fans_num').alias('fans_num'),
+        F.first('follow_num').alias('follow_num'),
+        F.avg('interaction_rate').alias('interaction_rate'),
+        F.avg('purchase_intent').alias('purchase_intent'),
+        F.max('last_click_gap').alias('last_click_gap'),
+        F.avg('item_discount').alias('item_discount'),
+    )
+    rank = Window.partitionBy('user_id').orderBy(F.col('cnt').desc(), F.col('category'))
+    preferred = (
+        joined.groupBy('user_id', 'category').agg(F.count(F.lit(1)).alias('cnt'))
+        .withColumn('rn', F.row_number().over(rank))
+        .where(F.col('rn') == 1)
+        .select('user_id', F.col('category').alias('preferred_category'))
+    )
+    result = features.join(preferred, 'user_id').select(
+        'user_id', *[F.col(c).cast("double").alias(c) for c in PERSONA_NUMERIC_FEATURES], 'preferred_category')
+    return result.orderBy('user_id').toPandas()
+
+
+def load_persona_features():
+    """从业务库读取星型模型并计算画像特征 (事实表按 behavior_id 分区并发读取)"""
+    return persona_features(read_table("dim_user"),
+                            read_table("fact_user_behavior", partition_column="behavior_id"),
+                            read_table("dim_item"))
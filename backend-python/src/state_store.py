@@ -0,0 +1,444 @@
+"""
+跨进程 / 跨主机共享的运行状态
+
+以下状态由 API 进程 (可能是多个 uvicorn worker 或多台主机) 与任务工作进程共同读写，不能保存在进程内：
+- 任务记录、任务事件流与取消请求 (src.jobs)
+- 命名锁：流水线 single-flight，同一时刻全局只允许一个任务运行
+- 全局数据版本号 (src.response_cache)：写库后递增，各进程据此判断缓存是否过期
+
+两种实现，通过环境变量 STATE_BACKEND 选择：
+- file (默认)：JSON 文件 + fcntl 文件锁，适用于单机多 worker (多台主机需挂载同一共享目录)
+- db：存放在业务库的 sys_* 表中，读改写在事务内以 SELECT ... FOR UPDATE 行锁串行化，适用于多主机部署
+
+db 模式只把上述状态放进数据库。流水线清单、服务文件、特征库、ID 字典、随机森林模型、上传文件等
+仍是本地文件 (见 SHARED_RUNTIME_PATHS)，任务可能在任意主机上运行，而 API 进程在另一台主机上读取结果，
+因此多主机部署必须把这些路径挂载到同一个共享卷 (NFS 等)。启用 db 模式时需设置 STATE_SHARED_RUNTIME=1
+声明已完成挂载，否则启动时报错，避免各主机各自维护一份互不可见的本地状态。
+
+命名锁带租约 (ttl)：持有方需定期续约，进程崩溃后租约到期即可被他人获取；
+获取时还可传入 is_stale 回调 (如“持有锁的任务已结束”)，提前回收失效的锁。
+"""
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+STATE_BACKEND = os.getenv("STATE_BACKEND", "file")
+JOBS_DIR = Path(os.getenv("JOBS_DIR", "runtime/jobs"))
+DATA_VERSION_PATH = Path(os.getenv("DATA_VERSION_PATH", "runtime/data_version.json"))
+
+# db 模式下必须挂载到共享卷的本地路径：环境变量 -> 默认值
+SHARED_RUNTIME_PATHS = {
+    "JOBS_DIR": "runtime/jobs",
+    "PIPELINE_MANIFEST": "runtime/pipeline/manifest.json",
+    "SERVING_DIR": "runtime/serving",
+    "FEATURE_STORE_DIR": "runtime/features",
+    "ANALYTICS_DIR": "runtime/analytics",
+    "ID_DICT_PATH": "runtime/ids/id_dictionary.npz",
+    "STAGE_METRICS_PATH": "runtime/metrics/stages.json",
+    "RF_MODEL_DIR": "libs",
+    "UPLOAD_DIR": "temp_uploads",
+}
+
+# db 模式下数据版本号的本地缓存时间 (秒)：看板请求频繁读取版本号，避免每个请求都查库
+VERSION_CACHE_SECONDS = float(os.getenv("STATE_VERSION_CACHE_SECONDS", "0.5"))
+
+
+@contextmanager
+def _flock(path):
+    """持有某个锁文件的排他锁"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with open(path, 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_json(path, default):
+    try:
+        return json.loads(path.read_text(encoding='utf-8'))
+    except (FileNotFoundError, json.JSONDecodeError):
+        return default
+
+
+def _write_json(path, data):
+    # 先写临时文件再原子替换，读取方不会看到写了一半的 JSON；
+    # 临时文件名唯一，多个进程 / 线程同时写同一路径时不会互相覆盖临时文件
+    with tempfile.NamedTemporaryFile('w', encoding='utf-8', dir=path.parent, prefix=f".{path.name}.",
+                                     suffix='.tmp', delete=False) as f:
+        tmp = Path(f.name)
+    try:
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding='utf-8')
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+
+def _lock_available(row, now, is_stale):
+    if row is None or not row.get('owner'):
+        return True
+    if row.get('expires_at') is not None and row['expires_at'] < now:
+        return True
+    return bool(is_stale and is_stale(row['owner']))
+
+
+class FileStateStore:
+    """单机共享状态：每个任务一个 JSON 文件，事件按行追加，锁与版本号为带文件锁的 JSON 文件"""
+
+    backend = "file"
+
+    def __init__(self, root=JOBS_DIR, version_path=DATA_VERSION_PATH):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.version_path = Path(version_path)
+
+    def config(self):
+        """重建同一存储所需的参数 (传给任务工作进程)"""
+        return {"backend": self.backend, "root": str(self.root), "version_path": str(self.version_path)}
+
+    # ---------------- 任务 ----------------
+
+    def _path(self, job_id):
+        return self.root / f"{job_id}.json"
+
+    def save(self, job):
+        _write_json(self._path(job['id']), job)
+
+    def load(self, job_id):
+        return _read_json(self._path(job_id), None)
+
+    def list(self, limit=20):
+        paths = sorted(self.root.glob('*.json'), key=lambda p: p.stat().st_mtime, reverse=True)
+        jobs = [self.load(p.stem) for p in paths[:limit]]
+        return [job for job in jobs if job]
+
+    def append_event(self, job_id, event):
+        # 单行 JSON 追加写入，读取方按字节偏移增量读取
+        line = json.dumps(event, ensure_ascii=False) + "\n"
+        with open(self.root / f"{job_id}.events.jsonl", 'a', encoding='utf-8') as f:
+            f.write(line)
+
+    def read_events(self, job_id, offset=0):
+        """
+        从字节偏移 offset 开始读取新增事件
+        :return: (事件列表, 新的偏移量)
+        """
+        path = self.root / f"{job_id}.events.jsonl"
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+        # 只消费完整的行，写了一半的行留到下次读取
+        complete = data[:data.rfind(b"\n") + 1]
+        events = [json.loads(line) for line in complete.decode('utf-8').splitlines() if line]
+        return events, offset + len(complete)
+
+    def request_cancel(self, job_id):
+        (self.root / f"{job_id}.cancel").touch()
+
+    def cancel_requested(self, job_id):
+        return (self.root / f"{job_id}.cancel").exists()
+
+    # ---------------- 命名锁 ----------------
+
+    def _lock_path(self, name):
+        return self.root / "locks" / f"{name}.json"
+
+    def acquire_lock(self, name, owner, ttl, is_stale=None):
+        """
+        :param is_stale: is_stale(owner) 返回 True 时视为锁已失效
+        :return: (是否获取成功, 当前持有者)
+        """
+        path = self._lock_path(name)
+        with _flock(path.with_suffix('.lock')):
+            now = time.time()
+            row = _read_json(path, None)
+            if not _lock_available(row, now, is_stale):
+                return False, row['owner']
+            _write_json(path, {"owner": owner, "expires_at": now + ttl, "acquired_at": now})
+            return True, owner
+
+    def refresh_lock(self, name, owner, ttl):
+        """续约；锁已被他人获取时返回 False"""
+        path = self._lock_path(name)
+        with _flock(path.with_suffix('.lock')):
+            row = _read_json(path, None)
+            if row is None or row.get('owner') != owner:
+                return False
+            row['expires_at'] = time.time() + ttl
+            _write_json(path, row)
+            return True
+
+    def release_lock(self, name, owner):
+        path = self._lock_path(name)
+        with _flock(path.with_suffix('.lock')):
+            row = _read_json(path, None)
+            if row is not None and row.get('owner') == owner:
+                path.unlink(missing_ok=True)
+
+    def lock_holder(self, name):
+        row = _read_json(self._lock_path(name), None)
+        if row is None or (row.get('expires_at') or 0) < time.time():
+            return None
+        return row.get('owner')
+
+    # ---------------- 数据版本号 ----------------
+
+    def get_data_version(self):
+        return _read_json(self.version_path, {"version": 0})['version']
+
+    def bump_data_version(self, reason):
+        with _flock(self.version_path.with_suffix('.lock')):
+            data = _read_json(self.version_path, {"version": 0, "updated_at": None, "reason": None})
+            data.update(version=data['version'] + 1, updated_at=time.time(), reason=reason)
+            _write_json(self.version_path, data)
+        return data['version']
+
+
+class DBStateStore:
+    """多主机共享状态：存放在业务库的 sys_job / sys_job_event / sys_lock / sys_data_version 表中"""
+
+    backend = "db"
+
+    def __init__(self, engine=None):
+        if engine is None:
+            # 锁与版本号必须读写主库，不能路由到只读副本
+            from src.database import get_engine
+            engine = get_engine("serving")
+        self.engine = engine
+        self._tables = None
+        self._tables_lock = threading.Lock()
+        self._version_cache = (None, 0.0)
+
+    def config(self):
+        return {"backend": self.backend}
+
+    @property
+    def tables(self):
+        """表结构与 sql/Smart_EComm_Strategy.sql 一致；首次使用时按需建表 (已存在则跳过)"""
+        if self._tables is None:
+            with self._tables_lock:
+                if self._tables is None:
+                    self._tables = self._define_tables()
+        return self._tables
+
+    def _define_tables(self):
+        from sqlalchemy import (MetaData, Table, Column, String, Integer, BigInteger, Float, Text, Boolean,
+                                Index)
+        from sqlalchemy.dialects.mysql import MEDIUMTEXT
+        metadata = MetaData()
+        tables = {
+            "job": Table(
+                "sys_job", metadata,
+                Column("job_id", String(32), primary_key=True),
+                Column("kind", String(30), nullable=False),
+                Column("state", String(20), nullable=False),
+                Column("payload", Text().with_variant(MEDIUMTEXT, "mysql"), nullable=False),
+                Column("cancel_requested", Boolean, nullable=False, default=False),
+                Column("created_at", Float, nullable=False),
+                Column("updated_at", Float, nullable=False),
+                Index("idx_job_created", "created_at"),
+            ),
+            "event": Table(
+                "sys_job_event", metadata,
+                Column("id", BigInteger().with_variant(Integer, "sqlite"), primary_key=True, autoincrement=True),
+                Column("job_id", String(32), nullable=False),
+                Column("payload", Text, nullable=False),
+                Index("idx_event_job", "job_id", "id"),
+            ),
+            "lock": Table(
+                "sys_lock", metadata,
+                Column("name", String(50), primary_key=True),
+                Column("owner", String(64)),
+                Column("expires_at", Float),
+                Column("acquired_at", Float),
+            ),
+            "version": Table(
+                "sys_data_version", metadata,
+                Column("id", Integer, primary_key=True, autoincrement=False),
+                Column("version", BigInteger, nullable=False),
+                Column("reason", String(100)),
+                Column("updated_at", Float),
+            ),
+        }
+        metadata.create_all(self.engine, checkfirst=True)
+        return tables
+
+    # ---------------- 任务 ----------------
+
+    def save(self, job):
+        table = self.tables['job']
+        values = {"kind": job['kind'], "state": job['state'],
+                  "payload": json.dumps(job, ensure_ascii=False), "updated_at": time.time()}
+        with self.engine.begin() as conn:
+            # 只更新任务内容，不覆盖其他进程写入的取消标记
+            updated = conn.execute(table.update().where(table.c.job_id == job['id']).values(**values))
+            if updated.rowcount == 0:
+                conn.execute(table.insert().values(job_id=job['id'], cancel_requested=False,
+                                                   created_at=job.get('created_at', time.time()), **values))
+
+    def load(self, job_id):
+        table = self.tables['job']
+        with self.engine.connect() as conn:
+            payload = conn.execute(table.select().with_only_columns(table.c.payload)
+                                   .where(table.c.job_id == job_id)).scalar()
+        return json.loads(payload) if payload else None
+
+    def list(self, limit=20):
+        table = self.tables['job']
+        with self.engine.connect() as conn:
+            rows = conn.execute(table.select().with_only_columns(table.c.payload)
+                                .order_by(table.c.created_at.desc()).limit(limit)).scalars().all()
+        return [json.loads(payload) for payload in rows]
+
+    def append_event(self, job_id, event):
+        table = self.tables['event']
+        with self.engine.begin() as conn:
+            conn.execute(table.insert().values(job_id=job_id, payload=json.dumps(event, ensure_ascii=False)))
+
+    def read_events(self, job_id, offset=0):
+        """
+        读取自增 id 大于 offset 的事件
+        :return: (事件列表, 新的偏移量 = 最后一条事件的 id)
+        """
+        table = self.tables['event']
+        with self.engine.connect() as conn:
+            rows = conn.execute(table.select().where(table.c.job_id == job_id, table.c.id > offset)
+                                .order_by(table.c.id)).all()
+        if not rows:
+            return [], offset
+        return [json.loads(row.payload) for row in rows], rows[-1].id
+
+    def request_cancel(self, job_id):
+        table = self.tables['job']
+        with self.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.job_id == job_id).values(cancel_requested=True))
+
+    def cancel_requested(self, job_id):
+        table = self.tables['job']
+        with self.engine.connect() as conn:
+            return bool(conn.execute(table.select().with_only_columns(table.c.cancel_requested)
+                                     .where(table.c.job_id == job_id)).scalar())
+
+    # ---------------- 命名锁 ----------------
+
+    def acquire_lock(self, name, owner, ttl, is_stale=None):
+        from sqlalchemy.exc import IntegrityError
+
+        table = self.tables['lock']
+        try:
+            with self.engine.begin() as conn:
+                row = conn.execute(table.select().where(table.c.name == name).with_for_update()).first()
+                now = time.time()
+                current = dict(row._mapping) if row is not None else None
+                if not _lock_available(current, now, is_stale):
+                    return False, current['owner']
+                values = {"owner": owner, "expires_at": now + ttl, "acquired_at": now}
+                if row is None:
+                    conn.execute(table.insert().values(name=name, **values))
+                else:
+                    conn.execute(table.update().where(table.c.name == name).values(**values))
+                return True, owner
+        except IntegrityError:
+            # 锁记录尚不存在时两个进程同时插入：主键冲突的一方获取失败
+            return False, self.lock_holder(name)
+
+    def refresh_lock(self, name, owner, ttl):
+        table = self.tables['lock']
+        with self.engine.begin() as conn:
+            updated = conn.execute(table.update().where(table.c.name == name, table.c.owner == owner)
+                                   .values(expires_at=time.time() + ttl))
+        return updated.rowcount > 0
+
+    def release_lock(self, name, owner):
+        table = self.tables['lock']
+        with self.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.name == name, table.c.owner == owner)
+                         .values(owner=None, expires_at=None))
+
+    def lock_holder(self, name):
+        table = self.tables['lock']
+        with self.engine.connect() as conn:
+            row = conn.execute(table.select().where(table.c.name == name)).first()
+        if row is None or row.owner is None or (row.expires_at or 0) < time.time():
+            return None
+        return row.owner
+
+    # ---------------- 数据版本号 ----------------
+
+    def get_data_version(self):
+        version, checked_at = self._version_cache
+        now = time.monotonic()
+        if version is not None and now - checked_at < VERSION_CACHE_SECONDS:
+            return version
+        table = self.tables['version']
+        with self.engine.connect() as conn:
+            version = conn.execute(table.select().with_only_columns(table.c.version)
+                                   .where(table.c.id == 1)).scalar() or 0
+        self._version_cache = (version, now)
+        return version
+
+    def bump_data_version(self, reason):
+        from sqlalchemy.exc import IntegrityError
+
+        table = self.tables['version']
+        for attempt in range(2):
+            try:
+                with self.engine.begin() as conn:
+                    current = conn.execute(table.select().with_only_columns(table.c.version)
+                                           .where(table.c.id == 1).with_for_update()).scalar()
+                    values = {"reason": str(reason)[:100], "updated_at": time.time()}
+                    if current is None:
+                        version = 1
+                        conn.execute(table.insert().values(id=1, version=version, **values))
+                    else:
+                        version = current + 1
+                        conn.execute(table.update().where(table.c.id == 1).values(version=version, **values))
+                break
+            except IntegrityError:
+                # 首次写入时并发插入，重试一次走更新分支；重试仍冲突时如实抛出
+                if attempt:
+                    raise
+        # 本进程写入后立即可见，不等本地缓存过期
+        self._version_cache = (version, time.monotonic())
+        return version
+
+
+def _require_shared_runtime():
+    if os.getenv("STATE_SHARED_RUNTIME") == "1":
+        return
+    paths = ", ".join(f"{name}={os.getenv(name, default)}" for name, default in SHARED_RUNTIME_PATHS.items())
+    raise ValueError("STATE_BACKEND=db 用于多主机部署，但流水线清单、服务文件、特征库、模型等仍是本地文件；"
+                     f"请把以下路径挂载到所有主机共享的卷后设置 STATE_SHARED_RUNTIME=1: {paths}")
+
+
+def make_state_store(backend=STATE_BACKEND, **kwargs):
+    if backend == "db":
+        _require_shared_runtime()
+        return DBStateStore(**kwargs)
+    if backend == "file":
+        return FileStateStore(**kwargs)
+    raise ValueError(f"未知的 STATE_BACKEND: {backend} (可选 file / db)")
+
+
+_default_store = None
+_default_lock = threading.Lock()
+
+
+def get_state_store():
+    """按 STATE_BACKEND 创建的进程内单例"""
+    global _default_store
+    if _default_store is None:
+        with _default_lock:
+            if _default_store is None:
+                _default_store = make_state_store()
+    return _default_store
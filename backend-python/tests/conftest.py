@@ -0,0 +1,31 @@
+"""
+测试环境：业务库使用临时 SQLite 替身库，运行时文件 (清单、任务、服务文件、特征库、模型等) 全部写入临时目录
+
+各模块在导入时读取路径类环境变量，因此必须在导入 src 之前设置。
+"""
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parents[1]
+SAMPLE_CSV = BACKEND_DIR.parent / "data" / "raw" / "test.csv"
+
+WORKDIR = Path(tempfile.mkdtemp(prefix="backend-tests-"))
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{WORKDIR / 'test.db'}",
+    "STATE_BACKEND": "file",
+    "ANALYTICS_BACKEND": "sql",
+    "JOBS_DIR": str(WORKDIR / "jobs"),
+    "SERVING_DIR": str(WORKDIR / "serving"),
+    "ANALYTICS_DIR": str(WORKDIR / "analytics"),
+    "PROFILE_DIR": str(WORKDIR / "profiles"),
+    "FEATURE_STORE_DIR": str(WORKDIR / "features"),
+    "RF_MODEL_DIR": str(WORKDIR / "models"),
+    "PIPELINE_MANIFEST": str(WORKDIR / "pipeline" / "manifest.json"),
+    "DATA_VERSION_PATH": str(WORKDIR / "data_version.json"),
+    "STAGE_METRICS_PATH": str(WORKDIR / "metrics" / "stages.json"),
+    "ID_DICT_PATH": str(WORKDIR / "ids" / "id_dictionary.npz"),
+    "UPLOAD_DIR": str(WORKDIR / "uploads"),
+})
+sys.path.insert(0, str(BACKEND_DIR))
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.database import create_schema, get_engine
+from src.id_dictionary import build_id_dictionary, encode_ids, get_id_dictionary
+from src.recommendation.evaluate import compute_ranking_metrics, evaluate_model_streaming, _load_ground_truth
+
+METRICS = ['precision_val', 'recall_val', 'f1_val', 'ndcg_val', 'map_val', 'hit_rate', 'coverage']
+
+
+def test_compute_ranking_metrics_by_hand():
+    truth = pd.DataFrame({'user_id': ['a', 'a', 'b'], 'item_id': ['i1', 'i2', 'i4']})
+    pred = pd.DataFrame({'user_id': ['a', 'a', 'b', 'b'], 'item_id': ['i1', 'i3', 'i5', 'i4'], 'rank': [1, 2, 1, 2]})
+
+    overall, segments = compute_ranking_metrics(truth, pred, n_catalog_items=10)
+
+    # a: 命中第 1 位 (真值 2 个)；b: 命中第 2 位 (真值 1 个)
+    ndcg_a = 1 / (1 + 1 / np.log2(3))
+    ndcg_b = 1 / np.log2(3)
+    assert overall['k_value'] == 2
+    assert overall['precision_val'] == pytest.approx(0.5)
+    assert overall['recall_val'] == pytest.approx(0.75)
+    assert overall['ndcg_val'] == pytest.approx((ndcg_a + ndcg_b) / 2)
+    assert overall['map_val'] == pytest.approx(0.5)
+    assert overall['hit_rate'] == pytest.approx(1.0)
+    assert overall['coverage'] == pytest.approx(0.4)
+    assert segments is None
+
+
+@pytest.fixture
+def evaluation_db():
+    """随机生成的真值 / 推荐结果 / 画像，写入替身库供流式评估读取"""
+    rng = np.random.default_rng(7)
+    users = [f"u{i:03d}" for i in range(60)]
+    items = [f"i{i:03d}" for i in range(40)]
+    fact = pd.DataFrame({'user_id': rng.choice(users, 400), 'item_id': rng.choice(items, 400)})
+    fact['label'] = rng.integers(0, 2, len(fact))
+    fact['purchase_intent'] = rng.integers(0, 2, len(fact))
+    # 部分用户没有画像 (分群记为 -1)
+    persona = pd.DataFrame({'user_id': users[:45], 'cluster_label': rng.integers(0, 3, 45)})
+    results = pd.DataFrame({'user_id': np.repeat(users[5:], 5), 'item_id': rng.choice(items, 5 * 55),
+                            'model_type': 'RF-Optimized', 'rank': np.tile(np.arange(1, 6), 55)})
+
+    engine = get_engine("bulk_write")
+    create_schema(engine)
+    with engine.begin() as conn:
+        fact.to_sql('fact_user_behavior', conn, if_exists='append', index=False)
+        persona.to_sql('usr_persona', conn, if_exists='append', index=False)
+        results.to_sql('recommendation_results', conn, if_exists='append', index=False)
+    build_id_dictionary(pd.Series(users), pd.Series(items))
+    return persona, results, len(items)
+
+
+def test_streaming_matches_batch(evaluation_db):
+    persona, results, n_items = evaluation_db
+    ids = get_id_dictionary()
+    with get_engine("analytics").connect() as conn:
+        truth = encode_ids(_load_ground_truth(conn), ids)
+    segments = encode_ids(persona.copy(), ids, columns=('user_id',)).set_index('user_id')['cluster_label']
+    batch, batch_segments = compute_ranking_metrics(truth, encode_ids(results.copy(), ids),
+                                                    user_segments=segments, n_catalog_items=n_items)
+
+    # 分片远小于用户数，覆盖多次 flush
+    streaming, streaming_segments = evaluate_model_streaming('RF-Optimized', n_items, chunk_users=7, yield_per=11)
+
+    for key in METRICS:
+        assert streaming[key] == pytest.approx(batch[key]), key
+    assert streaming['user_count'] == batch['user_count']
+    assert streaming['hit_user_count'] == batch['hit_user_count']
+    pd.testing.assert_frame_equal(streaming_segments.reset_index(drop=True), batch_segments.reset_index(drop=True),
+                                  check_dtype=False)
@@ -0,0 +1,121 @@
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import feature_store
+from src.feature_store import _user_rows, build_feature_store, get_feature_store, load_features
+
+
+def test_user_rows_selects_each_users_range(tmp_path):
+    np.save(tmp_path / "user_id.npy", np.array([1, 1, 2, 4, 4, 4, 7], dtype=np.int32))
+
+    assert _user_rows(tmp_path, [4, 1]).tolist() == [0, 1, 3, 4, 5]
+    # 不存在的用户不占行，重复的用户只取一次
+    assert _user_rows(tmp_path, [3, 7, 7, 9]).tolist() == [6]
+    assert _user_rows(tmp_path, []).tolist() == []
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    """
+    特征库写入临时目录，特征计算替换为按构建序号生成的小表：
+    第 n 次构建的 user_items 有 n 行、generation 列全部为 n，便于判断读到的是哪个版本
+    """
+    source = SimpleNamespace(fingerprint="v1")
+    builds = []
+
+    def compute_features(ids, previous_categories=None):
+        builds.append(ids.fingerprint)
+        n = len(builds)
+        user_items = pd.DataFrame({"user_id": np.arange(n, dtype=np.int32),
+                                   "generation": np.full(n, n, dtype=np.int32)})
+        return {"user_items": user_items}, ["c"]
+
+    monkeypatch.setattr(feature_store, "FEATURE_STORE_DIR", tmp_path)
+    monkeypatch.setattr(feature_store, "get_id_dictionary", lambda: source)
+    monkeypatch.setattr(feature_store, "compute_features", compute_features)
+    return SimpleNamespace(root=tmp_path, source=source, builds=builds)
+
+
+def _versions(root):
+    return sorted(p.name for p in root.iterdir() if p.is_dir())
+
+
+def test_build_swaps_pointer_and_keeps_recent_versions(store):
+    first = build_feature_store()
+    assert (store.root / "CURRENT").read_text(encoding='utf-8') == first["version"]
+    assert load_features("user_items")["generation"].tolist() == [1]
+
+    second = build_feature_store()
+    assert (store.root / "CURRENT").read_text(encoding='utf-8') == second["version"]
+    assert load_features("user_items")["generation"].tolist() == [2, 2]
+    # 上一版本保留给仍在读取的进程
+    assert _versions(store.root) == [first["version"], second["version"]]
+
+    third = build_feature_store()
+    assert _versions(store.root) == [second["version"], third["version"]]
+    # 没有残留的临时目录 / 指针文件
+    assert sorted(p.name for p in store.root.iterdir()) == sorted(["CURRENT"] + _versions(store.root))
+
+
+def test_stale_store_is_rebuilt_after_data_change(store):
+    meta = get_feature_store()
+    assert store.builds == ["v1"]
+    # 源数据未变化时直接使用当前版本
+    assert get_feature_store() == meta
+    assert store.builds == ["v1"]
+
+    # 重新入库后指纹变化，下一次使用时重建
+    store.source.fingerprint = "v2"
+    rebuilt = get_feature_store()
+    assert store.builds == ["v1", "v2"]
+    assert rebuilt["source"] == "v2" and rebuilt["version"] != meta["version"]
+    assert load_features("user_items")["generation"].tolist() == [2, 2]
+
+
+def test_read_retries_when_version_is_cleaned_up(store, monkeypatch):
+    stale = build_feature_store()
+    build_feature_store()
+    build_feature_store()
+    assert stale["version"] not in _versions(store.root)
+
+    # 读取方拿到旧版本元数据后，该版本被后续构建清理
+    metas = iter([stale])
+    monkeypatch.setattr(feature_store, "get_feature_store", lambda: next(metas, feature_store.current_version()))
+    assert load_features("user_items")["generation"].tolist() == [3, 3, 3]
+
+
+def test_readers_during_rebuild_see_old_or_new_snapshot(store):
+    build_feature_store()
+    stop = threading.Event()
+    seen, errors = set(), []
+
+    def reader():
+        while not stop.is_set():
+            try:
+                df = load_features("user_items")
+                generation = int(df["generation"].iloc[0])
+                # 同一次读取的所有列、所有行都来自同一个版本
+                assert len(df) == generation and (df["generation"] == generation).all()
+                assert df["user_id"].tolist() == list(range(generation))
+                seen.add(generation)
+            except Exception as e:
+                errors.append(e)
+                return
+
+    threads = [threading.Thread(target=reader) for _ in range(4)]
+    for t in threads:
+        t.start()
+    try:
+        for _ in range(20):
+            build_feature_store()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+
+    assert errors == []
+    assert len(seen) > 1
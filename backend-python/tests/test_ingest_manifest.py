@@ -0,0 +1,60 @@
+import pytest
+import pandas as pd
+
+from tests.conftest import SAMPLE_CSV
+
+from src.database import create_schema, get_engine
+from src.jobs import JobManager
+from src.pipeline import PIPELINE_STAGES
+from src.pipeline_manifest import PipelineManifest, SOURCE_DATASETS
+
+
+@pytest.fixture(scope="module")
+def jobs():
+    create_schema(get_engine("bulk_write"))
+    return JobManager()
+
+
+def _run(jobs, kind, params):
+    job, active = jobs.run_inline(kind, params, stages=PIPELINE_STAGES[kind])
+    assert active is None
+    assert job['state'] == 'success', job.get('error')
+    return PipelineManifest().snapshot()
+
+
+def _persona_rows():
+    return int(pd.read_sql("SELECT COUNT(*) AS n FROM usr_persona", get_engine()).n[0])
+
+
+def test_reset_sources_drops_derived_entries(tmp_path):
+    manifest = PipelineManifest(tmp_path / "manifest.json")
+    manifest.record_datasets({"dim_user": "a", "usr_persona": "b", "agg:usr_persona": "c"})
+    manifest.record_stage("persona", "b", ("usr_persona",), 1.0)
+
+    manifest.reset_sources({"dim_user": "a2"})
+
+    data = manifest.snapshot()
+    assert data['datasets'] == {"dim_user": "a2"}
+    assert data['stages'] == {}
+
+
+@pytest.mark.skipif(not SAMPLE_CSV.exists(), reason="缺少样例数据 data/raw/test.csv")
+def test_reingest_same_file_reruns_persona(jobs):
+    _run(jobs, "ingest", {"file_path": str(SAMPLE_CSV)})
+    manifest = _run(jobs, "persona", {})
+    assert manifest['runs'][-1]['stages']['persona']['skipped'] is False
+    assert _persona_rows() > 0
+
+    # 同一文件再次入库：源指纹不变，但画像表已被清空
+    manifest = _run(jobs, "ingest", {"file_path": str(SAMPLE_CSV)})
+    assert set(manifest['datasets']) == set(SOURCE_DATASETS)
+    assert manifest['stages'] == {}
+    assert _persona_rows() == 0
+
+    manifest = _run(jobs, "persona", {})
+    assert manifest['runs'][-1]['stages']['persona']['skipped'] is False
+    assert _persona_rows() > 0
+
+    # 没有新的入库时，第二次运行仍按指纹跳过
+    manifest = _run(jobs, "persona", {})
+    assert manifest['runs'][-1]['stages']['persona']['skipped'] is True
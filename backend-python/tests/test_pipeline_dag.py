@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+
+import pytest
+
+from src import pipeline
+from src.pipeline import PIPELINE_STAGES, Stage, _dependencies, run_dag
+from src.pipeline_manifest import PipelineManifest
+
+
+class _Context:
+    """run_dag 只用到的任务上下文接口"""
+
+    job_id = "test"
+
+    def __init__(self):
+        self.ran, self.skipped = [], []
+
+    @contextmanager
+    def stage(self, name):
+        self.ran.append(name)
+        yield
+
+    def skip_stage(self, name, reason):
+        self.skipped.append(name)
+
+
+def test_rebuild_dependencies():
+    deps = _dependencies(PIPELINE_STAGES["rebuild"])
+    assert deps["features"] == set()
+    assert deps["persona"] == {"features"}
+    assert deps["user_cf"] == {"features"}
+    assert deps["popularity"] == {"persona"}
+    assert deps["rf"] == {"features", "persona"}
+    assert deps["evaluate"] == {"persona", "user_cf", "rf"}
+    assert deps["serving"] == {"user_cf", "rf"}
+
+
+def test_dependencies_limited_to_selected_stages():
+    # 独立推荐任务不含 persona：画像表视为已有数据，不构成依赖
+    deps = _dependencies(PIPELINE_STAGES["recommend"])
+    assert deps == {"features": set(), "rf": {"features"}, "aggregates": {"rf"}, "serving": {"rf"}}
+
+
+@pytest.fixture
+def dag(tmp_path, monkeypatch):
+    """source -> a -> b，c 只依赖 source；source -> broken (执行失败) -> after_broken"""
+    manifest_path = tmp_path / "manifest.json"
+    monkeypatch.setattr(pipeline, "PipelineManifest", lambda: PipelineManifest(manifest_path))
+    calls = []
+
+    def func(name, fail=False):
+        def run(handoff, **params):
+            calls.append(name)
+            if fail:
+                raise RuntimeError(f"{name} failed")
+        return run
+
+    stages = {
+        "a": Stage("a", func("a"), inputs=("source",), outputs=("x",)),
+        "b": Stage("b", func("b"), inputs=("x",), outputs=("y",)),
+        "c": Stage("c", func("c"), inputs=("source",), outputs=("z",), defaults={"k": 1}),
+        "broken": Stage("broken", func("broken", fail=True), inputs=("source",), outputs=("w",)),
+        "after_broken": Stage("after_broken", func("after_broken"), inputs=("w",), outputs=("v",)),
+    }
+    monkeypatch.setattr(pipeline, "STAGES", stages)
+    manifest = PipelineManifest(manifest_path)
+    manifest.record_datasets({"source": "v1"})
+    return manifest, calls
+
+
+def _run(stage_names, params=None, force=False):
+    ctx = _Context()
+    run_dag(ctx, stage_names, params or {}, force=force, max_parallel=2)
+    return ctx
+
+
+def test_unchanged_inputs_are_skipped(dag):
+    manifest, calls = dag
+    _run(["a", "b", "c"])
+    assert sorted(calls) == ["a", "b", "c"]
+    assert calls.index("a") < calls.index("b")
+
+    ctx = _run(["a", "b", "c"])
+    assert sorted(ctx.skipped) == ["a", "b", "c"] and ctx.ran == []
+
+    # 参数变化只影响使用该参数的阶段
+    ctx = _run(["a", "b", "c"], {"k": 2})
+    assert ctx.ran == ["c"]
+
+    # 源数据变化沿依赖链向下游传递
+    manifest.record_datasets({"source": "v2"})
+    ctx = _run(["a", "b", "c"], {"k": 2})
+    assert sorted(ctx.ran) == ["a", "b", "c"]
+
+    ctx = _run(["a", "b", "c"], {"k": 2}, force=True)
+    assert sorted(ctx.ran) == ["a", "b", "c"] and ctx.skipped == []
+
+
+def test_unknown_input_fingerprint_always_runs(dag):
+    manifest, calls = dag
+    manifest.reset_sources({})
+    _run(["a"])
+    _run(["a"])
+    assert calls == ["a", "a"]
+
+
+def test_failure_stops_downstream_and_is_recorded(dag):
+    manifest, calls = dag
+    with pytest.raises(RuntimeError, match="broken failed"):
+        _run(["broken", "after_broken"])
+    assert calls == ["broken"]
+    run = manifest.snapshot()['runs'][-1]
+    assert run['state'] == "failed" and "error" in run['stages']["broken"]
+    assert "broken" not in manifest.snapshot()['stages']
@@ -0,0 +1,64 @@
+import pandas as pd
+import pytest
+from sqlalchemy import text
+
+from src.database import create_schema, get_engine
+from src.id_dictionary import build_id_dictionary
+from src.recommendation import popularity
+from src.recommendation.popularity import PopularityFallback
+from src.response_cache import bump_data_version
+
+
+def _popular(segment_type, segment_value, items):
+    return pd.DataFrame({"segment_type": segment_type, "segment_value": segment_value, "item_id": items,
+                         "category": "c", "score": range(len(items), 0, -1), "rank": range(1, len(items) + 1)})
+
+
+@pytest.fixture
+def fallback(monkeypatch):
+    engine = get_engine("bulk_write")
+    create_schema(engine)
+    with engine.begin() as conn:
+        pd.concat([_popular("global", "global", ["g1", "g2"]),
+                   _popular("cluster_label", "1", ["c1", "c2"]),
+                   _popular("consumption_level", "高消费", ["h1"])]).to_sql(
+            "popular_items_segment", conn, if_exists="append", index=False)
+        conn.execute(text("INSERT INTO usr_persona (user_id, cluster_label, consumption_level) "
+                          "VALUES ('u1', 1, '高消费'), ('u2', 7, '高消费'), ('u3', NULL, NULL)"))
+    build_id_dictionary(pd.Series(["u1", "u2", "u3", "u4"]), pd.Series(["g1", "g2", "c1", "c2", "h1"]))
+    monkeypatch.setattr(popularity, "RELOAD_INTERVAL", 0.0)
+    fallback = PopularityFallback()
+    fallback.refresh(force=True)
+    return fallback
+
+
+def test_segment_priority_per_user(fallback):
+    assert fallback.get("u1", 1) == ([{"item_id": "c1", "category": "c", "score": 1.0, "rank": 1}],
+                                     "cluster_label:1")
+    # 聚类 7 没有榜单，退到消费等级
+    assert fallback.get("u2")[1] == "consumption_level:高消费"
+    # 未建画像、画像各维度为空、不在字典中的用户都使用全局榜
+    for user_id in ("u4", "u3", "cold"):
+        items, segment = fallback.get(user_id)
+        assert segment == "global" and [item["item_id"] for item in items] == ["g1", "g2"]
+
+
+def test_lookup_does_not_touch_database(fallback, monkeypatch):
+    def no_database(*args, **kwargs):
+        raise AssertionError("兜底查询不应访问数据库")
+
+    monkeypatch.setattr(popularity, "get_engine", no_database)
+    monkeypatch.setattr(popularity, "RELOAD_INTERVAL", 3600.0)
+    assert [fallback.get(user_id)[1] for user_id in ("u1", "u2", "u4")] == [
+        "cluster_label:1", "consumption_level:高消费", "global"]
+
+
+def test_version_bump_reloads_in_background(fallback):
+    with get_engine("bulk_write").begin() as conn:
+        conn.execute(text("DELETE FROM popular_items_segment WHERE segment_type = 'cluster_label'"))
+    bump_data_version("popular_items_segment")
+
+    # 请求线程不等待加载，仍使用旧榜单
+    assert fallback.get("u1")[1] == "cluster_label:1"
+    fallback._loader.join(timeout=10)
+    assert fallback.get("u1")[1] == "consumption_level:高消费"
@@ -0,0 +1,36 @@
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from src import profiler
+from src.profiler import PROFILE_DIR, request_profiling, reset_request_profiling, route_enabled
+
+
+@pytest.fixture
+def client():
+    PROFILE_DIR.mkdir(parents=True, exist_ok=True)
+    (PROFILE_DIR / "sample.summary.txt").write_text("summary", encoding='utf-8')
+    # 不进入 lifespan：这里只测试剖析相关接口
+    return TestClient(main.app)
+
+
+@pytest.mark.parametrize("allowed", [False, True])
+def test_request_trigger_requires_switch(monkeypatch, allowed):
+    monkeypatch.setattr(profiler, "PROFILE_ALLOW_REQUEST", allowed)
+    token = request_profiling(True)
+    try:
+        assert route_enabled("/api/recommend/{user_id}") is allowed
+    finally:
+        reset_request_profiling(token)
+
+
+def test_profile_endpoints_closed_by_default(client):
+    assert client.get("/api/profiles").status_code == 403
+    assert client.get("/api/profiles/sample.summary.txt").status_code == 403
+
+
+def test_profile_endpoints_behind_switch(client, monkeypatch):
+    monkeypatch.setattr(main, "PROFILE_ALLOW_REQUEST", True)
+    assert client.get("/api/profiles").status_code == 200
+    response = client.get("/api/profiles/sample.summary.txt")
+    assert response.status_code == 200 and response.text == "summary"
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.ensemble import RandomForestClassifier
+
+from src.recommendation import rf_ranker
+from src.recommendation.rf_ranker import RF_SEED, _grow_forest
+
+
+def _data(seed, n=400):
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(rng.normal(size=(n, 4)), columns=['a', 'b', 'c', 'd'])
+    y = pd.Series((X['a'] + rng.normal(scale=0.5, size=n) > 0).astype(int))
+    return X, y
+
+
+@pytest.fixture
+def small_budget(monkeypatch):
+    monkeypatch.setattr(rf_ranker, "RF_TREE_BUDGET", 10)
+    monkeypatch.setattr(rf_ranker, "RF_INCREMENTAL_TREES", 4)
+
+
+@pytest.fixture
+def base_forest(small_budget):
+    X, y = _data(0)
+    return RandomForestClassifier(n_estimators=10, max_depth=4, random_state=RF_SEED).fit(X, y)
+
+
+def test_grow_forest_keeps_budget_and_retires_oldest(base_forest):
+    X, y = _data(1)
+    original = list(base_forest.estimators_)
+
+    grown = _grow_forest(base_forest, X, y, seed=RF_SEED + 1)
+
+    assert len(grown.estimators_) == 10
+    assert grown.n_estimators == 10
+    assert grown.warm_start is False
+    # 最早的 4 棵被淘汰，其余 6 棵原样保留在前面，新树追加在末尾
+    kept = [t.tree_.node_count for t in grown.estimators_[:6]]
+    assert kept == [t.tree_.node_count for t in original[4:]]
+    # 上一版本模型不受影响
+    assert base_forest.estimators_ == original
+    assert grown.predict_proba(X).shape == (len(X), 2)
+
+
+def test_successive_updates_use_different_tree_seeds(base_forest):
+    X, y = _data(1)
+    first = _grow_forest(base_forest, X, y, seed=RF_SEED + 1)
+    second = _grow_forest(first, X, y, seed=RF_SEED + 2)
+
+    new_first = {t.random_state for t in first.estimators_[-4:]}
+    new_second = {t.random_state for t in second.estimators_[-4:]}
+    assert new_first.isdisjoint(new_second)
+
+
+def test_class_counts_ignore_unlabelled_rows(tmp_path, monkeypatch):
+    from sqlalchemy import create_engine, text
+
+    # 独立的替身库，不受其他用例写入的行为数据影响
+    engine = create_engine(f"sqlite:///{tmp_path / 'rf.db'}")
+    with engine.begin() as conn:
+        pd.DataFrame({'behavior_id': [1, 2, 3, 4, 5], 'user_id': 'u1',
+                      'label': [1, 0, None, 1, None]}).to_sql('fact_user_behavior', conn, index=False)
+        pd.DataFrame({'user_id': ['u1']}).to_sql('usr_persona', conn, index=False)
+    monkeypatch.setattr(rf_ranker, "read_analytics",
+                        lambda query, tables, params=None: pd.read_sql(text(query), engine, params=params))
+
+    assert rf_ranker._class_counts(since=2) == (1, 0, 3)
@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+
+from src.recommendation.rf_ranker import _SequentialSampler
+
+
+def _chunks(rng, total):
+    sizes = []
+    while total > 0:
+        n = int(min(total, rng.integers(0, 300)))
+        sizes.append(n)
+        total -= n
+    return sizes
+
+
+@pytest.mark.parametrize("total,size", [(1000, 0), (1000, 1), (1000, 137), (1000, 1000), (50, 200), (0, 10)])
+def test_selects_exactly_size_rows(total, size):
+    rng = np.random.default_rng(total + size)
+    for _ in range(20):
+        sampler = _SequentialSampler(total, size, rng)
+        masks = [sampler.take(n) for n in _chunks(rng, total)]
+        selected = np.concatenate(masks) if masks else np.zeros(0, dtype=bool)
+        assert len(selected) == total
+        assert selected.sum() == min(size, total)
+
+
+def test_every_row_equally_likely():
+    rng = np.random.default_rng(0)
+    total, size, trials = 200, 20, 4000
+    hits = np.zeros(total)
+    for _ in range(trials):
+        sampler = _SequentialSampler(total, size, rng)
+        hits += np.concatenate([sampler.take(n) for n in (13, 0, 87, 100)])
+    # 每行的入选概率为 size / total = 0.1
+    assert np.abs(hits / trials - size / total).max() < 0.03
+
+
+def test_more_rows_than_expected():
+    # 两次查询之间数据增加：以实际行数为准，不会选出超过 size 行
+    sampler = _SequentialSampler(100, 10, np.random.default_rng(1))
+    selected = np.concatenate([sampler.take(80), sampler.take(80)])
+    assert selected.sum() <= 10
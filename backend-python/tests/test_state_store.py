@@ -0,0 +1,124 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+
+from src import state_store
+from src.state_store import DBStateStore, FileStateStore, make_state_store
+
+
+@pytest.fixture
+def db_store(tmp_path):
+    return DBStateStore(create_engine(f"sqlite:///{tmp_path / 'state.db'}"))
+
+
+@pytest.fixture(params=["file", "db"])
+def store(request, tmp_path):
+    if request.param == "file":
+        return FileStateStore(root=tmp_path / "jobs", version_path=tmp_path / "version.json")
+    return DBStateStore(create_engine(f"sqlite:///{tmp_path / 'state.db'}"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """可拨动的 time.time()，用于模拟租约到期"""
+    now = [1000.0]
+    monkeypatch.setattr(state_store.time, "time", lambda: now[0])
+    return now
+
+
+def test_lock_is_exclusive_until_released(store, clock):
+    assert store.acquire_lock("pipeline", "job-a", ttl=60) == (True, "job-a")
+    assert store.acquire_lock("pipeline", "job-b", ttl=60) == (False, "job-a")
+    assert store.lock_holder("pipeline") == "job-a"
+
+    # 非持有者的续约与释放无效
+    assert store.refresh_lock("pipeline", "job-b", ttl=60) is False
+    store.release_lock("pipeline", "job-b")
+    assert store.lock_holder("pipeline") == "job-a"
+
+    store.release_lock("pipeline", "job-a")
+    assert store.lock_holder("pipeline") is None
+    assert store.acquire_lock("pipeline", "job-b", ttl=60) == (True, "job-b")
+
+
+def test_expired_lease_is_reclaimed(store, clock):
+    store.acquire_lock("pipeline", "job-a", ttl=60)
+    clock[0] += 30
+    assert store.refresh_lock("pipeline", "job-a", ttl=60) is True
+    clock[0] += 59
+    # 续约后租约从续约时刻起算，尚未到期
+    assert store.acquire_lock("pipeline", "job-b", ttl=60) == (False, "job-a")
+
+    clock[0] += 2
+    assert store.lock_holder("pipeline") is None
+    assert store.acquire_lock("pipeline", "job-b", ttl=60) == (True, "job-b")
+    # 原持有者的续约失败，应停止工作
+    assert store.refresh_lock("pipeline", "job-a", ttl=60) is False
+
+
+def test_stale_owner_is_reclaimed_before_expiry(store, clock):
+    store.acquire_lock("pipeline", "job-a", ttl=3600)
+    assert store.acquire_lock("pipeline", "job-b", ttl=60, is_stale=lambda owner: False) == (False, "job-a")
+    checked = []
+
+    def finished(owner):
+        checked.append(owner)
+        return owner == "job-a"
+
+    assert store.acquire_lock("pipeline", "job-b", ttl=60, is_stale=finished) == (True, "job-b")
+    assert checked == ["job-a"]
+
+
+def test_db_backend_requires_shared_runtime(monkeypatch):
+    monkeypatch.delenv("STATE_SHARED_RUNTIME", raising=False)
+    with pytest.raises(ValueError, match="STATE_SHARED_RUNTIME"):
+        make_state_store("db")
+    monkeypatch.setenv("STATE_SHARED_RUNTIME", "1")
+    assert make_state_store("db").backend == "db"
+
+
+def test_bump_data_version(db_store):
+    assert db_store.get_data_version() == 0
+    assert db_store.bump_data_version("ingest") == 1
+    assert db_store.bump_data_version("persona") == 2
+
+
+def test_bump_data_version_reraises_after_retry(db_store, monkeypatch):
+    db_store.tables
+    attempts = []
+
+    class ConflictingEngine:
+        def begin(self):
+            attempts.append(1)
+            raise IntegrityError("INSERT INTO sys_data_version", {}, Exception("duplicate key"))
+
+    monkeypatch.setattr(db_store, "engine", ConflictingEngine())
+    with pytest.raises(IntegrityError):
+        db_store.bump_data_version("ingest")
+    assert len(attempts) == 2
+
+
+def test_concurrent_json_writes_use_distinct_temp_files(tmp_path):
+    import json
+    import threading
+
+    path = tmp_path / "version.json"
+    errors = []
+
+    def writer(n):
+        try:
+            for i in range(50):
+                state_store._write_json(path, {"writer": n, "i": i})
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    assert errors == []
+    assert json.loads(path.read_text(encoding='utf-8'))['i'] == 49
+    # 临时文件全部被替换或清理
+    assert [p.name for p in tmp_path.iterdir()] == ["version.json"]